@@ -2,8 +2,12 @@
 Vercel Serverless Function - Native Handler Format
 """
 from http.server import BaseHTTPRequestHandler
+import time
+_module_started = time.perf_counter()
 import os
 import json
+import hashlib
+import threading
 from datetime import datetime
 from urllib.parse import urlparse, parse_qs
 
@@ -11,47 +15,298 @@ from urllib.parse import urlparse, parse_qs
 SUPABASE_URL = os.environ.get('SUPABASE_URL', '')
 SUPABASE_KEY = os.environ.get('SUPABASE_KEY', '')
 
-# Initialize Supabase
+# The Supabase client is created on first use and reused by every request of
+# this instance. Importing the SDK (httpx, postgrest, gotrue, storage, ...) is
+# most of a cold start, and /api/health and /api/metrics do not need it
 supabase_client = None
-if SUPABASE_URL and SUPABASE_KEY:
-    try:
-        from supabase import create_client
-        supabase_client = create_client(SUPABASE_URL, SUPABASE_KEY)
-    except Exception as e:
-        print(f"Supabase initialization error: {e}")
+_client_lock = threading.Lock()
+
+# Cold start timings of this instance (see /api/health and /api/metrics)
+_cold_start = {'module_import_seconds': None, 'client_init_seconds': None, 'requests': 0}
+
+
+def get_supabase_client():
+    """Supabase client of this instance, created on first call.
+    
+    Returns None if the credentials are missing or the client cannot be
+    created (the next call tries again)
+    """
+    global supabase_client
+    if supabase_client is not None or not (SUPABASE_URL and SUPABASE_KEY):
+        return supabase_client
+    with _client_lock:
+        if supabase_client is None:
+            started = time.perf_counter()
+            try:
+                from supabase import create_client
+                supabase_client = create_client(SUPABASE_URL, SUPABASE_KEY)
+            except Exception as e:
+                print(f"Supabase initialization error: {e}")
+                return None
+            _cold_start['client_init_seconds'] = time.perf_counter() - started
+    return supabase_client
+
+
+def _cold_start_info():
+    def ms(seconds):
+        return round(seconds * 1000, 1) if seconds is not None else None
+    return {
+        'module_import_ms': ms(_cold_start['module_import_seconds']),
+        'client_init_ms': ms(_cold_start['client_init_seconds']),
+        'requests_served': _cold_start['requests'],
+    }
+
+# Order matches the slot_mask bits: morning = 1, day = 2, evening = 4, night = 8
+TIME_SLOTS = ['morning', 'day', 'evening', 'night']
+
+
+def _decode_slots(slot_mask):
+    """Bitmask from daily_status.slot_mask -> list of slot names"""
+    return [slot for bit, slot in enumerate(TIME_SLOTS) if slot_mask & (1 << bit)]
+
+# Keyset pagination for player lists: ?limit=N&after=<telegram_id>&fields=a,b,c
+PLAYER_FIELDS = ('telegram_id', 'telegram_username', 'telegram_first_name',
+                 'valorant_nick', 'rank', 'roles', 'time_slots')
+PAGE_DEFAULT_LIMIT = 100
+PAGE_MAX_LIMIT = 500
+
+
+def _parse_page_params(query):
+    """Parse limit/after/fields query params. Raises ValueError on bad input"""
+    limit = int(query.get('limit', [PAGE_DEFAULT_LIMIT])[0])
+    if not 1 <= limit <= PAGE_MAX_LIMIT:
+        raise ValueError(f'limit must be between 1 and {PAGE_MAX_LIMIT}')
+    
+    after = int(query.get('after', ['0'])[0])
+    
+    fields_param = query.get('fields', [''])[0]
+    if fields_param:
+        fields = [field.strip() for field in fields_param.split(',') if field.strip()]
+        unknown = [field for field in fields if field not in PLAYER_FIELDS]
+        if unknown:
+            raise ValueError(f"Unknown fields: {', '.join(unknown)}")
+    else:
+        fields = list(PLAYER_FIELDS)
+    
+    # telegram_id is the pagination cursor, so it is always returned
+    if 'telegram_id' not in fields:
+        fields.insert(0, 'telegram_id')
+    return limit, after, fields
+
+
+def _fetch_players_page(today, limit, after, fields, timeslot=None):
+    """One page of players playing today, ordered by telegram_id.
+    
+    Returns (players, next_cursor); next_cursor is None on the last page
+    """
+    player_columns = ','.join(field for field in fields if field != 'time_slots')
+    query = supabase_client.table('daily_status')\
+        .select(f'telegram_id, slot_mask, players!inner({player_columns})')\
+        .eq('date', today)\
+        .eq('is_playing', True)\
+        .gt('telegram_id', after)
+    if timeslot:
+        query = query.contains('time_slots', [timeslot])
+    
+    # One extra row tells whether there is a next page
+    rows = query.order('telegram_id').limit(limit + 1).execute().data or []
+    
+    players = []
+    for item in rows[:limit]:
+        player_data = item['players'].copy()
+        if 'time_slots' in fields:
+            player_data['time_slots'] = _decode_slots(item.get('slot_mask') or 0)
+        players.append(player_data)
+    
+    next_cursor = rows[limit - 1]['telegram_id'] if len(rows) > limit else None
+    return players, next_cursor
+
+
+def _latest_change(today):
+    """updated_at of today's latest daily_status change (or midnight): the live feed cursor"""
+    response = supabase_client.table('daily_status')\
+        .select('updated_at')\
+        .eq('date', today)\
+        .order('updated_at', desc=True)\
+        .limit(1)\
+        .execute()
+    if response.data:
+        return response.data[0]['updated_at']
+    return f'{today}T00:00:00'
+
+
+# Short-lived cache of serialized responses, keyed by request path + query.
+# N dashboards polling the same endpoint cost one database round trip per TTL
+RESPONSE_CACHE_TTL = float(os.environ.get('RESPONSE_CACHE_TTL', 10))
+RESPONSE_CACHE_MAX_ENTRIES = 256
+_response_cache = {}
+
+
+def _cache_response(key, body):
+    """Store a response body; returns the (expires_at, body, etag) entry"""
+    now = time.monotonic()
+    if len(_response_cache) >= RESPONSE_CACHE_MAX_ENTRIES:
+        for stale_key in [k for k, entry in _response_cache.items() if entry[0] <= now]:
+            del _response_cache[stale_key]
+        while len(_response_cache) >= RESPONSE_CACHE_MAX_ENTRIES:
+            del _response_cache[next(iter(_response_cache))]
+    
+    etag = '"%s"' % hashlib.sha1(body).hexdigest()[:20]
+    entry = (now + RESPONSE_CACHE_TTL, body, etag)
+    _response_cache[key] = entry
+    return entry
+
+
+def _get_cached_response(key):
+    entry = _response_cache.get(key)
+    if entry and entry[0] > time.monotonic():
+        return entry
+    return None
+
+
+# Per-route request metrics of this instance, served on /api/metrics
+# in Prometheus text format
+LATENCY_BUCKETS = (0.01, 0.025, 0.05, 0.1, 0.25, 0.5, 1.0, 2.5, 5.0)
+_route_latency = {}   # route -> [bucket counts..., sum, count]
+_route_requests = {}  # (route, status) -> count
+
+
+def _route_name(path):
+    """Metric label for a request path (mirrors the routing in do_GET)"""
+    if 'metrics' in path:
+        return 'metrics'
+    if 'health' in path:
+        return 'health'
+    if 'stats' in path:
+        return 'stats'
+    if 'players/today' in path or path.endswith('/today'):
+        return 'players_today'
+    if 'players/timeslot' in path:
+        return 'players_timeslot'
+    return 'not_found'
+
+
+def _observe_request(route, status, seconds):
+    series = _route_latency.get(route)
+    if series is None:
+        series = _route_latency[route] = [0] * (len(LATENCY_BUCKETS) + 2)
+    for i, bound in enumerate(LATENCY_BUCKETS):
+        if seconds <= bound:
+            series[i] += 1
+    series[-2] += seconds
+    series[-1] += 1
+    _route_requests[(route, status)] = _route_requests.get((route, status), 0) + 1
+
+
+def _render_metrics():
+    lines = ['# TYPE api_request_duration_seconds histogram']
+    for route, series in sorted(_route_latency.items()):
+        for bound, count in zip(LATENCY_BUCKETS, series):
+            lines.append(f'api_request_duration_seconds_bucket{{route="{route}",le="{bound}"}} {count}')
+        lines.append(f'api_request_duration_seconds_bucket{{route="{route}",le="+Inf"}} {series[-1]}')
+        lines.append(f'api_request_duration_seconds_sum{{route="{route}"}} {round(series[-2], 6)}')
+        lines.append(f'api_request_duration_seconds_count{{route="{route}"}} {series[-1]}')
+    lines.append('# TYPE api_requests_total counter')
+    for (route, status), count in sorted(_route_requests.items()):
+        lines.append(f'api_requests_total{{route="{route}",status="{status}"}} {count}')
+    lines.append('# TYPE api_cold_start_seconds gauge')
+    for phase in ('module_import', 'client_init'):
+        seconds = _cold_start[f'{phase}_seconds']
+        if seconds is not None:
+            lines.append(f'api_cold_start_seconds{{phase="{phase}"}} {round(seconds, 6)}')
+    return '\n'.join(lines) + '\n'
+
+
+def _count_stats(today):
+    """Stats via HEAD requests with exact counts (no rows are transferred)"""
+    def playing_query():
+        return supabase_client.table('daily_status')\
+            .select('telegram_id', count='exact', head=True)\
+            .eq('date', today)\
+            .eq('is_playing', True)
+    
+    total = supabase_client.table('players').select('telegram_id', count='exact', head=True).execute()
+    playing = playing_query().execute()
+    slots = {
+        slot: playing_query().contains('time_slots', [slot]).execute().count or 0
+        for slot in TIME_SLOTS
+    }
+    return {
+        'total_players': total.count or 0,
+        'playing_today': playing.count or 0,
+        'slots': slots,
+    }
 
 
 class handler(BaseHTTPRequestHandler):
     """Vercel handler class"""
     
-    def _set_headers(self, status=200):
+    # Request path used as response cache key (None - do not cache)
+    _cache_key = None
+    
+    # Status of the response being sent (for /api/metrics)
+    _status = None
+    
+    def _set_headers(self, status=200, etag=None):
         """Set response headers"""
+        self._status = status
         self.send_response(status)
         self.send_header('Content-Type', 'application/json')
         self.send_header('Access-Control-Allow-Origin', '*')
         self.send_header('Access-Control-Allow-Methods', 'GET, POST, OPTIONS')
-        self.send_header('Access-Control-Allow-Headers', 'Content-Type')
+        self.send_header('Access-Control-Allow-Headers', 'Content-Type, If-None-Match')
+        self.send_header('Access-Control-Expose-Headers', 'ETag')
+        if etag:
+            ttl = int(RESPONSE_CACHE_TTL)
+            self.send_header('ETag', etag)
+            self.send_header('Cache-Control', f'public, max-age={ttl}, s-maxage={ttl}, stale-while-revalidate={ttl * 2}')
+        else:
+            self.send_header('Cache-Control', 'no-store')
         self.end_headers()
     
     def _send_json(self, data, status=200):
-        """Send JSON response"""
+        """Send JSON response (successful responses of cacheable routes are cached)"""
+        body = json.dumps(data).encode()
+        if status == 200 and self._cache_key:
+            _, body, etag = _cache_response(self._cache_key, body)
+            return self._send_cacheable(body, etag)
         self._set_headers(status)
-        self.wfile.write(json.dumps(data).encode())
+        self.wfile.write(body)
+    
+    def _send_cacheable(self, body, etag):
+        """Send 200 with ETag, or 304 without body if the client already has it"""
+        if_none_match = self.headers.get('If-None-Match', '')
+        if etag in [tag.strip() for tag in if_none_match.split(',')] or if_none_match.strip() == '*':
+            return self._set_headers(304, etag=etag)
+        self._set_headers(200, etag=etag)
+        self.wfile.write(body)
     
     def do_OPTIONS(self):
         """Handle CORS preflight"""
         self._set_headers(200)
     
     def do_GET(self):
-        """Handle GET requests"""
-        
+        """Handle GET requests (timed per route, see /api/metrics)"""
+        route = _route_name(urlparse(self.path).path)
+        started = time.perf_counter()
+        try:
+            self._route_request(route)
+        finally:
+            _cold_start['requests'] += 1
+            _observe_request(route, self._status or 500, time.perf_counter() - started)
+    
+    def _route_request(self, route):
         # Parse path
         parsed = urlparse(self.path)
         path = parsed.path
         query = parse_qs(parsed.query)
         
-        # Check Supabase connection
-        if not supabase_client:
+        if route == 'metrics':
+            return self._handle_metrics()
+        
+        # Check Supabase connection (health checks do not load the SDK)
+        configured = bool(SUPABASE_URL and SUPABASE_KEY)
+        if not configured or (route != 'health' and not get_supabase_client()):
             return self._send_json({
                 'success': False,
                 'error': 'Database not configured',
@@ -59,18 +314,25 @@ class handler(BaseHTTPRequestHandler):
                 'has_key': bool(SUPABASE_KEY)
             }, 500)
         
+        # Everything except health checks is served from the response cache when fresh
+        if route != 'health':
+            self._cache_key = self.path
+            cached = _get_cached_response(self._cache_key)
+            if cached:
+                return self._send_cacheable(cached[1], cached[2])
+        
         try:
             # Route to appropriate handler
-            if 'health' in path:
+            if route == 'health':
                 self._handle_health()
-            elif 'stats' in path:
+            elif route == 'stats':
                 self._handle_stats()
-            elif 'players/today' in path or path.endswith('/today'):
-                self._handle_players_today()
-            elif 'players/timeslot' in path:
+            elif route == 'players_today':
+                self._handle_players_today(query)
+            elif route == 'players_timeslot':
                 # Новый endpoint для фильтрации по временному слоту
                 timeslot = query.get('slot', [''])[0]
-                self._handle_players_by_timeslot(timeslot)
+                self._handle_players_by_timeslot(timeslot, query)
             else:
                 self._send_json({
                     'success': False,
@@ -84,37 +346,46 @@ class handler(BaseHTTPRequestHandler):
                 'error_type': type(e).__name__
             }, 500)
     
+    def _handle_metrics(self):
+        """Request metrics of this instance in Prometheus text format"""
+        body = _render_metrics().encode()
+        self._status = 200
+        self.send_response(200)
+        self.send_header('Content-Type', 'text/plain; version=0.0.4')
+        self.send_header('Cache-Control', 'no-store')
+        self.end_headers()
+        self.wfile.write(body)
+    
     def _handle_health(self):
         """Health check endpoint"""
         self._send_json({
             'success': True,
             'status': 'healthy',
             'timestamp': datetime.now().isoformat(),
-            'supabase_connected': bool(supabase_client),
+            'supabase_configured': bool(SUPABASE_URL and SUPABASE_KEY),
+            # The client is created by the first data request of this instance
+            'supabase_connected': supabase_client is not None,
+            'cold_start': _cold_start_info(),
             'url_preview': SUPABASE_URL[:30] + '...' if len(SUPABASE_URL) > 30 else SUPABASE_URL
         })
     
     def _handle_stats(self):
-        """Get statistics"""
+        """Get statistics (counts only, one round trip via RPC)"""
         try:
             today = datetime.now().date().isoformat()
             
-            # Total players
-            total_response = supabase_client.table('players').select('telegram_id').execute()
-            total_players = len(total_response.data) if total_response.data else 0
-            
-            # Playing today
-            playing_response = supabase_client.table('daily_status')\
-                .select('telegram_id')\
-                .eq('date', today)\
-                .eq('is_playing', True)\
-                .execute()
-            playing_today = len(playing_response.data) if playing_response.data else 0
+            try:
+                stats = supabase_client.rpc('team_finder_stats', {'p_date': today}).execute().data
+            except Exception as e:
+                # migrations/004_stats.sql not applied - use exact-count HEAD requests
+                print(f"team_finder_stats RPC failed, falling back to count queries: {e}")
+                stats = _count_stats(today)
             
             self._send_json({
                 'success': True,
-                'total_players': total_players,
-                'playing_today': playing_today,
+                'total_players': stats['total_players'],
+                'playing_today': stats['playing_today'],
+                'slots': stats['slots'],
                 'date': today
             })
         except Exception as e:
@@ -124,39 +395,36 @@ class handler(BaseHTTPRequestHandler):
                 'error_type': type(e).__name__
             }, 500)
     
-    def _handle_players_by_timeslot(self, timeslot):
-        """Get players by specific timeslot"""
+    def _send_page_params_error(self, error):
+        return self._send_json({
+            'success': False,
+            'error': f'Invalid pagination parameters: {error}'
+        }, 400)
+    
+    def _handle_players_by_timeslot(self, timeslot, query):
+        """Get players by specific timeslot (paginated)"""
         try:
-            today = datetime.now().date().isoformat()
-            
-            if not timeslot or timeslot not in ['morning', 'day', 'evening', 'night']:
+            if not timeslot or timeslot not in TIME_SLOTS:
                 return self._send_json({
                     'success': False,
                     'error': 'Invalid timeslot. Must be: morning, day, evening, or night'
                 }, 400)
             
-            # Query with timeslot filter
-            response = supabase_client.table('daily_status')\
-                .select('telegram_id, time_slots, players(*)')\
-                .eq('date', today)\
-                .eq('is_playing', True)\
-                .contains('time_slots', [timeslot])\
-                .execute()
+            try:
+                limit, after, fields = _parse_page_params(query)
+            except ValueError as e:
+                return self._send_page_params_error(e)
             
-            players = []
-            if response.data:
-                for item in response.data:
-                    if item.get('players'):
-                        player_data = item['players'].copy()
-                        player_data['time_slots'] = item.get('time_slots', [])
-                        players.append(player_data)
+            today = datetime.now().date().isoformat()
+            players, next_cursor = _fetch_players_page(today, limit, after, fields, timeslot)
             
             self._send_json({
                 'success': True,
                 'date': today,
                 'timeslot': timeslot,
                 'count': len(players),
-                'players': players
+                'players': players,
+                'next_cursor': next_cursor
             })
         except Exception as e:
             self._send_json({
@@ -165,31 +433,27 @@ class handler(BaseHTTPRequestHandler):
                 'error_type': type(e).__name__
             }, 500)
     
-    def _handle_players_today(self):
-        """Get players playing today with time slots"""
+    def _handle_players_today(self, query):
+        """Get players playing today with time slots (paginated)"""
         try:
-            today = datetime.now().date().isoformat()
-            
-            # Query with join
-            response = supabase_client.table('daily_status')\
-                .select('telegram_id, time_slots, players(*)')\
-                .eq('date', today)\
-                .eq('is_playing', True)\
-                .execute()
+            try:
+                limit, after, fields = _parse_page_params(query)
+            except ValueError as e:
+                return self._send_page_params_error(e)
             
-            players = []
-            if response.data:
-                for item in response.data:
-                    if item.get('players'):
-                        player_data = item['players'].copy()
-                        player_data['time_slots'] = item.get('time_slots', [])
-                        players.append(player_data)
+            today = datetime.now().date().isoformat()
+            # The first page may be served from the caches for a while; the cursor
+            # read before it lets /api/live?since= replay everything changed after it
+            live_cursor = _latest_change(today) if after == 0 else None
+            players, next_cursor = _fetch_players_page(today, limit, after, fields)
             
             self._send_json({
                 'success': True,
                 'date': today,
                 'count': len(players),
-                'players': players
+                'players': players,
+                'next_cursor': next_cursor,
+                'live_cursor': live_cursor
             })
         except Exception as e:
             self._send_json({
@@ -197,3 +461,6 @@ class handler(BaseHTTPRequestHandler):
                 'error': str(e),
                 'error_type': type(e).__name__
             }, 500)
+
+
+_cold_start['module_import_seconds'] = time.perf_counter() - _module_started
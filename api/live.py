@@ -0,0 +1,236 @@
+"""
+Vercel Serverless Function - Server-Sent Events roster feed
+
+Streams incremental changes of today's roster instead of the full list:
+    event: join / update  -> player (with time_slots) joined or changed plan
+    event: leave          -> {"telegram_id": ...} is no longer playing today
+Each event id is the daily_status.updated_at cursor, so a reconnecting
+EventSource resumes from Last-Event-ID. A new stream starts from `?since=`
+(the live_cursor of the roster snapshot the page loaded), so changes made
+after the snapshot are replayed even if the snapshot came from a cache.
+
+All streams of one instance share a single poll of daily_status (ChangeFeed).
+That only helps where one process serves many streams - the long-lived local
+server below, or a warm instance that gets concurrent requests. On Vercel
+each open stream usually gets its own instance, so every viewer costs one
+cursor read per connection plus one indexed changes query per
+LIVE_POLL_SECONDS.
+
+Serverless invocations are short, so a stream lasts LIVE_STREAM_SECONDS and
+the browser reconnects. For local development run `python api/live.py`:
+it serves the dashboard, the JSON API and a long-lived stream on PORT.
+"""
+from http.server import BaseHTTPRequestHandler, ThreadingHTTPServer
+import os
+import sys
+import json
+import time
+import threading
+from datetime import datetime, timedelta
+from urllib.parse import urlparse, parse_qs
+
+sys.path.insert(0, os.path.dirname(os.path.abspath(__file__)))
+import index as api  # noqa: E402
+
+LIVE_STREAM_SECONDS = float(os.environ.get('LIVE_STREAM_SECONDS', 8))
+# Per viewer on serverless (see above): keep it well above a round trip
+LIVE_POLL_SECONDS = float(os.environ.get('LIVE_POLL_SECONDS', 5))
+# Re-read this many seconds before the cursor so late commits are not missed;
+# clients apply events idempotently, so repeats are harmless
+LIVE_OVERLAP_SECONDS = 10
+LIVE_BATCH_SIZE = 500
+LIVE_PLAYER_FIELDS = 'telegram_id,telegram_username,valorant_nick,rank,roles'
+
+
+def _shift(cursor, seconds):
+    return (datetime.fromisoformat(cursor) + timedelta(seconds=seconds)).isoformat()
+
+
+def _parse_cursor(value):
+    """Client-supplied cursor (Last-Event-ID or ?since=) if it is an ISO timestamp, else None"""
+    if not value or len(value) > 64:
+        return None
+    try:
+        datetime.fromisoformat(value)
+    except ValueError:
+        return None
+    return value
+
+
+def _fetch_changes(today, since):
+    """daily_status rows of today changed after `since`, oldest first"""
+    response = api.supabase_client.table('daily_status')\
+        .select(f'telegram_id, is_playing, slot_mask, updated_at, players!inner({LIVE_PLAYER_FIELDS})')\
+        .eq('date', today)\
+        .gt('updated_at', since)\
+        .order('updated_at')\
+        .limit(LIVE_BATCH_SIZE)\
+        .execute()
+    return response.data or []
+
+
+class ChangeFeed:
+    """
+    Today's roster changes, polled at most once per LIVE_POLL_SECONDS per
+    instance and shared by every open stream
+
+    Keeps the latest daily_status row of each player changed since the
+    feed started (at most one row per player, reset at midnight). A stream
+    whose Last-Event-ID is older than that reads the database itself once.
+    """
+
+    def __init__(self, poll_seconds=LIVE_POLL_SECONDS):
+        self.poll_seconds = poll_seconds
+        self.polls = 0
+        self._lock = threading.Lock()
+        self._reset(None)
+
+    def _reset(self, today):
+        self.today = today
+        self.origin = None   # cursor when the feed started
+        self.cursor = None   # latest updated_at seen
+        self._rows = {}      # telegram_id -> latest row
+        self._polled_at = float('-inf')
+
+    def _refresh(self, today):
+        if today != self.today:
+            self._reset(today)
+        if self.cursor is None:
+            self.origin = self.cursor = api._latest_change(today)
+        if time.monotonic() - self._polled_at < self.poll_seconds:
+            return
+        for row in _fetch_changes(today, _shift(self.cursor, -LIVE_OVERLAP_SECONDS)):
+            self._rows[row['telegram_id']] = row
+            self.cursor = max(self.cursor, row['updated_at'])
+        self._polled_at = time.monotonic()
+        self.polls += 1
+
+    def latest(self, today):
+        """Cursor for a fresh connection: the latest change of today (or midnight)"""
+        with self._lock:
+            if today != self.today or self.cursor is None:
+                self._refresh(today)
+            return self.cursor
+
+    def changes(self, today, since):
+        """Rows changed after `since`, oldest first; None if `since` is older than the feed"""
+        with self._lock:
+            if self.today is not None and today < self.today:
+                # Stream opened before midnight: the feed already follows the new day
+                return None
+            self._refresh(today)
+            if since < _shift(self.origin, -LIVE_OVERLAP_SECONDS):
+                return None
+            rows = [row for row in self._rows.values() if row['updated_at'] > since]
+        return sorted(rows, key=lambda row: row['updated_at'])
+
+
+_feed = ChangeFeed()
+
+
+def _write_event(request_handler, event, data, event_id):
+    payload = f'id: {event_id}\nevent: {event}\ndata: {json.dumps(data)}\n\n'
+    request_handler.wfile.write(payload.encode())
+
+
+def stream_roster(request_handler, duration):
+    """Write roster diffs to an SSE response for `duration` seconds"""
+    request_handler.send_response(200)
+    request_handler.send_header('Content-Type', 'text/event-stream')
+    request_handler.send_header('Cache-Control', 'no-cache')
+    request_handler.send_header('Connection', 'keep-alive')
+    request_handler.send_header('Access-Control-Allow-Origin', '*')
+    request_handler.send_header('X-Accel-Buffering', 'no')
+    request_handler.end_headers()
+
+    if not api.get_supabase_client():
+        request_handler.wfile.write(b'event: error\ndata: {"error": "Database not configured"}\n\n')
+        return
+
+    today = datetime.now().date().isoformat()
+    query = parse_qs(urlparse(request_handler.path).query)
+    # telegram_id -> (is_playing, slot_mask, updated_at) already sent on this connection
+    sent = {}
+
+    try:
+        request_handler.wfile.write(f'retry: {int(LIVE_POLL_SECONDS * 1000)}\n\n'.encode())
+        cursor = (_parse_cursor(request_handler.headers.get('Last-Event-ID'))
+                  or _parse_cursor(query.get('since', [''])[0])
+                  or _feed.latest(today))
+        deadline = time.monotonic() + duration
+        while True:
+            since = _shift(cursor, -LIVE_OVERLAP_SECONDS)
+            rows = _feed.changes(today, since)
+            if rows is None:
+                # Resuming from before this instance started: catch up from the database,
+                # after that the shared feed has everything
+                rows = _fetch_changes(today, since)
+                if len(rows) < LIVE_BATCH_SIZE and _feed.today == today:
+                    cursor = max(cursor, _feed.origin)
+            for row in rows:
+                telegram_id = row['telegram_id']
+                state = (row['is_playing'], row['slot_mask'], row['updated_at'])
+                if sent.get(telegram_id) == state:
+                    continue
+
+                if row['is_playing'] and row['slot_mask']:
+                    event = 'update' if telegram_id in sent else 'join'
+                    data = row['players'].copy()
+                    data['time_slots'] = api._decode_slots(row['slot_mask'])
+                else:
+                    event = 'leave'
+                    data = {'telegram_id': telegram_id}
+
+                sent[telegram_id] = state
+                cursor = max(cursor, row['updated_at'])
+                _write_event(request_handler, event, data, cursor)
+
+            request_handler.wfile.write(b': keepalive\n\n')
+            request_handler.wfile.flush()
+
+            if time.monotonic() + LIVE_POLL_SECONDS >= deadline:
+                break
+            time.sleep(LIVE_POLL_SECONDS)
+    except (BrokenPipeError, ConnectionResetError):
+        # Browser closed the page
+        pass
+    except Exception as e:
+        # Database error: end the stream, the browser reconnects after `retry`
+        try:
+            request_handler.wfile.write(f'event: error\ndata: {json.dumps({"error": str(e)})}\n\n'.encode())
+        except (BrokenPipeError, ConnectionResetError):
+            pass
+
+
+class handler(BaseHTTPRequestHandler):
+    """Vercel handler class"""
+
+    def do_GET(self):
+        stream_roster(self, LIVE_STREAM_SECONDS)
+
+
+class LocalHandler(api.handler):
+    """Local development server: dashboard + JSON API + long-lived SSE stream"""
+
+    dashboard_path = os.path.join(os.path.dirname(os.path.dirname(os.path.abspath(__file__))), 'index2.html')
+
+    def do_GET(self):
+        path = urlparse(self.path).path
+        if path == '/api/live':
+            return stream_roster(self, float(os.environ.get('LIVE_STREAM_SECONDS', 300)))
+        if path in ('/', '/index.html'):
+            with open(self.dashboard_path, 'rb') as f:
+                body = f.read()
+            self.send_response(200)
+            self.send_header('Content-Type', 'text/html; charset=utf-8')
+            self.end_headers()
+            self.wfile.write(body)
+            return
+        return super().do_GET()
+
+
+if __name__ == '__main__':
+    port = int(os.environ.get('PORT', 8000))
+    server = ThreadingHTTPServer(('0.0.0.0', port), LocalHandler)
+    print(f"Local server on http://localhost:{port}")
+    server.serve_forever()
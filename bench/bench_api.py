@@ -0,0 +1,117 @@
+"""
+Бенчмарк API веб-приложения (api/index.py) на базе в памяти
+
+Заполняет списки игроков нескольких размеров и вызывает обработчик в том же
+процессе (без сокетов) - с выключенным и с включённым кэшем ответов.
+Показывает задержку p50 / p99 и число запросов к базе на один запрос к API.
+
+    python bench/bench_api.py
+    python bench/bench_api.py --sizes 100,1000 --requests 200 --latency 0.005
+"""
+import io
+import json
+import time
+import argparse
+import importlib
+from datetime import datetime
+from email.message import Message
+
+import common
+from fake_supabase import FakeClient, seed
+
+ENDPOINTS = (
+    ('health', '/api/health'),
+    ('stats', '/api/stats'),
+    ('players_today', '/api/players/today?limit=100'),
+    ('players_timeslot', '/api/players/timeslot?slot=evening&limit=100'),
+)
+WALK_PAGE_SIZE = 200
+
+
+def call(api, path):
+    """Выполнить GET через api.handler без сервера; возвращает (статус, тело)"""
+    request = api.handler.__new__(api.handler)
+    request.path = path
+    request.command = 'GET'
+    request.request_version = 'HTTP/1.1'
+    request.requestline = f'GET {path}'
+    request.client_address = ('bench', 0)
+    request.headers = Message()
+    request.wfile = io.BytesIO()
+    request.log_message = lambda *args: None
+    request.do_GET()
+    return request._status, request.wfile.getvalue()
+
+
+def walk_roster(api):
+    """Прочитать весь список постранично (keyset); возвращает число страниц"""
+    after, pages = 0, 0
+    while True:
+        status, body = call(api, f'/api/players/today?limit={WALK_PAGE_SIZE}&after={after}')
+        assert status == 200, body[:200]
+        pages += 1
+        payload = body.split(b'\r\n\r\n', 1)[-1]
+        cursor = json.loads(payload)['next_cursor']
+        if cursor is None:
+            return pages
+        after = cursor
+
+
+def run(sizes, requests, latency, cache_ttl):
+    api = importlib.import_module('index')
+    api.RESPONSE_CACHE_TTL = cache_ttl
+    today = datetime.now().date().isoformat()
+    rows = []
+
+    for size in sizes:
+        client = seed(FakeClient(latency=latency), size, today)
+        api.supabase_client = client
+        api._response_cache.clear()
+
+        for name, path in ENDPOINTS:
+            samples = []
+            trips_before, server_before = client.round_trips, client.server_seconds
+            for _ in range(requests):
+                started = time.perf_counter()
+                status, body = call(api, path)
+                samples.append(time.perf_counter() - started)
+                assert status == 200, body[:200]
+            summary = common.summarize(samples)
+            trips = (client.round_trips - trips_before) / requests
+            server_ms = (client.server_seconds - server_before) / requests * 1000
+            rows.append([size, name, summary['p50_ms'], summary['p99_ms'], round(trips, 2), round(server_ms, 2)])
+
+        samples = []
+        trips_before, server_before = client.round_trips, client.server_seconds
+        pages = 0
+        for _ in range(max(1, requests // 10)):
+            api._response_cache.clear()
+            started = time.perf_counter()
+            pages = walk_roster(api)
+            samples.append(time.perf_counter() - started)
+        summary = common.summarize(samples)
+        trips = (client.round_trips - trips_before) / len(samples)
+        server_ms = (client.server_seconds - server_before) / len(samples) * 1000
+        rows.append([size, f'full walk ({pages} pages)', summary['p50_ms'], summary['p99_ms'],
+                     round(trips, 2), round(server_ms, 2)])
+
+    title = f"API, cache {'off' if cache_ttl <= 0 else f'{cache_ttl:g}s'}, db latency {latency * 1000:g} ms"
+    # "fake db ms" - время внутри таблиц в памяти, то есть часть задержки,
+    # которую у настоящей базы заменит время выполнения запроса
+    common.print_table(title, ['players', 'endpoint', 'p50 ms', 'p99 ms', 'db trips/req', 'fake db ms/req'], rows)
+
+
+def main():
+    parser = argparse.ArgumentParser(description=__doc__, formatter_class=argparse.RawDescriptionHelpFormatter)
+    parser.add_argument('--sizes', default='100,1000,10000', help='Размеры списка игроков через запятую')
+    parser.add_argument('--requests', type=int, default=100, help='Запросов на каждый адрес')
+    parser.add_argument('--latency', type=float, default=0.0, help='Задержка запроса к Supabase, секунд')
+    args = parser.parse_args()
+
+    sizes = [int(size) for size in args.sizes.split(',')]
+    run(sizes, args.requests, args.latency, cache_ttl=0)
+    run(sizes, args.requests, args.latency, cache_ttl=10)
+
+
+if __name__ == '__main__':
+    main()
@@ -0,0 +1,225 @@
+"""
+Сквозной бенчмарк обработки апдейтов ботом без Telegram и Supabase
+
+N имитируемых пользователей одновременно проходят весь сценарий - /start,
+ник, ранг, роли, "играю сегодня", два слота, подтверждение. Апдейты подаются
+в настоящий Application (обработчики из bot/main.py) через process_update();
+вызовы Bot API уходят в FakeBotRequest, запросы к базе - в FakeClient в
+памяти, у обоих задержка настраивается. Показывает апдейты в секунду,
+p50/p99 по шагам, запросы к базе и вызовы Bot API на один апдейт.
+
+    python bench/bench_bot.py
+    python bench/bench_bot.py --users 500 --concurrency 100 --db-latency 0.03 --api-latency 0.08
+"""
+import json
+import time
+import asyncio
+import argparse
+import logging
+import warnings
+from collections import Counter, defaultdict
+from datetime import datetime
+
+import common
+from fake_supabase import FakeClient, seed, RANKS
+
+from telegram import Update
+from telegram.request import BaseRequest
+
+BOT_USER = {'id': 123456, 'is_bot': True, 'first_name': 'Bench', 'username': 'bench_bot'}
+
+
+class FakeBotRequest(BaseRequest):
+    """
+    Заглушка Bot API: отвечает на любой метод как Telegram через `latency` секунд
+
+    Запоминает последний текст и клавиатуру каждого сообщения, чтобы нажатия
+    кнопок несли сообщение в том виде, в каком его сейчас видит пользователь.
+    """
+
+    def __init__(self, latency: float = 0.0):
+        self.latency = latency
+        self.calls = Counter()
+        self.messages = {}  # (chat_id, message_id) -> сообщение
+        self._next_message_id = 1
+
+    @property
+    def read_timeout(self):
+        return None
+
+    async def initialize(self):
+        pass
+
+    async def shutdown(self):
+        pass
+
+    def _message(self, chat_id, message_id, params):
+        message = {
+            'message_id': message_id,
+            'date': int(time.time()),
+            'chat': {'id': chat_id, 'type': 'private'},
+            'from': BOT_USER,
+            'text': params.get('text', ''),
+        }
+        markup = params.get('reply_markup')
+        if markup:
+            message['reply_markup'] = json.loads(markup) if isinstance(markup, str) else markup
+        self.messages[(chat_id, message_id)] = message
+        return message
+
+    async def do_request(self, url, method, request_data=None, read_timeout=None, write_timeout=None,
+                         connect_timeout=None, pool_timeout=None):
+        endpoint = url.rsplit('/', 1)[-1]
+        self.calls[endpoint] += 1
+        if self.latency:
+            await asyncio.sleep(self.latency)
+
+        params = request_data.parameters if request_data else {}
+        if endpoint == 'getMe':
+            result = BOT_USER
+        elif endpoint == 'sendMessage':
+            message_id = self._next_message_id
+            self._next_message_id += 1
+            result = self._message(int(params['chat_id']), message_id, params)
+        elif endpoint == 'editMessageText':
+            result = self._message(int(params['chat_id']), int(params['message_id']), params)
+        else:
+            result = True
+        return 200, json.dumps({'ok': True, 'result': result}).encode()
+
+
+class SimulatedUser:
+    """Пользователь Telegram, проходящий сценарий бота"""
+
+    def __init__(self, application, bot_request, telegram_id):
+        self.application = application
+        self.bot_request = bot_request
+        self.telegram_id = telegram_id
+        self.user = {'id': telegram_id, 'is_bot': False, 'first_name': f'User {telegram_id}',
+                     'username': f'user{telegram_id}'}
+        self.rank = RANKS[telegram_id % len(RANKS)]
+
+    async def _process(self, payload):
+        payload['update_id'] = next(_update_ids)
+        await self.application.process_update(Update.de_json(payload, self.application.bot))
+
+    async def send_text(self, text):
+        message = {'message_id': next(_update_ids), 'date': int(time.time()),
+                   'chat': {'id': self.telegram_id, 'type': 'private'}, 'from': self.user, 'text': text}
+        if text.startswith('/'):
+            message['entities'] = [{'type': 'bot_command', 'offset': 0, 'length': len(text.split()[0])}]
+        await self._process({'message': message})
+
+    async def press(self, data):
+        # Кнопка - в последнем сообщении бота этому пользователю
+        message = max((key for key in self.bot_request.messages if key[0] == self.telegram_id),
+                      key=lambda key: key[1])
+        await self._process({'callback_query': {
+            'id': str(next(_update_ids)),
+            'from': self.user,
+            'chat_instance': str(self.telegram_id),
+            'data': data,
+            'message': self.bot_request.messages[message],
+        }})
+
+    def steps(self):
+        return [
+            ('start', lambda: self.send_text('/start')),
+            ('nick', lambda: self.send_text(f'Bench#{self.telegram_id}')),
+            ('rank', lambda: self.press(f'rank_{self.rank}')),
+            ('role', lambda: self.press('role_duelist')),
+            ('role', lambda: self.press('role_initiator')),
+            ('roles_done', lambda: self.press('roles_done')),
+            ('play_today', lambda: self.press('play_today_slots')),
+            ('slot', lambda: self.press('slot_evening')),
+            ('slot', lambda: self.press('slot_night')),
+            ('confirm', lambda: self.press('confirm_slots')),
+        ]
+
+
+def _counter():
+    value = 0
+    while True:
+        value += 1
+        yield value
+
+
+_update_ids = _counter()
+
+
+async def run(args):
+    import database
+    client = FakeClient(latency=args.db_latency, jitter=args.db_latency / 2)
+    seed(client, args.roster, datetime.now().date().isoformat())
+    database.set_client(client)
+
+    import main as bot
+    import render
+    import async_database as db
+    from telegram.ext import Application
+
+    bot_request = FakeBotRequest(latency=args.api_latency)
+    application = Application.builder().token('123456:BENCH').request(bot_request).updater(None).build()
+    bot.add_handlers(application)
+
+    latencies = defaultdict(list)
+    semaphore = asyncio.Semaphore(args.concurrency)
+
+    async def simulate(user):
+        async with semaphore:
+            for name, step in user.steps():
+                started = time.perf_counter()
+                await step()
+                latencies[name].append(time.perf_counter() - started)
+
+    users = [SimulatedUser(application, bot_request, telegram_id) for telegram_id in range(1, args.users + 1)]
+    async with application:
+        trips_before = client.round_trips
+        started = time.perf_counter()
+        await asyncio.gather(*(simulate(user) for user in users))
+        elapsed = time.perf_counter() - started
+        await db.flush_writes()
+        trips = client.round_trips - trips_before
+
+    updates = sum(len(samples) for samples in latencies.values())
+    today = datetime.now().date().isoformat()
+    registered = sum(1 for user in users if (user.telegram_id,) in client.tables['players'])
+    confirmed = sum(1 for user in users if (user.telegram_id, today) in client.daily_by_date.get(today, {}))
+
+    rows = []
+    for name, samples in latencies.items():
+        summary = common.summarize(samples)
+        rows.append([name, summary['n'], summary['p50_ms'], summary['p99_ms'], summary['max_ms']])
+    common.print_table(
+        f"Bot: {args.users} users, concurrency {args.concurrency}, roster {args.roster}, "
+        f"db {args.db_latency * 1000:g} ms, Bot API {args.api_latency * 1000:g} ms",
+        ['step', 'updates', 'p50 ms', 'p99 ms', 'max ms'], rows)
+
+    api_calls = sum(bot_request.calls.values()) - bot_request.calls['getMe']
+    print(f"\nupdates: {updates} in {elapsed:.2f}s = {updates / elapsed:.0f} updates/s")
+    print(f"db round trips: {trips} ({trips / updates:.2f}/update), fake db cpu {client.server_seconds:.2f}s")
+    print(f"bot api calls: {api_calls} ({api_calls / updates:.2f}/update) {dict(bot_request.calls)}")
+    print(f"render: {render.get_render_stats()}")
+    print(f"write buffer: {db.get_write_buffer_stats()}")
+    print(f"registered: {registered}/{args.users}, confirmed today: {confirmed}/{args.users}")
+
+
+def main():
+    parser = argparse.ArgumentParser(description=__doc__, formatter_class=argparse.RawDescriptionHelpFormatter)
+    parser.add_argument('--users', type=int, default=200, help='Число пользователей')
+    parser.add_argument('--concurrency', type=int, default=50, help='Одновременно активных пользователей')
+    parser.add_argument('--roster', type=int, default=1000, help='Уже зарегистрированных игроков')
+    parser.add_argument('--db-latency', type=float, default=0.02, help='Задержка запроса к Supabase, секунд')
+    parser.add_argument('--api-latency', type=float, default=0.05, help='Задержка вызова Bot API, секунд')
+    parser.add_argument('--verbose', action='store_true', help='Не отключать INFO-логи бота')
+    args = parser.parse_args()
+
+    if not args.verbose:
+        logging.disable(logging.INFO)
+        # per_message=False в main.py выбран намеренно
+        warnings.filterwarnings('ignore', message=".*per_message=False")
+    asyncio.run(run(args))
+
+
+if __name__ == '__main__':
+    main()
@@ -0,0 +1,95 @@
+"""
+Холодный старт функции API и bot/database.py
+
+Каждый запуск - новый процесс Python, как новый экземпляр serverless-функции.
+Измеряет:
+- импорт api/index.py и первый /api/health (SDK при этом не загружается);
+- создание клиента при первом запросе данных (импорт supabase + create_client);
+- импорт bot/database.py и первый get_client().
+"eager" - то, что модули раньше делали при импорте: импорт + создание клиента.
+
+Для осмысленных цифр нужен настоящий пакет supabase (в сеть бенчмарк не
+ходит: create_client не подключается).
+
+    python bench/bench_cold_start.py --runs 10
+"""
+import os
+import sys
+import json
+import argparse
+import subprocess
+
+import common
+
+CHILD = r'''
+import io, os, sys, json, time
+from email.message import Message
+started = time.perf_counter()
+sys.path.insert(0, os.environ['BENCH_TARGET_DIR'])
+target = os.environ['BENCH_TARGET']
+result = {}
+if target == 'api':
+    import index as api
+    result['import_ms'] = (time.perf_counter() - started) * 1000
+    request = api.handler.__new__(api.handler)
+    request.path, request.command, request.request_version = '/api/health', 'GET', 'HTTP/1.1'
+    request.requestline, request.client_address = 'GET /api/health', ('bench', 0)
+    request.headers, request.wfile = Message(), io.BytesIO()
+    request.log_message = lambda *args: None
+    request.do_GET()
+    result['first_health_ms'] = (time.perf_counter() - started) * 1000
+    result['sdk_loaded_by_health'] = 'supabase' in sys.modules
+    init = time.perf_counter()
+    api.get_supabase_client()
+    result['client_init_ms'] = (time.perf_counter() - init) * 1000
+else:
+    import database
+    result['import_ms'] = (time.perf_counter() - started) * 1000
+    result['sdk_loaded_by_import'] = 'supabase' in sys.modules
+    init = time.perf_counter()
+    database.get_client()
+    result['client_init_ms'] = (time.perf_counter() - init) * 1000
+print(json.dumps(result))
+'''
+
+
+def measure(target, runs):
+    env = dict(os.environ, BENCH_TARGET=target,
+               BENCH_TARGET_DIR=common.API_DIR if target == 'api' else common.BOT_DIR)
+    samples = []
+    for _ in range(runs):
+        output = subprocess.run([sys.executable, '-c', CHILD], env=env, check=True,
+                                capture_output=True, text=True).stdout
+        samples.append(json.loads(output.strip().splitlines()[-1]))
+    return samples
+
+
+def main():
+    parser = argparse.ArgumentParser(description=__doc__, formatter_class=argparse.RawDescriptionHelpFormatter)
+    parser.add_argument('--runs', type=int, default=10, help='Новых процессов на каждую цель')
+    args = parser.parse_args()
+
+    # Без SDK common.py регистрирует модуль-заглушку без __file__
+    if getattr(sys.modules.get('supabase'), '__file__', None) is None:
+        print("supabase is not installed: client init is not measured, install bot/requirements.txt")
+        return
+
+    rows = []
+    for target in ('api', 'bot'):
+        samples = measure(target, args.runs)
+
+        def p50(field):
+            return round(common.percentile([sample[field] for sample in samples], 50), 1)
+
+        lazy = p50('first_health_ms') if target == 'api' else p50('import_ms')
+        eager = round(p50('import_ms') + p50('client_init_ms'), 1)
+        loaded = any(sample.get('sdk_loaded_by_health', sample.get('sdk_loaded_by_import')) for sample in samples)
+        rows.append([target, p50('import_ms'), lazy, p50('client_init_ms'), eager, 'yes' if loaded else 'no'])
+
+    common.print_table(
+        f"Cold start, p50 of {args.runs} fresh processes",
+        ['target', 'import ms', 'ready ms (health / import)', 'client init ms', 'eager ms', 'SDK loaded'], rows)
+
+
+if __name__ == '__main__':
+    main()
@@ -0,0 +1,108 @@
+"""
+Бенчмарк очереди "найти команду сейчас" (bot/lobby.py)
+
+Сначала очередь заполняется игроками, которые не могут собрать команду между
+собой (только дуэлянты), поэтому каждую команду приходится искать в большой
+очереди. Затем с заданной частотой приходят случайные игроки. Показывает
+задержку от входа в очередь до уведомления игрока, который замкнул команду,
+и пропускную способность подбора при залповом входе.
+
+    python bench/bench_lobby.py
+    python bench/bench_lobby.py --backlog 20000 --arrivals 5000 --rate 500
+"""
+import time
+import random
+import asyncio
+import argparse
+
+import common
+from fake_supabase import RANKS
+from bench_matchmaking import RANK_WEIGHTS
+import lobby as lobby_module
+import matchmaking
+
+SLOTS = ('morning', 'day', 'evening', 'night')
+
+
+def random_player(rng, telegram_id, roles=None):
+    return {
+        'telegram_id': telegram_id,
+        'rank': rng.choices(RANKS, RANK_WEIGHTS)[0],
+        'roles': roles or sorted(set(rng.choices(matchmaking.ROLES, (40, 22, 22, 16), k=rng.randint(1, 2)))),
+        'valorant_nick': f'Agent#{telegram_id}',
+    }
+
+
+async def run(backlog, arrivals, rate):
+    rng = random.Random(3)
+    lobby = lobby_module.Lobby(RANKS)
+    joined_at = {}
+    latencies = []
+    teams = []
+
+    async def on_match(match):
+        now = time.perf_counter()
+        # Команду замыкает последний пришедший (игроки из backlog вошли раньше)
+        latencies.append(now - max(joined_at.get(player['telegram_id'], 0.0) for player in match.team.players))
+        teams.append(match)
+
+    lobby.start(on_match)
+
+    # Очередь, которая сама не сматчится: из 5 дуэлянтов 3 играют не на своей роли
+    for telegram_id in range(backlog):
+        lobby.join(random_player(rng, telegram_id, ['duelist']), [rng.choice(SLOTS)])
+    while lobby._events.qsize():
+        await asyncio.sleep(0)
+    await asyncio.sleep(0.01)
+    waiting_before = lobby.size()
+
+    # Приход игроков с частотой `rate` в секунду
+    started = time.perf_counter()
+    for i in range(arrivals):
+        telegram_id = backlog + i
+        player = random_player(rng, telegram_id)
+        slots = rng.sample(SLOTS, rng.randint(1, 2))
+        joined_at[telegram_id] = time.perf_counter()
+        lobby.join(player, slots)
+        delay = started + (i + 1) / rate - time.perf_counter()
+        await asyncio.sleep(max(0.0, delay))
+    await asyncio.sleep(0.05)
+    streamed = time.perf_counter() - started
+
+    # Залп: столько же игроков входят разом, измеряется только CPU подбора
+    burst_lobby = lobby_module.Lobby(RANKS)
+    burst_lobby.start(lambda match: asyncio.sleep(0))
+    for i in range(arrivals):
+        burst_lobby.join(random_player(rng, 10 ** 7 + i), rng.sample(SLOTS, rng.randint(1, 2)))
+    burst_started = time.perf_counter()
+    while burst_lobby._events.qsize():
+        await asyncio.sleep(0)
+    burst_seconds = time.perf_counter() - burst_started
+
+    stats = lobby.stats()
+    await lobby.stop()
+    await burst_lobby.stop()
+
+    summary = common.summarize(latencies)
+    common.print_table(
+        f"Lobby: backlog {backlog}, {arrivals} arrivals at {rate}/s over {streamed:.1f}s",
+        ['waiting before', 'waiting after', 'teams', 'match p50 ms', 'match p99 ms', 'match max ms',
+         'avg spread', 'avg off-role'],
+        [[waiting_before, stats['waiting'], len(teams), summary['p50_ms'], summary['p99_ms'], summary['max_ms'],
+          round(sum(m.team.rank_spread for m in teams) / max(1, len(teams)), 2),
+          round(sum(m.team.off_role for m in teams) / max(1, len(teams)), 2)]])
+    print(f"\nburst: {arrivals} joins processed in {burst_seconds * 1000:.0f} ms "
+          f"({arrivals / burst_seconds:.0f} joins/s), {burst_lobby.teams_formed} teams")
+
+
+def main():
+    parser = argparse.ArgumentParser(description=__doc__, formatter_class=argparse.RawDescriptionHelpFormatter)
+    parser.add_argument('--backlog', type=int, default=5000, help='Игроков уже в очереди')
+    parser.add_argument('--arrivals', type=int, default=2000, help='Игроков, входящих во время прогона')
+    parser.add_argument('--rate', type=float, default=200, help='Входов в секунду')
+    args = parser.parse_args()
+    asyncio.run(run(args.backlog, args.arrivals, args.rate))
+
+
+if __name__ == '__main__':
+    main()
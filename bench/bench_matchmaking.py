@@ -0,0 +1,96 @@
+"""
+Бенчмарк bot/matchmaking.py: сбор пятёрок из пула (дата, слот)
+
+Для пулов из 100 / 1 000 / 10 000 игроков показывает время одного прохода
+form_teams(), долю игроков, попавших в команду, разброс рангов и число
+игроков не на своей роли в команде. Также сравнивает распределение позиций
+(ДП по подмножествам) с перебором всех 5! перестановок.
+
+    python bench/bench_matchmaking.py
+    python bench/bench_matchmaking.py --sizes 100,1000,10000,50000 --repeat 5
+"""
+import time
+import random
+import argparse
+import itertools
+
+import common
+from fake_supabase import RANKS
+import matchmaking
+
+# Примерное распределение рангов у игроков: больше всего в середине
+RANK_WEIGHTS = (6, 12, 16, 18, 16, 14, 12, 6)
+
+
+def make_pool(size, seed=7):
+    rng = random.Random(seed)
+    pool = []
+    for i in range(size):
+        pool.append({
+            'telegram_id': i,
+            'rank': rng.choices(RANKS, RANK_WEIGHTS)[0],
+            # Дуэлянт - самая популярная роль, контроллер - самая редкая
+            'roles': sorted(set(rng.choices(matchmaking.ROLES, (40, 22, 22, 16), k=rng.randint(1, 2)))),
+        })
+    return pool
+
+
+def brute_force_positions(players):
+    """Все 120 перестановок - базовый вариант, который заменило ДП по подмножествам"""
+    best = None
+    for order in itertools.permutations(matchmaking.POSITIONS):
+        off_role = sum(position != 'flex' and position not in player['roles']
+                       for player, position in zip(players, order))
+        if best is None or off_role < best[0]:
+            best = (off_role, order)
+    return best
+
+
+def main():
+    parser = argparse.ArgumentParser(description=__doc__, formatter_class=argparse.RawDescriptionHelpFormatter)
+    parser.add_argument('--sizes', default='100,1000,10000', help='Размеры пулов через запятую')
+    parser.add_argument('--repeat', type=int, default=5, help='Проходов на каждый размер')
+    args = parser.parse_args()
+
+    rows = []
+    for size in (int(size) for size in args.sizes.split(',')):
+        pool = make_pool(size)
+        samples = []
+        for _ in range(args.repeat):
+            matchmaking._solve_positions.cache_clear()
+            started = time.perf_counter()
+            teams, unmatched = matchmaking.form_teams(pool, RANKS)
+            samples.append(time.perf_counter() - started)
+
+        matched = sum(len(team.players) for team in teams)
+        summary = common.summarize(samples)
+        rows.append([
+            size, summary['p50_ms'], summary['max_ms'], len(teams),
+            f"{matched / size:.1%}" if size else '-',
+            round(sum(team.rank_spread for team in teams) / max(1, len(teams)), 2),
+            max((team.rank_spread for team in teams), default=0),
+            round(sum(team.off_role for team in teams) / max(1, len(teams)), 2),
+        ])
+    common.print_table(
+        f"form_teams, max rank spread {matchmaking.MAX_RANK_SPREAD}, p50 of {args.repeat}",
+        ['pool', 'p50 ms', 'max ms', 'teams', 'matched', 'avg spread', 'max spread', 'off-role/team'], rows)
+
+    # Только распределение позиций: ДП по подмножествам против перебора на тех же командах
+    teams = [team.players for team in matchmaking.form_teams(make_pool(5000), RANKS)[0]]
+    started = time.perf_counter()
+    brute = [brute_force_positions(team)[0] for team in teams]
+    brute_seconds = time.perf_counter() - started
+    matchmaking._solve_positions.cache_clear()
+    started = time.perf_counter()
+    exact = [matchmaking.assign_positions(team)[1] for team in teams]
+    dp_seconds = time.perf_counter() - started
+    assert brute == exact, "subset DP must match the permutation search"
+    common.print_table(
+        f"Position assignment for {len(teams)} teams (same optimum)",
+        ['method', 'total ms', 'us/team'],
+        [['permutations (5!)', round(brute_seconds * 1000, 1), round(brute_seconds / len(teams) * 1e6, 1)],
+         ['subset DP + cache', round(dp_seconds * 1000, 1), round(dp_seconds / len(teams) * 1e6, 1)]])
+
+
+if __name__ == '__main__':
+    main()
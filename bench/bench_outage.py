@@ -0,0 +1,118 @@
+"""
+Недоступность базы: повторы, предохранитель и устаревший кэш (bot/resilience.py)
+
+Потоки вызывают чтения bot/database.py (профили, игроки в слоте, статус на
+сегодня) у FakeClient в памяти. В середине прогона база "падает": каждый
+запрос ждёт `--outage-latency` секунд (таймаут подключения) и завершается
+ошибкой, потом база возвращается. Для каждой фазы бенчмарк показывает
+задержку вызовов, долю вызовов, получивших ответ (свежий или устаревший),
+и число запросов к недоступной базе. Прогон делается дважды: с фактически
+выключенным предохранителем и с предохранителем по умолчанию.
+
+    python bench/bench_outage.py
+    python bench/bench_outage.py --threads 16 --outage 5 --outage-latency 1.0
+"""
+import os
+import time
+import random
+import logging
+import argparse
+import threading
+
+# Короткие TTL, чтобы сбой пришёлся на устаревшие записи кэша и индексы
+os.environ.setdefault('PLAYER_CACHE_TTL', '1')
+os.environ.setdefault('SLOT_INDEX_TTL', '1')
+
+import common
+from fake_supabase import FakeClient, seed
+import database
+import resilience
+
+
+def run(args, threshold):
+    today = time.strftime('%Y-%m-%d')
+    client = FakeClient(latency=args.db_latency)
+    client.outage_latency = args.outage_latency
+    seed(client, args.players, today, playing_share=0.5)
+    database.set_client(client)
+    database._player_cache.clear()
+    database._slot_index.invalidate(today)
+    database._breaker = resilience.CircuitBreaker(threshold, args.cooldown)
+
+    calls = {'healthy': [], 'outage': [], 'recovered': []}
+    answered = {phase: 0 for phase in calls}
+    failed_trips = {}
+    lock = threading.Lock()
+    phase = ['healthy']
+    stop = threading.Event()
+
+    def worker(seed_value):
+        rng = random.Random(seed_value)
+        while not stop.is_set():
+            current = phase[0]
+            telegram_id = 1000 + rng.randrange(args.players // 10)  # частые игроки, закэшированы до сбоя
+            kind = rng.random()
+            started = time.perf_counter()
+            if kind < 0.6:
+                result = database.get_player(telegram_id)
+            elif kind < 0.8:
+                result = database.get_players_by_timeslot(today, 'evening') or None
+            else:
+                result = database.get_daily_status(telegram_id, today) or database.is_available()
+            elapsed = time.perf_counter() - started
+            with lock:
+                calls[current].append(elapsed)
+                answered[current] += result is not None and result is not False
+            time.sleep(args.think)
+
+    threads = [threading.Thread(target=worker, args=(i,), daemon=True) for i in range(args.threads)]
+    for thread in threads:
+        thread.start()
+    time.sleep(args.healthy)
+    phase[0] = 'outage'
+    before = client.failed_trips
+    client.down = True
+    time.sleep(args.outage)
+    client.down = False
+    failed_trips['outage'] = client.failed_trips - before
+    phase[0] = 'recovered'
+    time.sleep(args.healthy)
+    stop.set()
+    for thread in threads:
+        thread.join()
+
+    rows = []
+    for name, samples in calls.items():
+        summary = common.summarize(samples)
+        rows.append([name, summary['n'], summary['p50_ms'], summary['p99_ms'],
+                     f"{answered[name] / max(1, len(samples)):.0%}", failed_trips.get(name, 0)])
+    return rows, database.get_breaker_stats()
+
+
+def main():
+    parser = argparse.ArgumentParser(description=__doc__, formatter_class=argparse.RawDescriptionHelpFormatter)
+    parser.add_argument('--threads', type=int, default=8, help='Одновременных потоков (DB_POOL_SIZE)')
+    parser.add_argument('--players', type=int, default=2000, help='Зарегистрированных игроков')
+    parser.add_argument('--db-latency', type=float, default=0.01, help='Задержка запроса к работающей базе, секунд')
+    parser.add_argument('--outage-latency', type=float, default=0.5, help='Задержка неудачного запроса, секунд')
+    parser.add_argument('--healthy', type=float, default=2.0, help='Секунд до и после сбоя')
+    parser.add_argument('--outage', type=float, default=4.0, help='Длительность сбоя, секунд')
+    parser.add_argument('--cooldown', type=float, default=1.0, help='Пауза предохранителя, секунд')
+    parser.add_argument('--think', type=float, default=0.01, help='Пауза между вызовами одного потока')
+    args = parser.parse_args()
+
+    logging.disable(logging.CRITICAL)
+    resilience.RETRY_BASE_DELAY = 0.05
+
+    header = ['phase', 'calls', 'p50 ms', 'p99 ms', 'answered', 'trips to dead db']
+    for title, threshold in (('retries only (breaker never opens)', 10 ** 9),
+                             (f'breaker: {database.DB_BREAKER_THRESHOLD} failures, {args.cooldown:g}s cooldown',
+                              database.DB_BREAKER_THRESHOLD)):
+        rows, breaker = run(args, threshold)
+        common.print_table(f"{title}; outage {args.outage:g}s, failed trip {args.outage_latency * 1000:g} ms",
+                           header, rows)
+        print(f"breaker: opened {breaker['opened']}x, rejected {breaker['rejected']} calls")
+
+
+if __name__ == '__main__':
+    main()
@@ -0,0 +1,56 @@
+"""
+Общие функции офлайн-бенчмарков
+
+Добавляет bot/, api/ и migrations/ в sys.path (модули бота импортируют друг
+друга по имени), подставляет фиктивные SUPABASE_URL/SUPABASE_KEY, чтобы модули
+импортировались без настоящего проекта, и форматирует результаты.
+"""
+import os
+import sys
+import math
+
+ROOT = os.path.dirname(os.path.dirname(os.path.abspath(__file__)))
+BENCH_DIR = os.path.join(ROOT, 'bench')
+BOT_DIR = os.path.join(ROOT, 'bot')
+API_DIR = os.path.join(ROOT, 'api')
+MIGRATIONS_DIR = os.path.join(ROOT, 'migrations')
+
+for path in (BENCH_DIR, BOT_DIR, API_DIR, MIGRATIONS_DIR):
+    if path not in sys.path:
+        sys.path.insert(0, path)
+
+os.environ.setdefault('SUPABASE_URL', 'http://bench.invalid')
+os.environ.setdefault('SUPABASE_KEY', 'bench-key')
+
+from fake_supabase import install_sdk_stand_in  # noqa: E402
+
+install_sdk_stand_in()
+
+
+def percentile(samples, q):
+    """Перцентиль q (0..100) списка чисел методом ближайшего ранга"""
+    if not samples:
+        return 0.0
+    ordered = sorted(samples)
+    index = max(0, math.ceil(q / 100 * len(ordered)) - 1)
+    return ordered[index]
+
+
+def summarize(samples) -> dict:
+    """p50 / p99 / max в миллисекундах для задержек в секундах"""
+    return {
+        'n': len(samples),
+        'p50_ms': round(percentile(samples, 50) * 1000, 2),
+        'p99_ms': round(percentile(samples, 99) * 1000, 2),
+        'max_ms': round(max(samples) * 1000, 2) if samples else 0.0,
+    }
+
+
+def print_table(title, header, rows):
+    """Напечатать строки (списки значений) выровненной таблицей"""
+    widths = [max(len(str(value)) for value in column) for column in zip(header, *rows)]
+    print(f"\n{title}")
+    print('  '.join(str(value).ljust(width) for value, width in zip(header, widths)))
+    print('  '.join('-' * width for width in widths))
+    for row in rows:
+        print('  '.join(str(value).ljust(width) for value, width in zip(row, widths)))
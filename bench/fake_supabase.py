@@ -0,0 +1,462 @@
+"""
+Клиент Supabase (PostgREST) в памяти для бенчмарков и тестов
+
+Отвечает на те запросы, что делают bot/database.py, api/index.py и
+api/live.py: select с фильтрами / order / limit / range / точным count,
+вложенные players!inner(...), upsert / update / delete и RPC-функции из
+migrations/ (match_teammates, confirm_slots_and_match, team_finder_stats,
+apply_player_changes, archive_daily_status). Триггер daily_status из
+003_slot_mask.sql (slot_mask <-> time_slots) применяется при каждой записи.
+
+Каждый execute() - один запрос к "базе": он ждёт `latency` секунд (плюс
+до `jitter`), поэтому потоки и event loop ведут себя как с удалённой базой.
+"""
+import sys
+import time
+import random
+import threading
+import types
+from datetime import datetime
+
+SLOT_BITS = {'morning': 1, 'day': 2, 'evening': 4, 'night': 8}
+RANKS = ["Железо", "Бронза", "Серебро", "Золото",
+         "Платина", "Алмаз", "Бессмертный", "Сияющий"]
+ROLES = ['duelist', 'sentinel', 'initiator', 'controller']
+
+PRIMARY_KEYS = {
+    'players': ('telegram_id',),
+    'daily_status': ('telegram_id', 'date'),
+    'bot_state': ('kind', 'key'),
+    'daily_status_history': ('date', 'telegram_id'),
+}
+DEFAULTS = {
+    'players': lambda: {'telegram_username': None, 'telegram_first_name': None,
+                        'created_at': _now(), 'updated_at': _now()},
+    'daily_status': lambda: {'is_playing': False, 'slot_mask': 0, 'time_slots': [], 'updated_at': _now()},
+    'bot_state': lambda: {'updated_at': _now()},
+    'daily_status_history': lambda: {'slot_mask': 0},
+}
+
+
+class FakeAPIError(Exception):
+    """Как postgrest.APIError (например, для несуществующей RPC-функции)"""
+
+    def __init__(self, message, code=None):
+        super().__init__(message)
+        self.code = code
+
+
+def _now():
+    return datetime.now().isoformat()
+
+
+def _mask_from_slots(slots):
+    return sum(SLOT_BITS[slot] for slot in set(slots or []))
+
+
+def _slots_from_mask(mask):
+    return [slot for slot, bit in SLOT_BITS.items() if (mask or 0) & bit]
+
+
+def _split_columns(columns):
+    """'a, b, players!inner(x,y)' -> ['a', 'b', 'players!inner(x,y)'] (запятые внутри () не делят)"""
+    parts, depth, current = [], 0, ''
+    for char in columns:
+        if char == ',' and depth == 0:
+            parts.append(current.strip())
+            current = ''
+            continue
+        depth += (char == '(') - (char == ')')
+        current += char
+    if current.strip():
+        parts.append(current.strip())
+    return parts
+
+
+class FakeResponse:
+    def __init__(self, data, count=None):
+        self.data = data
+        self.count = count
+
+
+class FakeQuery:
+    """Построитель запроса с той частью API postgrest-py, которой пользуется проект"""
+
+    def __init__(self, client, table):
+        self.client = client
+        self.table_name = table
+        self._op = 'select'
+        self._columns = '*'
+        self._count = None
+        self._head = False
+        self._filters = []
+        self._eq = {}
+        self._order = []
+        self._limit = None
+        self._offset = 0
+        self._payload = None
+
+    # --- операции ---
+
+    def select(self, columns='*', count=None, head=False):
+        self._op, self._columns, self._count, self._head = 'select', columns, count, head
+        return self
+
+    def upsert(self, rows, **kwargs):
+        self._op, self._payload = 'upsert', rows
+        return self
+
+    def insert(self, rows, **kwargs):
+        self._op, self._payload = 'upsert', rows
+        return self
+
+    def update(self, data):
+        self._op, self._payload = 'update', data
+        return self
+
+    def delete(self):
+        self._op = 'delete'
+        return self
+
+    # --- фильтры ---
+
+    def eq(self, column, value):
+        self._eq[column] = value
+        self._filters.append(lambda row: row.get(column) == value)
+        return self
+
+    def neq(self, column, value):
+        self._filters.append(lambda row: row.get(column) != value)
+        return self
+
+    def gt(self, column, value):
+        self._filters.append(lambda row: row.get(column) is not None and row[column] > value)
+        return self
+
+    def lt(self, column, value):
+        self._filters.append(lambda row: row.get(column) is not None and row[column] < value)
+        return self
+
+    def in_(self, column, values):
+        values = set(values)
+        self._filters.append(lambda row: row.get(column) in values)
+        return self
+
+    def ov(self, column, values):
+        values = set(values)
+        self._filters.append(lambda row: bool(values & set(row.get(column) or [])))
+        return self
+
+    def contains(self, column, values):
+        values = set(values)
+        self._filters.append(lambda row: values <= set(row.get(column) or []))
+        return self
+
+    def order(self, column, desc=False):
+        self._order.append((column, desc))
+        return self
+
+    def limit(self, count):
+        self._limit = count
+        return self
+
+    def range(self, start, end):
+        self._offset, self._limit = start, end - start + 1
+        return self
+
+    # --- выполнение ---
+
+    def execute(self):
+        return self.client._round_trip(self._run)
+
+    def _matching(self):
+        table = self.client.tables[self.table_name]
+        # daily_status почти всегда фильтруется по дате - берём строки из индекса по дате
+        if self.table_name == 'daily_status' and 'date' in self._eq:
+            rows = self.client.daily_by_date.get(self._eq['date'], {}).values()
+        else:
+            rows = table.values()
+        return [row for row in rows if all(check(row) for check in self._filters)]
+
+    def _run(self):
+        if self._op == 'select':
+            return self._run_select()
+        if self._op == 'upsert':
+            payload = self._payload if isinstance(self._payload, list) else [self._payload]
+            if self.table_name == 'daily_status':
+                # Внешний ключ на players: одна плохая строка отклоняет весь запрос
+                for row in payload:
+                    if (row['telegram_id'],) not in self.client.tables['players']:
+                        raise FakeAPIError('insert or update on table "daily_status" violates foreign key '
+                                           'constraint "daily_status_telegram_id_fkey"', code='23503')
+            return FakeResponse([self.client.upsert_row(self.table_name, row) for row in payload])
+        if self._op == 'update':
+            updated = [self.client.upsert_row(self.table_name, {**self._key(row), **self._payload})
+                       for row in self._matching()]
+            return FakeResponse(updated)
+        if self._op == 'delete':
+            deleted = self._matching()
+            for row in deleted:
+                self.client.delete_row(self.table_name, row)
+            return FakeResponse([dict(row) for row in deleted])
+        raise FakeAPIError(f"Unsupported operation {self._op}")
+
+    def _key(self, row):
+        return {column: row[column] for column in PRIMARY_KEYS[self.table_name]}
+
+    def _run_select(self):
+        rows = self._matching()
+        columns = _split_columns(self._columns)
+        embeds = [column for column in columns if '(' in column]
+        plain = [column for column in columns if '(' not in column]
+
+        joined = []
+        for row in rows:
+            out = dict(row) if '*' in plain else {column: row.get(column) for column in plain}
+            keep = True
+            for embed in embeds:
+                head, inner = embed.split('(', 1)
+                name, _, hint = head.partition('!')
+                other = self.client.tables[name].get((row['telegram_id'],))
+                if other is None:
+                    keep = keep and hint != 'inner'
+                    out[name] = None
+                    continue
+                fields = [field.strip() for field in inner.rstrip(')').split(',')]
+                out[name] = dict(other) if '*' in fields else {field: other.get(field) for field in fields}
+            if keep:
+                joined.append((row, out))
+
+        for column, desc in reversed(self._order):
+            joined.sort(key=lambda pair: pair[0].get(column), reverse=desc)
+
+        count = len(joined) if self._count else None
+        if self._head:
+            return FakeResponse([], count)
+        end = None if self._limit is None else self._offset + self._limit
+        return FakeResponse([out for _, out in joined[self._offset:end]], count)
+
+
+class FakeRPC:
+    def __init__(self, client, name, params):
+        self.client = client
+        self.name = name
+        self.params = params
+
+    def execute(self):
+        function = self.client.rpc_functions.get(self.name)
+        if function is None:
+            raise FakeAPIError(f"Could not find the function public.{self.name}")
+        return self.client._round_trip(lambda: FakeResponse(function(**self.params)))
+
+
+class FakeClient:
+    """
+    Замена клиента Supabase
+
+    Args:
+        latency: Сколько секунд занимает каждый запрос
+        jitter: Дополнительная случайная задержка, до стольких секунд
+        rpcs: Имена "установленных" RPC-функций (None - все); пустое
+            множество - проверить запасные пути без RPC
+
+    `down = True` имитирует сбой базы: каждый запрос ждёт `outage_latency`
+    секунд (таймаут соединения) и завершается ConnectionError.
+    """
+
+    def __init__(self, latency: float = 0.0, jitter: float = 0.0, rpcs=None):
+        self.latency = latency
+        self.jitter = jitter
+        self.tables = {name: {} for name in PRIMARY_KEYS}
+        self.daily_by_date = {}
+        self.round_trips = 0
+        self.server_seconds = 0.0
+        self.down = False
+        self.outage_latency = 0.0
+        self.failed_trips = 0
+        self._lock = threading.RLock()
+        functions = {
+            'match_teammates': self._match_teammates,
+            'confirm_slots_and_match': self._confirm_slots_and_match,
+            'team_finder_stats': self._team_finder_stats,
+            'apply_player_changes': self._apply_player_changes,
+            'archive_daily_status': self._archive_daily_status,
+        }
+        self.rpc_functions = {name: function for name, function in functions.items()
+                              if rpcs is None or name in rpcs}
+
+    # --- API supabase-py ---
+
+    def table(self, name):
+        if name not in self.tables:
+            raise FakeAPIError(f"relation public.{name} does not exist")
+        return FakeQuery(self, name)
+
+    def rpc(self, name, params=None):
+        return FakeRPC(self, name, params or {})
+
+    # --- хранение ---
+
+    def _round_trip(self, run):
+        if self.down:
+            if self.outage_latency:
+                time.sleep(self.outage_latency)
+            with self._lock:
+                self.failed_trips += 1
+            raise ConnectionError("[Errno 111] Connection refused")
+        delay = self.latency + (random.uniform(0, self.jitter) if self.jitter else 0)
+        if delay:
+            time.sleep(delay)
+        with self._lock:
+            started = time.perf_counter()
+            try:
+                return run()
+            finally:
+                self.round_trips += 1
+                self.server_seconds += time.perf_counter() - started
+
+    def upsert_row(self, table, data):
+        key = tuple(data[column] for column in PRIMARY_KEYS[table])
+        rows = self.tables[table]
+        old = rows.get(key)
+        row = {**(old or DEFAULTS[table]()), **data}
+        if table == 'players' and row.get('roles') is None:
+            row['roles'] = []
+        if table == 'daily_status':
+            self._sync_slots(row, old, data)
+            self.daily_by_date.setdefault(row['date'], {})[key] = row
+        rows[key] = row
+        return dict(row)
+
+    def delete_row(self, table, row):
+        key = tuple(row[column] for column in PRIMARY_KEYS[table])
+        self.tables[table].pop(key, None)
+        if table == 'daily_status':
+            self.daily_by_date.get(row['date'], {}).pop(key, None)
+        if table == 'players':
+            # ON DELETE CASCADE
+            for table_name in ('daily_status', 'daily_status_history'):
+                for status in [s for s in self.tables[table_name].values() if s['telegram_id'] == row['telegram_id']]:
+                    self.delete_row(table_name, status)
+
+    @staticmethod
+    def _sync_slots(row, old, data):
+        """Триггер daily_status_sync_slots (migrations/003_slot_mask.sql)"""
+        if old is not None and 'slot_mask' in data and data['slot_mask'] != old.get('slot_mask'):
+            row['time_slots'] = _slots_from_mask(row['slot_mask'])
+        elif old is not None and 'time_slots' in data and data['time_slots'] != old.get('time_slots'):
+            row['slot_mask'] = _mask_from_slots(row['time_slots'])
+        elif old is None and not row.get('slot_mask'):
+            row['slot_mask'] = _mask_from_slots(row.get('time_slots'))
+        else:
+            row['time_slots'] = _slots_from_mask(row['slot_mask'])
+
+    # --- RPC-функции (те же результаты, что у SQL из migrations/) ---
+
+    def _match_teammates(self, p_date, p_slot_mask, p_exclude_id=None, p_rank=None, p_roles=None, p_limit=10):
+        roles = set(p_roles or [])
+        candidates = []
+        for status in self.daily_by_date.get(p_date, {}).values():
+            if not status['is_playing'] or not status['slot_mask'] & p_slot_mask:
+                continue
+            if p_exclude_id is not None and status['telegram_id'] == p_exclude_id:
+                continue
+            player = self.tables['players'].get((status['telegram_id'],))
+            if player is None:
+                continue
+            candidates.append((player, status))
+
+        def rank_distance(rank):
+            if rank not in RANKS or p_rank not in RANKS:
+                return 0
+            return abs(RANKS.index(rank) - RANKS.index(p_rank))
+
+        candidates.sort(key=lambda pair: (
+            rank_distance(pair[0].get('rank')),
+            -len(set(pair[0].get('roles') or []) - roles),
+            -bin(pair[1]['slot_mask'] & p_slot_mask).count('1'),
+            pair[1]['updated_at'] and -datetime.fromisoformat(pair[1]['updated_at']).timestamp(),
+        ))
+        fields = ('telegram_id', 'telegram_username', 'telegram_first_name', 'valorant_nick', 'rank', 'roles')
+        return [{**{field: player.get(field) for field in fields}, 'slot_mask': status['slot_mask']}
+                for player, status in candidates[:p_limit]]
+
+    def _confirm_slots_and_match(self, p_telegram_id, p_date, p_slot_mask, p_limit=10):
+        self.upsert_row('daily_status', {'telegram_id': p_telegram_id, 'date': p_date, 'is_playing': True,
+                                         'slot_mask': p_slot_mask, 'updated_at': _now()})
+        player = self.tables['players'].get((p_telegram_id,)) or {}
+        return self._match_teammates(p_date, p_slot_mask, p_telegram_id, player.get('rank'),
+                                     player.get('roles') or [], p_limit)
+
+    def _team_finder_stats(self, p_date):
+        playing = [status for status in self.daily_by_date.get(p_date, {}).values() if status['is_playing']]
+        return {
+            'total_players': len(self.tables['players']),
+            'playing_today': len(playing),
+            'slots': {slot: sum(1 for status in playing if status['slot_mask'] & bit)
+                      for slot, bit in SLOT_BITS.items()},
+        }
+
+    def _apply_player_changes(self, p_changes):
+        updated = 0
+        for change in p_changes:
+            if (change['telegram_id'],) in self.tables['players']:
+                self.upsert_row('players', {**change, 'updated_at': _now()})
+                updated += 1
+        return updated
+
+    def _archive_daily_status(self, p_before, p_batch=10000):
+        old_dates = sorted(date for date in self.daily_by_date if date < p_before)
+        batch = [status for date in old_dates for status in self.daily_by_date[date].values()][:p_batch]
+        for status in batch:
+            self.delete_row('daily_status', status)
+            self.upsert_row('daily_status_history', {field: status[field] for field in
+                                                     ('date', 'telegram_id', 'is_playing', 'slot_mask')})
+        return len(batch)
+
+
+def seed(client: FakeClient, players: int, date: str, playing_share: float = 0.3, seed_value: int = 42):
+    """
+    Заполнить таблицы: `players` игроков, доля playing_share из них играет в `date`
+
+    Id начинаются с 1000, чтобы пользователи бенчмарка (bench_bot.py) могли брать маленькие.
+    """
+    rng = random.Random(seed_value)
+    for i in range(players):
+        telegram_id = 1000 + i
+        client.upsert_row('players', {
+            'telegram_id': telegram_id,
+            'telegram_username': f'player{i}' if rng.random() < 0.7 else None,
+            'telegram_first_name': f'Player {i}',
+            'valorant_nick': f'Agent#{i:05d}',
+            'rank': rng.choice(RANKS),
+            'roles': rng.sample(ROLES, rng.randint(1, 2)),
+        })
+        if rng.random() < playing_share:
+            client.upsert_row('daily_status', {
+                'telegram_id': telegram_id,
+                'date': date,
+                'is_playing': True,
+                'slot_mask': rng.randint(1, 15),
+                'updated_at': _now(),
+            })
+    return client
+
+
+def install_sdk_stand_in():
+    """
+    Сделать `from supabase import create_client` импортируемым без SDK
+
+    Нужно только если пакет supabase не установлен: клиент проверяемых
+    модулей всё равно заменяется на FakeClient.
+    """
+    try:
+        import supabase  # noqa: F401
+        return
+    except ImportError:
+        pass
+    module = types.ModuleType('supabase')
+    module.create_client = lambda url, key, *args, **kwargs: FakeClient()
+    module.ClientOptions = lambda **options: options
+    module.Client = FakeClient
+    sys.modules['supabase'] = module
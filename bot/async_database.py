@@ -0,0 +1,78 @@
+"""
+Асинхронный слой доступа к данным
+Те же функции, что и в database.py, но в виде корутин: синхронные вызовы
+supabase выполняются в ограниченном пуле потоков, поэтому медленный запрос
+к PostgREST не блокирует event loop бота для остальных пользователей.
+"""
+import os
+import asyncio
+import contextvars
+import functools
+from concurrent.futures import ThreadPoolExecutor
+import database
+
+# Максимальное число одновременных запросов к базе.
+# Все потоки используют один клиент supabase (и один пул HTTP-соединений httpx)
+DB_POOL_SIZE = int(os.environ.get('DB_POOL_SIZE', 8))
+
+_executor = ThreadPoolExecutor(max_workers=DB_POOL_SIZE, thread_name_prefix='db')
+
+
+def _to_async(func):
+    """Обернуть синхронную функцию database.py в корутину"""
+    @functools.wraps(func)
+    async def wrapper(*args, **kwargs):
+        loop = asyncio.get_running_loop()
+        # Копия контекста переносит в поток учёт обращений к базе для текущего апдейта (metrics.py)
+        context = contextvars.copy_context()
+        return await loop.run_in_executor(_executor, functools.partial(context.run, func, *args, **kwargs))
+    return wrapper
+
+
+save_player = _to_async(database.save_player)
+get_player = _to_async(database.get_player)
+update_player_fields = _to_async(database.update_player_fields)
+update_daily_status = _to_async(database.update_daily_status)
+get_daily_status = _to_async(database.get_daily_status)
+get_all_players = _to_async(database.get_all_players)
+get_players_page = _to_async(database.get_players_page)
+get_players_playing_today = _to_async(database.get_players_playing_today)
+get_players_by_slots = _to_async(database.get_players_by_slots)
+confirm_daily_slots = _to_async(database.confirm_daily_slots)
+flush_writes = _to_async(database.flush_writes)
+get_players_by_timeslot = _to_async(database.get_players_by_timeslot)
+get_slot_teams = _to_async(database.get_slot_teams)
+find_team = _to_async(database.find_team)
+delete_player = _to_async(database.delete_player)
+archive_old_statuses = _to_async(database.archive_old_statuses)
+# Создать клиент supabase заранее (при старте бота), чтобы первый апдейт не ждал импорта SDK
+warm_up_client = _to_async(database.get_client)
+
+# Не обращаются к базе, поэтому вызываются напрямую
+get_client_stats = database.get_client_stats
+get_breaker_stats = database.get_breaker_stats
+is_available = database.is_available
+get_player_cache_stats = database.get_player_cache_stats
+get_write_buffer_stats = database.get_write_buffer_stats
+queue_daily_status = database.queue_daily_status
+queue_player_fields = database.queue_player_fields
+take_dropped_writes = database.take_dropped_writes
+WRITE_FLUSH_INTERVAL = database.WRITE_FLUSH_INTERVAL
+STATUS_RETENTION_DAYS = database.STATUS_RETENTION_DAYS
+RANKS = database.RANKS
+
+
+async def iter_players_playing(*args, **kwargs):
+    """Асинхронная версия database.iter_players_playing: каждая страница загружается в пуле потоков"""
+    pages = database.iter_players_playing(*args, **kwargs)
+    loop = asyncio.get_running_loop()
+    while True:
+        page = await loop.run_in_executor(_executor, contextvars.copy_context().run, next, pages, None)
+        if page is None:
+            return
+        yield page
+
+
+def shutdown():
+    """Остановить пул потоков (вызывается при завершении бота)"""
+    _executor.shutdown(wait=False)
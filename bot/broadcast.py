@@ -0,0 +1,259 @@
+"""
+Массовая рассылка сообщений с учётом лимитов Telegram
+Получатели загружаются постранично, сообщения отправляются параллельно
+через token bucket (общий лимит и лимит на чат), прогресс сохраняется
+в файл, чтобы перезапущенная рассылка продолжилась с места остановки.
+"""
+import os
+import json
+import time
+import asyncio
+import logging
+from dataclasses import dataclass, field, asdict
+from telegram.error import RetryAfter, Forbidden, BadRequest, TimedOut, NetworkError
+
+logger = logging.getLogger(__name__)
+
+# Telegram позволяет ~30 сообщений в секунду на бота и ~1 в секунду на чат
+BROADCAST_RATE = float(os.environ.get('BROADCAST_RATE', 25))
+BROADCAST_CONCURRENCY = int(os.environ.get('BROADCAST_CONCURRENCY', 20))
+BROADCAST_PAGE_SIZE = int(os.environ.get('BROADCAST_PAGE_SIZE', 500))
+BROADCAST_STATE_FILE = os.environ.get('BROADCAST_STATE_FILE', 'broadcast_state.json')
+PER_CHAT_INTERVAL = 1.0
+MAX_RETRIES = 3
+
+
+class TokenBucket:
+    """Token bucket: не больше rate операций в секунду, всплески до capacity"""
+
+    def __init__(self, rate: float, capacity: float = None):
+        self.rate = rate
+        self.capacity = capacity if capacity is not None else rate
+        self._tokens = self.capacity
+        self._updated = time.monotonic()
+        self._paused_until = 0.0
+        self._lock = asyncio.Lock()
+
+    def pause(self, seconds: float):
+        """Остановить выдачу токенов (например, после RetryAfter от Telegram)"""
+        self._paused_until = max(self._paused_until, time.monotonic() + seconds)
+
+    async def acquire(self):
+        """Дождаться и забрать один токен"""
+        async with self._lock:
+            while True:
+                now = time.monotonic()
+                if now < self._paused_until:
+                    await asyncio.sleep(self._paused_until - now)
+                    continue
+                self._tokens = min(self.capacity, self._tokens + (now - self._updated) * self.rate)
+                self._updated = now
+                if self._tokens >= 1:
+                    self._tokens -= 1
+                    return
+                await asyncio.sleep((1 - self._tokens) / self.rate)
+
+
+class PerChatLimiter:
+    """
+    Минимальный интервал между сообщениями в один чат
+
+    Время последней отправки хранится, пока не пройдёт interval, и
+    удаляется после: в памяти только чаты, которым писали последнюю секунду.
+    """
+
+    def __init__(self, interval: float = PER_CHAT_INTERVAL):
+        self.interval = interval
+        self._last_sent = {}
+        self._pruned_at = time.monotonic()
+
+    async def wait(self, chat_id: int):
+        last = self._last_sent.get(chat_id)
+        if last is not None:
+            delay = last + self.interval - time.monotonic()
+            if delay > 0:
+                await asyncio.sleep(delay)
+        now = time.monotonic()
+        self._last_sent[chat_id] = now
+        if now - self._pruned_at >= self.interval:
+            self._prune(now)
+
+    def _prune(self, now: float):
+        """Удалить чаты, для которых интервал уже прошёл"""
+        self._last_sent = {
+            chat_id: sent for chat_id, sent in self._last_sent.items()
+            if sent + self.interval > now
+        }
+        self._pruned_at = now
+
+    def __len__(self):
+        return len(self._last_sent)
+
+
+@dataclass
+class BroadcastStats:
+    """Метрики одной рассылки"""
+    job_id: str
+    sent: int = 0
+    failed: int = 0
+    blocked: int = 0
+    unknown: int = 0  # таймаут ответа: сообщение могло и дойти, поэтому без повтора
+    retries: int = 0
+    pages: int = 0
+    resumed_after: int = 0
+    completed: bool = False
+    started_at: float = field(default_factory=time.monotonic)
+    elapsed: float = 0.0
+
+    @property
+    def messages_per_second(self) -> float:
+        return self.sent / self.elapsed if self.elapsed else 0.0
+
+    def as_dict(self) -> dict:
+        data = asdict(self)
+        data.pop('started_at')
+        data['messages_per_second'] = round(self.messages_per_second, 2)
+        return data
+
+
+class BroadcastProgress:
+    """Прогресс рассылок в JSON-файле: {job_id: {'last_id': ..., 'done': ...}}"""
+
+    def __init__(self, path: str = BROADCAST_STATE_FILE):
+        self.path = path
+        self._state = self._load()
+
+    def _load(self) -> dict:
+        try:
+            with open(self.path, encoding='utf-8') as f:
+                return json.load(f)
+        except (OSError, ValueError):
+            return {}
+
+    def _save(self):
+        tmp_path = f"{self.path}.tmp"
+        try:
+            with open(tmp_path, 'w', encoding='utf-8') as f:
+                json.dump(self._state, f)
+            os.replace(tmp_path, self.path)
+        except OSError as e:
+            logger.warning(f"Не удалось сохранить прогресс рассылки: {e}")
+
+    def get(self, job_id: str) -> dict:
+        return self._state.get(job_id, {'last_id': 0, 'done': False})
+
+    def unfinished(self):
+        """job_id незавершённой рассылки или None"""
+        for job_id, state in self._state.items():
+            if not state.get('done'):
+                return job_id
+        return None
+
+    def checkpoint(self, job_id: str, last_id: int, done: bool = False):
+        # Храним только текущую рассылку, старые записи не нужны
+        self._state = {job_id: {'last_id': last_id, 'done': done}}
+        self._save()
+
+
+class Broadcaster:
+    """
+    Параллельная рассылка сообщений всем игрокам
+
+    Args:
+        bot: Объект с корутиной send_message (telegram.Bot или фейк в тестах)
+        fetch_page: Корутина fetch_page(after_id, limit) -> список игроков
+            с telegram_id по возрастанию или None при ошибке
+        progress: Хранилище прогресса (None - не сохранять)
+    """
+
+    def __init__(self, bot, fetch_page, *, rate: float = BROADCAST_RATE,
+                 concurrency: int = BROADCAST_CONCURRENCY,
+                 page_size: int = BROADCAST_PAGE_SIZE,
+                 per_chat_interval: float = PER_CHAT_INTERVAL,
+                 progress: BroadcastProgress = None):
+        self.bot = bot
+        self.fetch_page = fetch_page
+        self.page_size = page_size
+        self.progress = progress
+        self._bucket = TokenBucket(rate)
+        self._per_chat = PerChatLimiter(per_chat_interval)
+        self._semaphore = asyncio.Semaphore(concurrency)
+
+    async def run(self, job_id: str, build_message) -> BroadcastStats:
+        """
+        Разослать сообщения всем игрокам
+
+        Args:
+            job_id: Идентификатор рассылки (по нему продолжается прерванная)
+            build_message: Функция player -> kwargs для bot.send_message
+        """
+        stats = BroadcastStats(job_id=job_id)
+        state = self.progress.get(job_id) if self.progress else {'last_id': 0, 'done': False}
+        if state['done']:
+            logger.info(f"Рассылка {job_id} уже завершена, пропускаем")
+            stats.completed = True
+            return stats
+
+        last_id = stats.resumed_after = state['last_id']
+        while True:
+            page = await self.fetch_page(last_id, self.page_size)
+            if page is None:
+                logger.error(f"Рассылка {job_id} прервана: не удалось загрузить игроков после {last_id}")
+                break
+
+            await asyncio.gather(*(self._send(player, build_message, stats) for player in page))
+            if page:
+                stats.pages += 1
+                last_id = page[-1]['telegram_id']
+
+            done = len(page) < self.page_size
+            if self.progress:
+                self.progress.checkpoint(job_id, last_id, done)
+            if done:
+                stats.completed = True
+                break
+
+        stats.elapsed = time.monotonic() - stats.started_at
+        return stats
+
+    async def _send(self, player: dict, build_message, stats: BroadcastStats):
+        chat_id = player['telegram_id']
+        async with self._semaphore:
+            for attempt in range(MAX_RETRIES + 1):
+                await self._bucket.acquire()
+                await self._per_chat.wait(chat_id)
+                try:
+                    await self.bot.send_message(chat_id=chat_id, **build_message(player))
+                    stats.sent += 1
+                    return
+                except RetryAfter as e:
+                    # Flood control действует на весь бот - притормаживаем всех
+                    delay = e.retry_after
+                    if hasattr(delay, 'total_seconds'):
+                        delay = delay.total_seconds()
+                    self._bucket.pause(delay)
+                except Forbidden:
+                    # Пользователь заблокировал бота - повторять бессмысленно
+                    stats.blocked += 1
+                    return
+                except BadRequest as e:
+                    logger.error(f"Failed to send notification to {chat_id}: {e}")
+                    stats.failed += 1
+                    return
+                except TimedOut as e:
+                    # Запрос ушёл, но ответа нет - повтор мог бы прислать сообщение дважды
+                    logger.warning(f"Timed out sending notification to {chat_id}, not retrying: {e}")
+                    stats.unknown += 1
+                    return
+                except NetworkError as e:
+                    logger.warning(f"Network error sending notification to {chat_id} (attempt {attempt + 1}): {e}")
+                    await asyncio.sleep(2 ** attempt)
+                except Exception as e:
+                    # Ошибка одного получателя не должна останавливать рассылку
+                    logger.error(f"Failed to send notification to {chat_id}: {e}", exc_info=True)
+                    stats.failed += 1
+                    return
+                if attempt < MAX_RETRIES:
+                    stats.retries += 1
+            logger.error(f"Failed to send notification to {chat_id}: retries exhausted")
+            stats.failed += 1
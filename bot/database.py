@@ -3,16 +3,431 @@ Database module for Supabase integration (v2)
 С поддержкой временных слотов
 """
 import os
-from supabase import create_client, Client
-from datetime import datetime
+import json
+import time
+import threading
+from collections import OrderedDict
+from datetime import datetime, timedelta
+from slot_index import SlotIndex, compact_record, PLAYER_FIELDS
+import matchmaking
+from metrics import track_db, db_error, round_trip
+import resilience
 
 # Supabase credentials from environment variables
 SUPABASE_URL = os.environ.get('SUPABASE_URL')
 SUPABASE_KEY = os.environ.get('SUPABASE_KEY')
 
-supabase: Client = create_client(SUPABASE_URL, SUPABASE_KEY)
+# Клиент создаётся при первом запросе, а не при импорте: импорт supabase
+# (httpx, postgrest, gotrue, realtime, storage) занимает заметную часть
+# холодного старта, а без переменных окружения модуль всё равно импортируется
+_client = None
+_client_lock = threading.Lock()
+_client_init_seconds = None
 
+# Таймаут HTTP-запроса к PostgREST, секунд
+DB_TIMEOUT = float(os.environ.get('DB_TIMEOUT', 5))
+# Сколько раз повторить чтение после временного сбоя
+DB_READ_RETRIES = int(os.environ.get('DB_READ_RETRIES', 2))
+# Предохранитель: сколько сбоев подряд размыкают его и через сколько секунд пробовать снова
+DB_BREAKER_THRESHOLD = int(os.environ.get('DB_BREAKER_THRESHOLD', 5))
+DB_BREAKER_COOLDOWN = float(os.environ.get('DB_BREAKER_COOLDOWN', 30))
 
+_breaker = resilience.CircuitBreaker(DB_BREAKER_THRESHOLD, DB_BREAKER_COOLDOWN)
+
+
+def get_client():
+    """
+    Клиент supabase, один на процесс (создаётся при первом вызове)
+    
+    Raises:
+        RuntimeError: Не заданы SUPABASE_URL / SUPABASE_KEY
+        Exception: Ошибка создания клиента (повторится при следующем вызове)
+    """
+    global _client, _client_init_seconds
+    if _client is not None:
+        return _client
+    with _client_lock:
+        if _client is None:
+            if not SUPABASE_URL or not SUPABASE_KEY:
+                raise RuntimeError("SUPABASE_URL and SUPABASE_KEY must be set")
+            started = time.perf_counter()
+            from supabase import create_client, ClientOptions
+            _client = create_client(SUPABASE_URL, SUPABASE_KEY,
+                                    options=ClientOptions(postgrest_client_timeout=DB_TIMEOUT))
+            _client_init_seconds = time.perf_counter() - started
+    return _client
+
+
+def set_client(client):
+    """Подменить клиент (бенчмарки в bench/); None - создать заново при следующем запросе"""
+    global _client, _client_init_seconds
+    with _client_lock:
+        _client = client
+        _client_init_seconds = None
+
+
+def get_client_stats():
+    """Создан ли клиент и сколько заняли импорт SDK и создание клиента"""
+    return {
+        'initialized': _client is not None,
+        'init_ms': round(_client_init_seconds * 1000, 1) if _client_init_seconds is not None else None,
+    }
+
+
+def _read(query):
+    """Выполнить запрос на чтение через предохранитель, с повторами при временных сбоях"""
+    return resilience.call(_breaker, round_trip(query.execute), retries=DB_READ_RETRIES)
+
+
+def _write(query):
+    """
+    Выполнить запрос на запись через предохранитель, без повторов: их делает
+    буфер отложенных записей (flush_writes) или сам пользователь
+    """
+    return resilience.call(_breaker, round_trip(query.execute))
+
+
+def get_breaker_stats():
+    """Состояние предохранителя базы (для /health и /stats)"""
+    return _breaker.stats()
+
+
+def is_available() -> bool:
+    """False, пока предохранитель разомкнут: запросы к базе сейчас не отправляются"""
+    return not _breaker.is_open
+
+# Кэш профилей игроков
+PLAYER_CACHE_SIZE = int(os.environ.get('PLAYER_CACHE_SIZE', 10000))
+PLAYER_CACHE_TTL = float(os.environ.get('PLAYER_CACHE_TTL', 300))
+
+
+class TTLCache:
+    """Ограниченный LRU-кэш с временем жизни записей (потокобезопасный)"""
+    
+    def __init__(self, maxsize: int, ttl: float):
+        self.maxsize = maxsize
+        self.ttl = ttl
+        self.hits = 0
+        self.misses = 0
+        self._data = OrderedDict()
+        self._lock = threading.Lock()
+    
+    def get(self, key):
+        """
+        Значение из кэша или None, если его нет или оно устарело
+        
+        Устаревшее значение не удаляется (его вытеснит LRU): peek отдаёт его,
+        когда база недоступна
+        """
+        with self._lock:
+            item = self._data.get(key)
+            if item is None or item[0] < time.monotonic():
+                self.misses += 1
+                return None
+            self._data.move_to_end(key)
+            self.hits += 1
+            return item[1]
+    
+    def set(self, key, value):
+        with self._lock:
+            self._data[key] = (time.monotonic() + self.ttl, value)
+            self._data.move_to_end(key)
+            while len(self._data) > self.maxsize:
+                self._data.popitem(last=False)
+    
+    def peek(self, key):
+        """Значение без учёта в статистике и без проверки времени жизни"""
+        with self._lock:
+            item = self._data.get(key)
+            return item[1] if item is not None else None
+    
+    def invalidate(self, key):
+        with self._lock:
+            self._data.pop(key, None)
+    
+    def clear(self):
+        with self._lock:
+            self._data.clear()
+    
+    def stats(self) -> dict:
+        with self._lock:
+            total = self.hits + self.misses
+            return {
+                'size': len(self._data),
+                'hits': self.hits,
+                'misses': self.misses,
+                'hit_rate': round(self.hits / total, 3) if total else 0.0,
+            }
+
+
+_player_cache = TTLCache(PLAYER_CACHE_SIZE, PLAYER_CACHE_TTL)
+
+# Отложенная запись: как часто бот сбрасывает накопленные изменения в базу
+WRITE_FLUSH_INTERVAL = float(os.environ.get('WRITE_FLUSH_INTERVAL', 2))
+
+
+class WriteBuffer:
+    """
+    Буфер отложенных записей (write-behind, потокобезопасный)
+    
+    Для каждого пользователя хранится только последняя версия строки
+    daily_status и объединённые изменения колонок players, поэтому серия
+    быстрых нажатий превращается в одну запись при сбросе.
+    """
+    
+    def __init__(self):
+        self.coalesced = 0
+        self.flushed = 0
+        self.dropped = 0
+        self._dropped = []  # (telegram_id, 'status' | 'profile') - о потере ещё не сообщили
+        self._status = {}   # (telegram_id, date) -> строка daily_status
+        self._players = {}  # telegram_id -> {колонка: значение}
+        self._flushing = {}  # строки daily_status, забранные на запись, но ещё не записанные
+        self._lock = threading.Lock()
+    
+    def put_status(self, row: dict):
+        with self._lock:
+            key = (row['telegram_id'], row['date'])
+            if key in self._status:
+                self.coalesced += 1
+            self._status[key] = row
+    
+    def put_player(self, telegram_id: int, changes: dict):
+        with self._lock:
+            if telegram_id in self._players:
+                self.coalesced += 1
+            self._players[telegram_id] = {**self._players.get(telegram_id, {}), **changes}
+    
+    def pending_status(self, telegram_id: int, date: str):
+        with self._lock:
+            row = self._status.get((telegram_id, date))
+            return dict(row) if row is not None else None
+    
+    def pending_statuses(self, date: str) -> list:
+        """Ещё не записанные в базу строки daily_status за дату (включая записываемые сейчас)"""
+        with self._lock:
+            rows = {**self._flushing, **self._status}
+            return [dict(row) for key, row in rows.items() if key[1] == date]
+    
+    def pending_player(self, telegram_id: int) -> dict:
+        with self._lock:
+            return dict(self._players.get(telegram_id, {}))
+    
+    def discard_status(self, telegram_id: int, date: str):
+        with self._lock:
+            self._status.pop((telegram_id, date), None)
+    
+    def drop_player(self, telegram_id: int):
+        with self._lock:
+            self._players.pop(telegram_id, None)
+            for key in [key for key in self._status if key[0] == telegram_id]:
+                del self._status[key]
+    
+    def take(self):
+        """Забрать всё накопленное: (строки daily_status, изменения players)"""
+        with self._lock:
+            status, self._status = self._status, {}
+            players, self._players = self._players, {}
+            self._flushing.update(status)
+            return status, players
+    
+    def finish(self, status: dict):
+        """Запись забранных строк закончена (записаны или возвращены через restore)"""
+        with self._lock:
+            for key, row in status.items():
+                if self._flushing.get(key) is row:
+                    del self._flushing[key]
+    
+    def drop(self, telegram_id: int, kind: str):
+        """База отклонила запись пользователя ('status' или 'profile')"""
+        with self._lock:
+            self.dropped += 1
+            self._dropped.append((telegram_id, kind))
+    
+    def take_dropped(self) -> list:
+        """Забрать отклонённые записи: [(telegram_id, 'status' | 'profile')]"""
+        with self._lock:
+            dropped, self._dropped = self._dropped, []
+            return dropped
+    
+    def restore(self, status: dict = None, players: dict = None):
+        """Вернуть несохранённое в буфер; более новые записи не затираются"""
+        with self._lock:
+            for key, row in (status or {}).items():
+                self._status.setdefault(key, row)
+            for telegram_id, changes in (players or {}).items():
+                self._players[telegram_id] = {**changes, **self._players.get(telegram_id, {})}
+    
+    def stats(self) -> dict:
+        with self._lock:
+            return {
+                'pending_status': len(self._status),
+                'pending_players': len(self._players),
+                'coalesced': self.coalesced,
+                'flushed': self.flushed,
+                'dropped': self.dropped,
+            }
+
+
+_write_buffer = WriteBuffer()
+
+# Индекс "кто играет в какой слот" на сегодня
+SLOT_INDEX_TTL = float(os.environ.get('SLOT_INDEX_TTL', 600))
+# Несколько воркеров (WORKER_URLS, routing.py): как часто индекс догоняет
+# отметки, сделанные у других воркеров (0 - только перестройка раз в SLOT_INDEX_TTL)
+SLOT_INDEX_SYNC_SECONDS = float(os.environ.get(
+    'SLOT_INDEX_SYNC_SECONDS', 5 if len(os.environ.get('WORKER_URLS', '').split(',')) > 1 else 0))
+# Изменения перечитываются с запасом: updated_at ставится при постановке в буфер,
+# а в базу строка попадает при сбросе (да и часы воркеров расходятся)
+SLOT_INDEX_SYNC_OVERLAP = 30
+DAY_PAGE_SIZE = 1000  # PostgREST по умолчанию отдаёт не больше 1000 строк
+
+# Битовая маска временных слотов (см. migrations/003_slot_mask.sql)
+SLOT_BITS = {'morning': 1, 'day': 2, 'evening': 4, 'night': 8}
+
+RANKS = ["Железо", "Бронза", "Серебро", "Золото",
+         "Платина", "Алмаз", "Бессмертный", "Сияющий"]
+
+# Сколько дней daily_status остаётся в основной таблице, более старые
+# переносятся в daily_status_history (0 - не переносить)
+STATUS_RETENTION_DAYS = int(os.environ.get('STATUS_RETENTION_DAYS', 30))
+ARCHIVE_BATCH_SIZE = 10000
+
+_slot_index = SlotIndex(ttl=SLOT_INDEX_TTL)
+_slot_index_load_lock = threading.Lock()
+# Команды слота: (date, slot, max_rank_spread) -> (версия слота в индексе, результат form_teams)
+_slot_teams = {}
+_slot_teams_lock = threading.Lock()
+
+
+def get_player_cache_stats():
+    """Статистика кэша профилей (hits/misses/size)"""
+    return _player_cache.stats()
+
+
+def get_write_buffer_stats():
+    """Статистика буфера отложенных записей"""
+    return _write_buffer.stats()
+
+
+def encode_slots(time_slots) -> int:
+    """['morning', 'evening'] -> 0b0101"""
+    mask = 0
+    for slot in time_slots or []:
+        mask |= SLOT_BITS[slot]
+    return mask
+
+
+def decode_slots(slot_mask: int) -> list:
+    """0b0101 -> ['morning', 'evening'] (в порядке SLOT_BITS)"""
+    return [slot for slot, bit in SLOT_BITS.items() if slot_mask & bit]
+
+
+def _with_slots(row: dict) -> dict:
+    """Добавить к строке daily_status список слотов, декодированный из маски"""
+    row['time_slots'] = decode_slots(row.get('slot_mask') or 0)
+    return row
+
+
+def _remember_player(row: dict):
+    """Записать свежую строку players в кэш профилей и индекс слотов"""
+    _player_cache.set(row['telegram_id'], row)
+    _slot_index.update_profile(row)
+
+
+def _fetch_day_records(date: str):
+    """Загрузить всех играющих в дату (постранично) в виде записей индекса"""
+    records = []
+    for page in iter_players_playing(date, page_size=DAY_PAGE_SIZE):
+        for player in page:
+            records.append(compact_record(player, player['time_slots'], player['slot_mask']))
+    return records
+
+
+@track_db
+def _ensure_day_indexed(date: str) -> bool:
+    """Построить индекс слотов за дату, если его ещё нет. False при ошибке"""
+    if _slot_index.is_loaded(date):
+        _sync_day_changes(date)
+        return True
+    with _slot_index_load_lock:
+        if _slot_index.is_loaded(date):
+            return True
+        started = datetime.now()
+        _slot_index.begin_load(date)
+        try:
+            records = _fetch_day_records(date)
+        except Exception as e:
+            _slot_index.abort_load(date)
+            db_error(f"Error building slot index for {date}", e)
+            # База недоступна - пока отвечаем по устаревшему индексу
+            return resilience.is_unavailable(e) and _slot_index.has_data(date)
+        # Статусы из буфера отложенных записей в базе ещё нет
+        pending = [(row['telegram_id'], row['is_playing'], decode_slots(row['slot_mask']),
+                    row['slot_mask'], _player_cache.peek(row['telegram_id']))
+                   for row in _write_buffer.pending_statuses(date)]
+        _slot_index.load(date, records, pending)
+        _slot_index.mark_synced(date, started)
+        return True
+
+
+def _sync_day_changes(date: str):
+    """Применить к индексу статусы за дату, записанные другими воркерами"""
+    if not SLOT_INDEX_SYNC_SECONDS:
+        return
+    cursor = _slot_index.sync_due(date, SLOT_INDEX_SYNC_SECONDS)
+    # Догоняет один поток; остальные пока отвечают по индексу как есть
+    if cursor is None or not _slot_index_load_lock.acquire(blocking=False):
+        return
+    try:
+        started = datetime.now()
+        try:
+            query = get_client().table('daily_status')\
+                .select(f"telegram_id, is_playing, slot_mask, players!inner({','.join(PLAYER_FIELDS)})")\
+                .eq('date', date)\
+                .gt('updated_at', (cursor - timedelta(seconds=SLOT_INDEX_SYNC_OVERLAP)).isoformat())\
+                .order('updated_at')\
+                .limit(DAY_PAGE_SIZE)
+            rows = _read(query).data or []
+        except Exception as e:
+            db_error(f"Error syncing slot index for {date}", e)
+            # Попробуем через интервал, а не на каждом запросе
+            _slot_index.mark_synced(date, cursor)
+            return
+        if len(rows) == DAY_PAGE_SIZE:
+            # Изменений больше страницы - дешевле перестроить дату целиком
+            _slot_index.invalidate(date)
+            return
+        # Свои незаписанные статусы новее базы
+        pending = {row['telegram_id'] for row in _write_buffer.pending_statuses(date)}
+        for row in rows:
+            if row['telegram_id'] in pending:
+                continue
+            slot_mask = row.get('slot_mask') or 0
+            _slot_index.set_status(date, row['telegram_id'], row['is_playing'], decode_slots(slot_mask),
+                                   slot_mask, {**row['players'], 'telegram_id': row['telegram_id']})
+        _slot_index.mark_synced(date, started)
+    finally:
+        _slot_index_load_lock.release()
+
+
+def _rank_distance(rank_a: str, rank_b: str) -> int:
+    if rank_a not in RANKS or rank_b not in RANKS:
+        return 0
+    return abs(RANKS.index(rank_a) - RANKS.index(rank_b))
+
+
+def _rank_teammates(candidates: list, slot_mask: int, rank: str = None, roles: list = None) -> list:
+    """Отсортировать кандидатов так же, как RPC match_teammates"""
+    roles = set(roles or [])
+    return sorted(candidates, key=lambda player: (
+        _rank_distance(player.get('rank'), rank),
+        -len(set(player.get('roles') or []) - roles),
+        -bin(player['slot_mask'] & slot_mask).count('1'),
+    ))
+
+
+@track_db
 def save_player(telegram_id: int, valorant_nick: str, rank: str, roles: list):
     """Создать или обновить профиль игрока"""
     try:
@@ -23,136 +438,526 @@ def save_player(telegram_id: int, valorant_nick: str, rank: str, roles: list):
             'roles': roles,
         }
         
-        result = supabase.table('players').upsert(data).execute()
+        result = _write(get_client().table('players').upsert(data))
+        
+        # Write-through: в кэш кладём строку, которую вернула база
+        if result.data:
+            _remember_player(result.data[0])
+        else:
+            _player_cache.invalidate(telegram_id)
+        return True
+    except Exception as e:
+        _player_cache.invalidate(telegram_id)
+        db_error("Error saving player", e)
+        return False
+
+
+# Колонки players, которые можно менять через update_player_fields / queue_player_fields
+PLAYER_UPDATABLE_FIELDS = ('valorant_nick', 'rank', 'roles', 'telegram_username', 'telegram_first_name')
+
+
+def _check_player_fields(changes: dict):
+    unknown = set(changes) - set(PLAYER_UPDATABLE_FIELDS)
+    if unknown:
+        raise ValueError(f"Unknown player fields: {', '.join(sorted(unknown))}")
+
+
+def _patch_player(telegram_id: int, changes: dict):
+    """
+    PATCH только переданных колонок players
+    
+    Returns:
+        Строка из базы или None, если игрока нет
+    
+    Raises:
+        Exception: Ошибка запроса (вызывающий решает, повторять ли)
+    """
+    data = dict(changes)
+    data['updated_at'] = datetime.now().isoformat()
+    result = _write(get_client().table('players').update(data).eq('telegram_id', telegram_id))
+    return result.data[0] if result.data else None
+
+
+@track_db
+def update_player_fields(telegram_id: int, **changes):
+    """
+    Частично обновить профиль игрока одним PATCH-запросом
+    
+    В запрос попадают только переданные колонки, поэтому параллельные
+    изменения разных полей не затирают друг друга. Этим же запросом
+    flush_writes записывает изменения из буфера, когда RPC недоступен.
+    
+    Returns:
+        True если профиль обновлён, False при ошибке или если игрока нет
+    """
+    _check_player_fields(changes)
+    if not changes:
+        return True
+    
+    try:
+        row = _patch_player(telegram_id, changes)
+        if row is None:
+            _player_cache.invalidate(telegram_id)
+            return False
+        # Отложенные изменения других полей новее строки из базы
+        _remember_player({**row, **_write_buffer.pending_player(telegram_id)})
         return True
     except Exception as e:
-        print(f"Error saving player: {e}")
+        _player_cache.invalidate(telegram_id)
+        db_error("Error updating player fields", e)
         return False
 
 
+@track_db
+def queue_player_fields(telegram_id: int, **changes):
+    """
+    Изменить профиль с отложенной записью (см. flush_writes)
+    
+    Кэш и индекс слотов обновляются сразу, в базу изменения уходят пакетом.
+    Несколько изменений одного игрока до сброса объединяются в одно.
+    """
+    _check_player_fields(changes)
+    if not changes:
+        return True
+    
+    _write_buffer.put_player(telegram_id, changes)
+    cached = _player_cache.peek(telegram_id)
+    if cached is not None:
+        _remember_player({**cached, **changes})
+    else:
+        _slot_index.update_profile({'telegram_id': telegram_id, **changes})
+    return True
+
+
+@track_db
 def get_player(telegram_id: int):
-    """Получить профиль игрока"""
+    """Получить профиль игрока (сначала из кэша)"""
+    cached = _player_cache.get(telegram_id)
+    if cached is not None:
+        return dict(cached)
+    
     try:
-        result = supabase.table('players').select('*').eq('telegram_id', telegram_id).execute()
+        result = _read(get_client().table('players').select('*').eq('telegram_id', telegram_id))
         if result.data:
-            return result.data[0]
+            # Изменения из буфера ещё не записаны в базу, но уже видны пользователю
+            row = {**result.data[0], **_write_buffer.pending_player(telegram_id)}
+            _player_cache.set(telegram_id, row)
+            return dict(row)
         return None
     except Exception as e:
-        print(f"Error getting player: {e}")
+        db_error("Error getting player", e)
+        if resilience.is_unavailable(e):
+            # Устаревший профиль лучше, чем "профиль не найден"
+            stale = _player_cache.peek(telegram_id)
+            if stale is not None:
+                return {**stale, **_write_buffer.pending_player(telegram_id)}
         return None
 
 
+def _status_row(telegram_id: int, date: str, is_playing: bool, time_slots: list) -> dict:
+    # Пишем только маску, time_slots заполняет триггер в базе
+    return {
+        'telegram_id': telegram_id,
+        'date': date,
+        'is_playing': is_playing,
+        'slot_mask': encode_slots(time_slots),
+        'updated_at': datetime.now().isoformat()
+    }
+
+
+def _index_status(row: dict):
+    """Инкрементально обновить индекс слотов (профиль берём из кэша)"""
+    _slot_index.set_status(row['date'], row['telegram_id'], row['is_playing'],
+                           decode_slots(row['slot_mask']), row['slot_mask'],
+                           profile=_player_cache.peek(row['telegram_id']))
+
+
+@track_db
 def update_daily_status(telegram_id: int, date: str, is_playing: bool, time_slots: list = None):
     """Обновить статус игрока на конкретную дату с временными слотами"""
     try:
-        if time_slots is None:
-            time_slots = []
-        
-        data = {
-            'telegram_id': telegram_id,
-            'date': date,
-            'is_playing': is_playing,
-            'time_slots': time_slots,
-            'updated_at': datetime.now().isoformat()
-        }
-        
-        result = supabase.table('daily_status').upsert(data).execute()
+        data = _status_row(telegram_id, date, is_playing, time_slots)
+        _write(get_client().table('daily_status').upsert(data))
+        # Запись в базе новее отложенной
+        _write_buffer.discard_status(telegram_id, date)
+        _index_status(data)
         return True
     except Exception as e:
-        print(f"Error updating daily status: {e}")
+        db_error("Error updating daily status", e)
         return False
 
 
+@track_db
+def queue_daily_status(telegram_id: int, date: str, is_playing: bool, time_slots: list = None):
+    """
+    Обновить статус с отложенной записью (см. flush_writes)
+    
+    Индекс слотов обновляется сразу, поэтому подбор тиммейтов видит
+    новый статус ещё до записи в базу.
+    """
+    data = _status_row(telegram_id, date, is_playing, time_slots)
+    _write_buffer.put_status(data)
+    _index_status(data)
+    return True
+
+
+def _flush_status_rows(status_rows: dict) -> dict:
+    """
+    Записать строки daily_status одним upsert
+
+    Returns:
+        Строки, которые нужно вернуть в буфер (база недоступна)
+    """
+    try:
+        _write(get_client().table('daily_status').upsert(list(status_rows.values())))
+        _write_buffer.flushed += len(status_rows)
+        return {}
+    except Exception as e:
+        db_error("Error flushing daily status", e)
+        if resilience.is_unavailable(e):
+            return dict(status_rows)
+    
+    # Upsert атомарный: одна плохая строка (например, игрок уже удалён - нарушен
+    # внешний ключ) отклоняет весь пакет. Пишем по одной, отклонённые отбрасываем
+    retry = {}
+    for key, row in status_rows.items():
+        if retry:
+            # База пропала посреди прохода - остальное тоже позже
+            retry[key] = row
+            continue
+        try:
+            _write(get_client().table('daily_status').upsert(row))
+            _write_buffer.flushed += 1
+        except Exception as e:
+            if resilience.is_unavailable(e):
+                retry[key] = row
+            else:
+                db_error(f"Dropping daily status of {key[0]} for {key[1]}", e)
+                _write_buffer.drop(key[0], 'status')
+                # Индекс уже показывает несохранённый статус - перечитаем дату из базы
+                _slot_index.invalidate(key[1])
+    return retry
+
+
+def _flush_player_changes(player_changes: dict) -> dict:
+    """
+    Записать изменения профилей: одним RPC, без него - PATCH на игрока
+    (тот же, что в update_player_fields)
+
+    Returns:
+        Изменения, которые нужно вернуть в буфер (база недоступна)
+    """
+    rows = [{'telegram_id': telegram_id, **changes} for telegram_id, changes in player_changes.items()]
+    try:
+        _write(get_client().rpc('apply_player_changes', {'p_changes': rows}))
+        _write_buffer.flushed += len(player_changes)
+        return {}
+    except Exception as e:
+        db_error("Error applying player changes via RPC, falling back to per-player updates", e)
+        if resilience.is_unavailable(e):
+            return dict(player_changes)
+    
+    retry = {}
+    for telegram_id, changes in player_changes.items():
+        if retry:
+            retry[telegram_id] = changes
+            continue
+        try:
+            if _patch_player(telegram_id, changes) is None:
+                # Игрок удалён - сообщать некому
+                _write_buffer.dropped += 1
+            else:
+                _write_buffer.flushed += 1
+        except Exception as e:
+            if resilience.is_unavailable(e):
+                retry[telegram_id] = changes
+            else:
+                db_error(f"Dropping profile changes of {telegram_id}", e)
+                _write_buffer.drop(telegram_id, 'profile')
+                # В кэше несохранённый профиль - следующий запрос перечитает его из базы
+                _player_cache.invalidate(telegram_id)
+    return retry
+
+
+@track_db
+def flush_writes():
+    """
+    Сбросить буфер отложенных записей в базу
+    
+    Все строки daily_status уходят одним upsert, изменения профилей - одним
+    RPC apply_player_changes (migrations/006_write_batching.sql). Если база
+    недоступна, несохранённое возвращается в буфер и будет записано при
+    следующем сбросе. Если база отклонила пакет, записи отправляются по
+    одной, а отклонённые отбрасываются (иначе они ломали бы каждый сброс);
+    кому сообщить о потере, возвращает take_dropped_writes.
+    
+    Returns:
+        True если в буфере не осталось записей на повтор
+    """
+    status_rows, player_changes = _write_buffer.take()
+    success = True
+    
+    if status_rows:
+        retry = _flush_status_rows(status_rows)
+        if retry:
+            _write_buffer.restore(status=retry)
+            success = False
+        _write_buffer.finish(status_rows)
+    
+    if player_changes:
+        retry = _flush_player_changes(player_changes)
+        if retry:
+            _write_buffer.restore(players=retry)
+            success = False
+    
+    return success
+
+
+def take_dropped_writes() -> list:
+    """Отклонённые базой отложенные записи с прошлого вызова: [(telegram_id, 'status' | 'profile')]"""
+    return _write_buffer.take_dropped()
+
+
+@track_db
 def get_daily_status(telegram_id: int, date: str):
     """Получить статус игрока на конкретную дату"""
+    pending = _write_buffer.pending_status(telegram_id, date)
+    if pending is not None:
+        return _with_slots({key: pending[key] for key in ('telegram_id', 'date', 'is_playing', 'slot_mask')})
+    
     try:
-        result = supabase.table('daily_status')\
-            .select('*')\
+        query = get_client().table('daily_status')\
+            .select('telegram_id, date, is_playing, slot_mask')\
             .eq('telegram_id', telegram_id)\
-            .eq('date', date)\
-            .execute()
+            .eq('date', date)
+        result = _read(query)
         
         if result.data:
-            return result.data[0]
+            return _with_slots(result.data[0])
         return None
     except Exception as e:
-        print(f"Error getting daily status: {e}")
+        db_error("Error getting daily status", e)
+        if resilience.is_unavailable(e):
+            # Играющие за дату есть в индексе слотов (возможно, устаревшем)
+            record = _slot_index.player(date, telegram_id)
+            if record is not None:
+                return _with_slots({'telegram_id': telegram_id, 'date': date, 'is_playing': True,
+                                    'slot_mask': record['slot_mask']})
         return None
 
 
+@track_db
 def get_all_players():
     """Получить всех зарегистрированных игроков"""
     try:
-        result = supabase.table('players').select('*').execute()
+        result = _read(get_client().table('players').select('*'))
         return result.data if result.data else []
     except Exception as e:
-        print(f"Error getting all players: {e}")
+        db_error("Error getting all players", e)
         return []
 
 
-def get_players_playing_today():
-    """Получить игроков, играющих сегодня"""
+@track_db
+def get_players_page(after_id: int = 0, limit: int = 500, columns: str = 'telegram_id, valorant_nick'):
+    """
+    Получить страницу игроков, упорядоченных по telegram_id (keyset-пагинация)
+    
+    Args:
+        after_id: telegram_id последнего игрока предыдущей страницы
+        limit: Размер страницы
+        columns: Какие колонки загружать
+    
+    Returns:
+        Список игроков или None при ошибке (чтобы отличить сбой от конца списка)
+    """
     try:
-        today = datetime.now().date().isoformat()
-        
-        # Получаем игроков с активным статусом на сегодня
-        result = supabase.table('daily_status')\
-            .select('telegram_id, time_slots, players(*)')\
-            .eq('date', today)\
+        query = get_client().table('players')\
+            .select(columns)\
+            .gt('telegram_id', after_id)\
+            .order('telegram_id')\
+            .limit(limit)
+        result = _read(query)
+        return result.data if result.data else []
+    except Exception as e:
+        db_error("Error getting players page", e)
+        return None
+
+
+def iter_players_playing(date: str, page_size: int = 500, fields: list = None, after_id: int = 0):
+    """
+    Постранично перебрать игроков, играющих в дату (keyset-пагинация по telegram_id)
+    
+    Каждая страница - один запрос не больше page_size строк, поэтому память и
+    время на запрос не растут вместе с количеством игроков.
+    
+    Args:
+        date: Дата в формате YYYY-MM-DD
+        page_size: Размер страницы (PostgREST отдаёт не больше 1000 строк)
+        fields: Колонки players (по умолчанию все)
+        after_id: Начать после этого telegram_id
+    
+    Yields:
+        Списки игроков с полями time_slots и slot_mask
+    """
+    player_columns = ','.join(fields) if fields else '*'
+    last_id = after_id
+    while True:
+        query = get_client().table('daily_status')\
+            .select(f'telegram_id, slot_mask, players!inner({player_columns})')\
+            .eq('date', date)\
             .eq('is_playing', True)\
-            .execute()
+            .gt('telegram_id', last_id)\
+            .order('telegram_id')\
+            .limit(page_size)
+        result = _read(query)
+        rows = result.data or []
         
-        players = []
-        for item in result.data:
-            if item.get('players'):
-                player_data = item['players'].copy()
-                player_data['time_slots'] = item.get('time_slots', [])
-                players.append(player_data)
+        page = []
+        for item in rows:
+            player_data = item['players'].copy()
+            player_data['telegram_id'] = item['telegram_id']
+            player_data['slot_mask'] = item.get('slot_mask') or 0
+            page.append(_with_slots(player_data))
+        if page:
+            yield page
         
-        return players
-    except Exception as e:
-        print(f"Error getting players playing today: {e}")
+        if len(rows) < page_size:
+            return
+        last_id = rows[-1]['telegram_id']
+
+
+@track_db
+def get_players_playing_today():
+    """Получить игроков, играющих сегодня (из индекса слотов)"""
+    today = datetime.now().date().isoformat()
+    if not _ensure_day_indexed(today):
         return []
+    return _slot_index.players(today)
 
 
-def get_players_by_slots(date: str, time_slots: list, limit: int = 10, exclude_id: int = None):
+@track_db
+def get_players_by_slots(date: str, time_slots: list, limit: int = 10, exclude_id: int = None,
+                         rank: str = None, roles: list = None):
     """
     Получить игроков, играющих в указанные временные слоты
     
+    Кандидаты берутся из индекса слотов и ранжируются так же, как RPC
+    match_teammates (migrations/002_match_teammates.sql): сначала близкие
+    по рангу, затем те, кто закрывает недостающие роли. Если индекс
+    построить не удалось - подбор выполняется в базе.
+    
     Args:
         date: Дата в формате YYYY-MM-DD
         time_slots: Список временных слотов ['morning', 'evening', ...]
         limit: Максимальное количество игроков
         exclude_id: ID игрока которого нужно исключить из результатов
+        rank: Ранг игрока, для которого подбираются тиммейты
+        roles: Роли игрока, для которого подбираются тиммейты
     """
+    slot_mask = encode_slots(time_slots)
+    if not slot_mask:
+        return []
+    
+    if _ensure_day_indexed(date):
+        candidates = _slot_index.players_in_slots(date, slot_mask, exclude_id=exclude_id)
+        return _rank_teammates(candidates, slot_mask, rank, roles)[:limit]
+    
     try:
-        # Получаем всех играющих в эту дату
-        query = supabase.table('daily_status')\
+        result = _read(get_client().rpc('match_teammates', {
+            'p_date': date,
+            'p_slot_mask': slot_mask,
+            'p_exclude_id': exclude_id,
+            'p_rank': rank,
+            'p_roles': roles or [],
+            'p_limit': limit,
+        }))
+        return [_with_slots(row) for row in result.data] if result.data else []
+    except Exception as e:
+        db_error("Error matching teammates via RPC, falling back to overlap query", e)
+        if resilience.is_unavailable(e):
+            return []
+    
+    # Функция не установлена - фильтруем пересечение оператором && без ранжирования
+    try:
+        query = get_client().table('daily_status')\
             .select('telegram_id, time_slots, players(*)')\
             .eq('date', date)\
-            .eq('is_playing', True)
+            .eq('is_playing', True)\
+            .ov('time_slots', time_slots)
         
         if exclude_id:
             query = query.neq('telegram_id', exclude_id)
         
-        result = query.limit(limit).execute()
+        result = _read(query.limit(limit))
         
         matching_players = []
         for item in result.data:
-            item_slots = item.get('time_slots', [])
-            # Проверяем есть ли пересечение слотов
-            if any(slot in item_slots for slot in time_slots):
-                if item.get('players'):
-                    player_data = item['players'].copy()
-                    player_data['time_slots'] = item_slots
-                    matching_players.append(player_data)
+            if item.get('players'):
+                player_data = item['players'].copy()
+                player_data['time_slots'] = item.get('time_slots', [])
+                matching_players.append(player_data)
         
-        return matching_players[:limit]
+        return matching_players
     except Exception as e:
-        print(f"Error getting players by slots: {e}")
+        db_error("Error getting players by slots", e)
         return []
 
 
+@track_db
+def confirm_daily_slots(telegram_id: int, date: str, time_slots: list, limit: int = 10):
+    """
+    Подтвердить слоты игрока и сразу подобрать тиммейтов за один запрос к базе
+    
+    Если индекс слотов за дату построен, записывается одна строка этого
+    игрока (буфер остальных сбрасывает flush_writes по расписанию), а
+    тиммейты берутся из индекса.
+    Иначе запись и подбор выполняет RPC confirm_slots_and_match
+    (migrations/006_write_batching.sql).
+    
+    Returns:
+        Список тиммейтов (как get_players_by_slots) или None, если статус не сохранён
+    """
+    data = _status_row(telegram_id, date, True, time_slots)
+    
+    if _slot_index.is_loaded(date):
+        player = get_player(telegram_id) or {}
+        try:
+            _write(get_client().table('daily_status').upsert(data))
+            # Более старый отложенный статус этого дня больше не нужен
+            _write_buffer.discard_status(telegram_id, date)
+        except Exception as e:
+            db_error("Error confirming daily slots", e)
+            if not resilience.is_unavailable(e):
+                return None
+            # База недоступна: статус запишется при следующем сбросе буфера,
+            # а тиммейты всё равно подбираются по индексу
+            _write_buffer.put_status(data)
+        _index_status(data)
+        candidates = _slot_index.players_in_slots(date, data['slot_mask'], exclude_id=telegram_id)
+        return _rank_teammates(candidates, data['slot_mask'], player.get('rank'), player.get('roles'))[:limit]
+    
+    try:
+        result = _write(get_client().rpc('confirm_slots_and_match', {
+            'p_telegram_id': telegram_id,
+            'p_date': date,
+            'p_slot_mask': data['slot_mask'],
+            'p_limit': limit,
+        }))
+        _write_buffer.discard_status(telegram_id, date)
+        return [_with_slots(row) for row in result.data] if result.data else []
+    except Exception as e:
+        db_error("Error confirming slots via RPC, falling back to separate queries", e)
+        if resilience.is_unavailable(e):
+            return None
+    
+    if not update_daily_status(telegram_id, date, True, time_slots):
+        return None
+    player = get_player(telegram_id) or {}
+    return get_players_by_slots(date, time_slots, limit=limit, exclude_id=telegram_id,
+                                rank=player.get('rank'), roles=player.get('roles'))
+
+
+@track_db
 def get_players_by_timeslot(date: str, timeslot: str):
     """
     Получить игроков, играющих в конкретный временной слот
@@ -161,14 +966,17 @@ def get_players_by_timeslot(date: str, timeslot: str):
         date: Дата в формате YYYY-MM-DD
         timeslot: Временной слот ('morning', 'day', 'evening', 'night')
     """
+    if _ensure_day_indexed(date):
+        return _slot_index.players_in_slot(date, timeslot)
+    
     try:
         # Используем contains для проверки наличия элемента в массиве
-        result = supabase.table('daily_status')\
+        query = get_client().table('daily_status')\
             .select('telegram_id, time_slots, players(*)')\
             .eq('date', date)\
             .eq('is_playing', True)\
-            .contains('time_slots', [timeslot])\
-            .execute()
+            .contains('time_slots', [timeslot])
+        result = _read(query)
         
         players = []
         for item in result.data:
@@ -179,15 +987,167 @@ def get_players_by_timeslot(date: str, timeslot: str):
         
         return players
     except Exception as e:
-        print(f"Error getting players by timeslot: {e}")
+        db_error("Error getting players by timeslot", e)
         return []
 
 
+@track_db
+def get_slot_teams(date: str, timeslot: str, max_rank_spread: int = matchmaking.MAX_RANK_SPREAD):
+    """
+    Разбить всех играющих в слот на команды по 5 (см. matchmaking.form_teams)
+    
+    Пул берётся из индекса слотов, поэтому при построенном индексе запросов
+    к базе нет, а результат кэшируется до изменения состава слота
+    (SlotIndex.version) - подтверждения подряд не пересобирают команды заново.
+    
+    Returns:
+        (список matchmaking.Team, игроки без команды); общие для вызовов, не изменять
+    """
+    if not _ensure_day_indexed(date):
+        return matchmaking.form_teams(get_players_by_timeslot(date, timeslot), RANKS, max_rank_spread)
+
+    key = (date, timeslot, max_rank_spread)
+    # Версию читаем до пула: если слот изменится между ними, запись просто устареет
+    version = _slot_index.version(date, timeslot)
+    with _slot_teams_lock:
+        cached = _slot_teams.get(key)
+    if cached is not None and cached[0] == version:
+        return cached[1]
+
+    result = matchmaking.form_teams(_slot_index.players_in_slot(date, timeslot), RANKS, max_rank_spread)
+    with _slot_teams_lock:
+        for old_key in [old_key for old_key in _slot_teams if not _slot_index.has_data(old_key[0])]:
+            del _slot_teams[old_key]
+        _slot_teams[key] = (version, result)
+    return result
+
+
+@track_db
+def find_team(telegram_id: int, date: str, time_slots: list):
+    """
+    Команда игрока в первом из его слотов, где она собирается
+    
+    Returns:
+        (слот, matchmaking.Team) или None
+    """
+    for slot in SLOT_BITS:
+        if slot not in (time_slots or []):
+            continue
+        teams, _ = get_slot_teams(date, slot)
+        team = matchmaking.find_team(teams, telegram_id)
+        if team is not None:
+            return slot, team
+    return None
+
+
+@track_db
 def delete_player(telegram_id: int):
-    """Удалить игрока (каскадно удалятся и его daily_status)"""
+    """Удалить игрока (каскадно удалятся его daily_status и архив)"""
+    _write_buffer.drop_player(telegram_id)
+    _player_cache.invalidate(telegram_id)
+    _slot_index.remove_player(telegram_id)
     try:
-        result = supabase.table('players').delete().eq('telegram_id', telegram_id).execute()
+        _write(get_client().table('players').delete().eq('telegram_id', telegram_id))
+        return True
+    except Exception as e:
+        db_error("Error deleting player", e)
+        return False
+
+
+@track_db
+def archive_old_statuses(retention_days: int = STATUS_RETENTION_DAYS, today: str = None):
+    """
+    Перенести дни старше retention_days из daily_status в daily_status_history
+    
+    RPC archive_daily_status (migrations/008_status_retention.sql) вызывается,
+    пока переносит полные пачки по ARCHIVE_BATCH_SIZE строк: короткие
+    транзакции не мешают записи сегодняшних статусов.
+    
+    Args:
+        retention_days: Сколько последних дней оставить (сегодня и ещё retention_days - 1)
+        today: Дата в формате YYYY-MM-DD (по умолчанию сегодня)
+    
+    Returns:
+        Число перенесённых строк или None при ошибке
+    """
+    if retention_days <= 0:
+        return 0
+    current = datetime.fromisoformat(today) if today else datetime.now()
+    before = (current.date() - timedelta(days=retention_days - 1)).isoformat()
+    
+    moved = 0
+    try:
+        while True:
+            result = _write(get_client().rpc('archive_daily_status', {
+                'p_before': before,
+                'p_batch': ARCHIVE_BATCH_SIZE,
+            }))
+            batch = result.data or 0
+            moved += batch
+            if batch < ARCHIVE_BATCH_SIZE:
+                return moved
+    except Exception as e:
+        db_error(f"Error archiving daily statuses before {before} ({moved} rows moved)", e)
+        return None
+
+
+@track_db
+def load_bot_state(kind: str = None, key: str = None):
+    """
+    Загрузить сохранённое состояние диалогов (таблица bot_state)
+    
+    Args:
+        kind, key: Загрузить одну запись (по умолчанию все)
+    
+    Returns:
+        Список (kind, key, value_json) или None при ошибке
+    """
+    try:
+        rows = []
+        offset = 0
+        while True:
+            query = get_client().table('bot_state')\
+                .select('kind, key, value')
+            if kind is not None:
+                query = query.eq('kind', kind).eq('key', key)
+            query = query\
+                .order('kind')\
+                .order('key')\
+                .range(offset, offset + DAY_PAGE_SIZE - 1)
+            result = _read(query)
+            page = result.data or []
+            rows.extend((row['kind'], row['key'], json.dumps(row['value'])) for row in page)
+            if len(page) < DAY_PAGE_SIZE:
+                return rows
+            offset += DAY_PAGE_SIZE
+    except Exception as e:
+        db_error("Error loading bot state", e)
+        return None
+
+
+@track_db
+def save_bot_state(rows: list):
+    """
+    Сохранить пакет изменений состояния диалогов
+    
+    Args:
+        rows: Список (kind, key, value_json); value_json=None - удалить запись
+    """
+    try:
+        upserts = [
+            {'kind': kind, 'key': key, 'value': json.loads(value), 'updated_at': datetime.now().isoformat()}
+            for kind, key, value in rows if value is not None
+        ]
+        if upserts:
+            _write(get_client().table('bot_state').upsert(upserts))
+        
+        deletes = {}
+        for kind, key, value in rows:
+            if value is None:
+                deletes.setdefault(kind, []).append(key)
+        for kind, keys in deletes.items():
+            _write(get_client().table('bot_state').delete().eq('kind', kind).in_('key', keys))
         return True
     except Exception as e:
-        print(f"Error deleting player: {e}")
+        db_error("Error saving bot state", e)
         return False
@@ -0,0 +1,134 @@
+"""
+Таблица маршрутов для callback-кнопок
+Обработчик выбирается поиском в словаре: сначала по полному callback_data,
+затем по префиксу до первого "_" (slot_, rank_, role_). Маршрут может
+зависеть от режима редактирования (user_data['editing']) и объявляет, в какое
+состояние ConversationHandler переходит диалог. Для каждого маршрута
+считается время обработки.
+"""
+import re
+import time
+import logging
+from dataclasses import dataclass
+
+logger = logging.getLogger(__name__)
+
+PREFIX_SEPARATOR = '_'
+
+
+@dataclass(frozen=True)
+class Route:
+    """Маршрут: обработчик и состояние диалога после него (None - не менять)"""
+    name: str
+    handler: object
+    next_state: object = None
+
+
+@dataclass
+class RouteStats:
+    """Счётчики одного маршрута"""
+    calls: int = 0
+    errors: int = 0
+    total_seconds: float = 0.0
+    max_seconds: float = 0.0
+
+    def observe(self, seconds: float, failed: bool = False):
+        self.calls += 1
+        self.errors += int(failed)
+        self.total_seconds += seconds
+        self.max_seconds = max(self.max_seconds, seconds)
+
+    def as_dict(self) -> dict:
+        return {
+            'calls': self.calls,
+            'errors': self.errors,
+            'avg_ms': round(self.total_seconds / self.calls * 1000, 2) if self.calls else 0.0,
+            'max_ms': round(self.max_seconds * 1000, 2),
+        }
+
+
+class CallbackRouter:
+    """
+    Реестр маршрутов {(callback_data или префикс, режим): Route}
+
+    Args:
+        unknown_text: Ответ на кнопку без маршрута (например, из старого сообщения)
+    """
+
+    def __init__(self, unknown_text: str = "⚠️ Неизвестная команда"):
+        self.unknown_text = unknown_text
+        self._exact = {}
+        self._prefix = {}
+        self._stats = {}
+
+    def add(self, handler, *, data: str = None, prefix: str = None, mode: str = None,
+            next_state=None, name: str = None):
+        """
+        Зарегистрировать обработчик
+
+        Args:
+            data: Точное значение callback_data
+            prefix: Префикс callback_data, заканчивается на "_" (например 'slot_')
+            mode: Значение user_data['editing'], в котором действует маршрут
+                (None - в любом режиме, если нет более точного)
+            next_state: Состояние ConversationHandler после обработчика
+        """
+        if (data is None) == (prefix is None):
+            raise ValueError("Route needs exactly one of data or prefix")
+        if prefix is not None and not prefix.endswith(PREFIX_SEPARATOR):
+            raise ValueError(f"Route prefix must end with '{PREFIX_SEPARATOR}': {prefix}")
+
+        table, key = (self._exact, data) if data is not None else (self._prefix, prefix)
+        if (key, mode) in table:
+            raise ValueError(f"Duplicate route: {key} (mode={mode})")
+
+        route = Route(name or f"{key}{f'[{mode}]' if mode else ''}", handler, next_state)
+        table[(key, mode)] = route
+        self._stats[route.name] = RouteStats()
+        return route
+
+    def resolve(self, data: str, mode: str = None):
+        """Route для callback_data или None"""
+        route = self._exact.get((data, mode)) or self._exact.get((data, None))
+        if route is not None:
+            return route
+        head, sep, _ = data.partition(PREFIX_SEPARATOR)
+        if not sep:
+            return None
+        prefix = head + sep
+        return self._prefix.get((prefix, mode)) or self._prefix.get((prefix, None))
+
+    def pattern(self) -> str:
+        """Регулярное выражение для CallbackQueryHandler: все известные callback_data"""
+        exact = sorted({re.escape(key) for key, _ in self._exact})
+        prefixes = sorted({re.escape(key) for key, _ in self._prefix})
+        parts = []
+        if exact:
+            parts.append(f"^(?:{'|'.join(exact)})$")
+        if prefixes:
+            parts.append(f"^(?:{'|'.join(prefixes)})")
+        return '|'.join(parts) or '^$'
+
+    async def dispatch(self, update, context):
+        """Обработчик для CallbackQueryHandler; возвращает объявленное состояние диалога"""
+        query = update.callback_query
+        route = self.resolve(query.data or '', context.user_data.get('editing'))
+        if route is None:
+            await query.answer(self.unknown_text)
+            return None
+
+        started = time.perf_counter()
+        failed = False
+        try:
+            await route.handler(update, context)
+        except Exception:
+            failed = True
+            raise
+        finally:
+            elapsed = time.perf_counter() - started
+            self._stats[route.name].observe(elapsed, failed)
+            logger.debug(f"callback {route.name} handled in {elapsed * 1000:.1f} ms")
+        return route.next_state
+
+    def stats(self) -> dict:
+        return {name: stats.as_dict() for name, stats in self._stats.items() if stats.calls}
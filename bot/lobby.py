@@ -0,0 +1,285 @@
+"""
+Очередь "найти команду сейчас"
+Игроки встают в очередь из главного меню и лежат в корзинах по
+(слот, ранг) и (слот, ранг, роль) в порядке прихода. Сопоставитель -
+одна asyncio-задача: события входа и выхода обрабатываются по очереди,
+и после каждого входа пятёрка ищется только вокруг нового игрока
+(в остальных корзинах совместимой пятёрки нет - она бы уже собралась).
+Берутся головы корзин, поэтому время подбора не зависит от длины очереди.
+
+Очередь живёт в памяти одного процесса: при нескольких воркерах кнопки
+lobby_* обрабатывает воркер 0 (см. routing.py).
+"""
+import os
+import time
+import asyncio
+import logging
+from collections import OrderedDict
+from dataclasses import dataclass
+import matchmaking
+
+logger = logging.getLogger(__name__)
+
+# Сколько игроков в пятёрке может стоять не на своей роли
+LOBBY_MAX_OFF_ROLE = int(os.environ.get('LOBBY_MAX_OFF_ROLE', 1))
+# Через сколько секунд ожидания игрок убирается из очереди
+LOBBY_TTL = float(os.environ.get('LOBBY_TTL', 3600))
+# Как часто проверять истёкшие ожидания
+LOBBY_SWEEP_INTERVAL = 30
+
+
+@dataclass
+class LobbyEntry:
+    """Игрок в очереди"""
+    player: dict   # профиль: telegram_id, rank, roles, valorant_nick, ...
+    slots: tuple
+    rank: int      # номер ранга в списке рангов
+    joined_at: float
+
+
+@dataclass
+class LobbyMatch:
+    """Собранная пятёрка"""
+    slot: str
+    team: matchmaking.Team
+    waited: float  # сколько ждал дольше всех, секунд
+
+
+class Lobby:
+    """
+    Очередь с сопоставителем на asyncio
+
+    Args:
+        ranks: Ранги от низшего к высшему (database.RANKS)
+        max_rank_spread: Максимальная разница рангов в пятёрке
+        max_off_role: Сколько игроков может стоять не на своей роли
+        ttl: Максимальное время ожидания, секунд
+    """
+
+    def __init__(self, ranks: list, max_rank_spread: int = matchmaking.MAX_RANK_SPREAD,
+                 max_off_role: int = LOBBY_MAX_OFF_ROLE, ttl: float = LOBBY_TTL):
+        self.rank_index = {rank: i for i, rank in enumerate(ranks)}
+        self.max_rank_spread = max_rank_spread
+        self.max_off_role = max_off_role
+        self.ttl = ttl
+        self._entries = {}  # telegram_id -> LobbyEntry
+        self._buckets = {}  # (slot, ранг) и (slot, ранг, роль) -> OrderedDict {telegram_id: LobbyEntry}
+        self._events = None
+        self._task = None
+        self._on_match = None
+        self._on_expire = None
+        self._notifications = set()  # задачи отправки уведомлений
+        self.joined = 0
+        self.teams_formed = 0
+        self.expired = 0
+        self.match_seconds_total = 0.0
+        self.match_seconds_max = 0.0
+
+    # --- публичный интерфейс (вызывается из обработчиков) ---
+
+    @property
+    def running(self) -> bool:
+        return self._task is not None and not self._task.done()
+
+    def start(self, on_match, on_expire=None):
+        """
+        Запустить сопоставитель в текущем event loop
+
+        Args:
+            on_match: async on_match(LobbyMatch) - уведомить пятёрку
+            on_expire: async on_expire(player) - игрок слишком долго ждал
+        """
+        self._on_match = on_match
+        self._on_expire = on_expire
+        self._events = asyncio.Queue()
+        self._task = asyncio.create_task(self._run())
+
+    async def stop(self):
+        if self._task is not None:
+            self._task.cancel()
+            try:
+                await self._task
+            except asyncio.CancelledError:
+                pass
+            self._task = None
+
+    def join(self, player: dict, slots: list) -> bool:
+        """Поставить игрока в очередь на слоты; False если ранг неизвестен или очередь не запущена"""
+        if not self.running or player.get('rank') not in self.rank_index or not slots:
+            return False
+        self._events.put_nowait(('join', player, tuple(slots), time.monotonic()))
+        return True
+
+    def leave(self, telegram_id: int) -> bool:
+        """Убрать игрока из очереди; False если его там не было"""
+        if not self.running:
+            return False
+        waiting = telegram_id in self._entries
+        self._events.put_nowait(('leave', telegram_id, None, None))
+        return waiting
+
+    def is_waiting(self, telegram_id: int) -> bool:
+        return telegram_id in self._entries
+
+    def size(self, slot: str = None) -> int:
+        """Сколько игроков ждёт (всего или в слоте)"""
+        if slot is None:
+            return len(self._entries)
+        return sum(1 for entry in self._entries.values() if slot in entry.slots)
+
+    def stats(self) -> dict:
+        return {
+            'running': self.running,
+            'waiting': len(self._entries),
+            'joined': self.joined,
+            'teams_formed': self.teams_formed,
+            'expired': self.expired,
+            'avg_match_ms': round(self.match_seconds_total / self.teams_formed * 1000, 2) if self.teams_formed else 0.0,
+            'max_match_ms': round(self.match_seconds_max * 1000, 2),
+        }
+
+    # --- сопоставитель ---
+
+    async def _run(self):
+        next_sweep = time.monotonic() + LOBBY_SWEEP_INTERVAL
+        while True:
+            try:
+                event = await asyncio.wait_for(self._events.get(), timeout=max(0.0, next_sweep - time.monotonic()))
+            except asyncio.TimeoutError:
+                event = None
+            if time.monotonic() >= next_sweep:
+                self._expire()
+                next_sweep = time.monotonic() + LOBBY_SWEEP_INTERVAL
+            if event is None:
+                continue
+
+            kind, payload, slots, enqueued_at = event
+            if kind == 'leave':
+                self._remove(payload)
+                continue
+
+            match = self._add(payload, slots, enqueued_at)
+            if match is None:
+                continue
+            elapsed = time.monotonic() - enqueued_at
+            self.teams_formed += 1
+            self.match_seconds_total += elapsed
+            self.match_seconds_max = max(self.match_seconds_max, elapsed)
+            # Уведомления отправляются отдельно, чтобы Bot API не задерживал подбор
+            self._spawn(self._on_match(match), "Lobby notification failed")
+
+    def _spawn(self, coroutine, error_message: str):
+        async def guarded():
+            try:
+                await coroutine
+            except Exception as e:
+                logger.error(f"{error_message}: {e}")
+        task = asyncio.create_task(guarded())
+        self._notifications.add(task)
+        task.add_done_callback(self._notifications.discard)
+
+    def _bucket(self, key) -> OrderedDict:
+        bucket = self._buckets.get(key)
+        if bucket is None:
+            bucket = self._buckets[key] = OrderedDict()
+        return bucket
+
+    def _keys(self, entry: LobbyEntry):
+        for slot in entry.slots:
+            yield (slot, entry.rank)
+            for role in entry.player.get('roles') or ():
+                yield (slot, entry.rank, role)
+
+    def _add(self, player: dict, slots: tuple, joined_at: float):
+        """
+        Добавить игрока и попробовать собрать пятёрку
+
+        Повторный вход обновляет профиль и слоты и ставит игрока в конец
+        очереди: корзины упорядочены по времени входа.
+        """
+        telegram_id = player['telegram_id']
+        previous = self._remove(telegram_id)
+        entry = LobbyEntry(player, slots, self.rank_index[player['rank']], joined_at)
+        self._entries[telegram_id] = entry
+        for key in self._keys(entry):
+            self._bucket(key)[telegram_id] = entry
+        self.joined += previous is None
+        return self._match_around(entry)
+
+    def _remove(self, telegram_id: int):
+        entry = self._entries.pop(telegram_id, None)
+        if entry is None:
+            return None
+        for key in self._keys(entry):
+            bucket = self._buckets.get(key)
+            if bucket is not None:
+                bucket.pop(telegram_id, None)
+                if not bucket:
+                    del self._buckets[key]
+        return entry
+
+    def _oldest(self, keys, taken: set):
+        """Дольше всех ждущий игрок из корзин keys, кроме уже взятых"""
+        best = None
+        for key in keys:
+            for entry in self._buckets.get(key, {}).values():
+                if entry.player['telegram_id'] not in taken:
+                    if best is None or entry.joined_at < best.joined_at:
+                        best = entry
+                    break
+        return best
+
+    def _match_around(self, entry: LobbyEntry):
+        """Собрать пятёрку с новым игроком: слоты по очереди, окна рангов вокруг его ранга"""
+        top = len(self.rank_index) - 1
+        for slot in entry.slots:
+            for low in range(max(0, entry.rank - self.max_rank_spread), entry.rank + 1):
+                ranks = range(low, min(low + self.max_rank_spread, top) + 1)
+                team = self._try_window(entry, slot, ranks)
+                if team is not None:
+                    return self._pop_team(slot, team)
+        return None
+
+    def _try_window(self, entry: LobbyEntry, slot: str, ranks: range):
+        members = [entry]
+        taken = {entry.player['telegram_id']}
+        covered = set(entry.player.get('roles') or ())
+
+        for role in matchmaking.ROLES:
+            if role in covered or len(members) == matchmaking.TEAM_SIZE:
+                continue
+            candidate = self._oldest([(slot, k, role) for k in ranks], taken)
+            if candidate is not None:
+                members.append(candidate)
+                taken.add(candidate.player['telegram_id'])
+                covered.update(candidate.player.get('roles') or ())
+
+        while len(members) < matchmaking.TEAM_SIZE:
+            candidate = self._oldest([(slot, k) for k in ranks], taken)
+            if candidate is None:
+                return None
+            members.append(candidate)
+            taken.add(candidate.player['telegram_id'])
+
+        players = [member.player for member in members]
+        positions, off_role = matchmaking.assign_positions(players)
+        if off_role > self.max_off_role:
+            return None
+        member_ranks = [member.rank for member in members]
+        return members, matchmaking.Team(players, positions, max(member_ranks) - min(member_ranks), off_role)
+
+    def _pop_team(self, slot: str, found) -> LobbyMatch:
+        members, team = found
+        now = time.monotonic()
+        for member in members:
+            self._remove(member.player['telegram_id'])
+        return LobbyMatch(slot, team, now - min(member.joined_at for member in members))
+
+    def _expire(self):
+        deadline = time.monotonic() - self.ttl
+        stale = [telegram_id for telegram_id, entry in self._entries.items() if entry.joined_at < deadline]
+        for telegram_id in stale:
+            entry = self._remove(telegram_id)
+            self.expired += 1
+            if self._on_expire is not None:
+                self._spawn(self._on_expire(entry.player), "Lobby expiry notification failed")
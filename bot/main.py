@@ -3,9 +3,14 @@ VALORANT Team Finder - Telegram Bot (Cloud Version v2)
 С поддержкой временных слотов
 """
 import os
+import sys
+import signal
+import asyncio
 import logging
+import secrets
 from datetime import time, datetime
 from telegram import Update, InlineKeyboardButton, InlineKeyboardMarkup
+from telegram.error import TelegramError
 from telegram.ext import (
     Application,
     CommandHandler,
@@ -15,9 +20,15 @@ from telegram.ext import (
     ContextTypes,
     filters
 )
-from threading import Thread
-from http.server import HTTPServer, BaseHTTPRequestHandler
-import database
+import async_database as db
+from broadcast import Broadcaster, BroadcastProgress
+from webserver import BotWebServer
+from dispatcher import CallbackRouter
+import render
+import metrics
+from persistence import create_persistence
+from lobby import Lobby
+from routing import create_router, WORKER_INDEX, WORKER_URLS
 
 # Настройка логирования
 logging.basicConfig(
@@ -31,6 +42,12 @@ VALORANT_NICK, RANK, ROLES = range(3)
 BOT_TOKEN = os.environ.get('BOT_TOKEN')
 PORT = int(os.environ.get('PORT', 10000))
 
+# Режим вебхука включается, если задан публичный адрес бота (например https://bot.onrender.com)
+WEBHOOK_URL = os.environ.get('WEBHOOK_URL', '').rstrip('/')
+WEBHOOK_PATH = os.environ.get('WEBHOOK_PATH', '/telegram')
+# Один воркер может сгенерировать секрет сам; при нескольких он должен быть общим (см. main)
+WEBHOOK_SECRET = os.environ.get('WEBHOOK_SECRET') or secrets.token_urlsafe(32)
+
 # Временные слоты
 TIME_SLOTS = {
     'morning': '🌅 Утро (6:00-12:00)',
@@ -53,54 +70,62 @@ TIME_SLOTS_RU = {
     'night': 'ночью'
 }
 
-# Простой HTTP сервер для health checks
-class HealthCheckHandler(BaseHTTPRequestHandler):
-    def do_GET(self):
-        self.send_response(200)
-        self.send_header('Content-type', 'text/plain')
-        self.end_headers()
-        self.wfile.write(b'Bot is running!')
-    
-    def log_message(self, format, *args):
-        pass
 
-def run_http_server():
-    """Запуск HTTP сервера в отдельном потоке"""
-    server = HTTPServer(('0.0.0.0', PORT), HealthCheckHandler)
-    logger.info(f"HTTP server started on port {PORT}")
-    server.serve_forever()
+def current_time_slot(now: datetime = None) -> str:
+    """Слот TIME_SLOTS, в который попадает текущее время (границы как в подписях)"""
+    hour = (now or datetime.now()).hour
+    if 6 <= hour < 12:
+        return 'morning'
+    if 12 <= hour < 18:
+        return 'day'
+    if hour >= 18:
+        return 'evening'
+    return 'night'
+
+# Роли: id -> подпись на кнопке (порядок задаёт порядок кнопок)
+ROLE_NAMES = {
+    'duelist': '💨 Дуэлист',
+    'sentinel': '🛡 Страж',
+    'initiator': '⚡ Инициатор',
+    'controller': '🎯 Контроллер'
+}
+
+# Позиции в собранной команде (matchmaking.POSITIONS)
+POSITION_NAMES = {**ROLE_NAMES, 'flex': '🔄 Флекс'}
+
+RANKS = db.RANKS
+
+DB_UNAVAILABLE_TEXT = "⏳ База данных временно недоступна. Попробуй через минуту."
+
 
+def error_text(text: str) -> str:
+    """Текст ошибки, а пока база недоступна - просьба подождать: повтор сразу не поможет"""
+    return text if db.is_available() else DB_UNAVAILABLE_TEXT
 
 # ======================
 # КЛАВИАТУРЫ
 # ======================
+# Все клавиатуры строятся один раз при импорте: состояний выбора всего 16
+# (4 слота или 4 роли, каждый выбран или нет), а InlineKeyboardMarkup
+# неизменяем, поэтому обработчики переиспользуют готовые объекты.
 
-def get_main_menu_keyboard():
-    """Главное меню"""
-    keyboard = [
-        [InlineKeyboardButton("🎮 Мой план на сегодня", callback_data="play_today_slots")],
-        [InlineKeyboardButton("👥 Кто играет сегодня?", url="https://valorant-team-finder-ten.vercel.app/")],
-        [InlineKeyboardButton("⚙️ Изменить данные", callback_data="edit_profile")],
-    ]
-    return InlineKeyboardMarkup(keyboard)
+def _selection_mask(selected, options) -> int:
+    """Выбранные значения -> номер состояния (бит i = i-й вариант из options)"""
+    return sum(1 << i for i, option in enumerate(options) if option in (selected or ()))
 
 
-def get_time_slots_keyboard(selected_slots=None):
-    """Клавиатура выбора временных слотов"""
-    if selected_slots is None:
-        selected_slots = []
-    
+def _build_time_slots_keyboard(mask: int):
     keyboard = []
-    for slot_id, slot_name in TIME_SLOTS.items():
+    for i, (slot_id, slot_name) in enumerate(TIME_SLOTS.items()):
         # Добавляем галочку если выбрано
-        prefix = "✅ " if slot_id in selected_slots else ""
+        prefix = "✅ " if mask & (1 << i) else ""
         keyboard.append([InlineKeyboardButton(
             f"{prefix}{slot_name}",
             callback_data=f"slot_{slot_id}"
         )])
     
     # Кнопка подтверждения (только если что-то выбрано)
-    if selected_slots:
+    if mask:
         keyboard.append([InlineKeyboardButton("✅ Подтвердить выбор", callback_data="confirm_slots")])
     
     # Кнопка "Не буду играть"
@@ -110,39 +135,94 @@ def get_time_slots_keyboard(selected_slots=None):
     return InlineKeyboardMarkup(keyboard)
 
 
+def _build_roles_keyboard(mask: int, editing: bool):
+    keyboard = []
+    for i, (role_id, role_name) in enumerate(ROLE_NAMES.items()):
+        prefix = "✅ " if mask & (1 << i) else ""
+        keyboard.append([InlineKeyboardButton(
+            f"{prefix}{role_name}",
+            callback_data=f"role_{role_id}"
+        )])
+    
+    if editing:
+        if mask:
+            keyboard.append([InlineKeyboardButton("✅ Сохранить", callback_data="save_roles")])
+        keyboard.append([InlineKeyboardButton("❌ Отмена", callback_data="edit_profile")])
+    elif mask:
+        # Кнопка готово (если выбрана хотя бы одна роль)
+        keyboard.append([InlineKeyboardButton("✅ Готово", callback_data="roles_done")])
+    
+    return InlineKeyboardMarkup(keyboard)
+
+
+MAIN_MENU_KEYBOARD = InlineKeyboardMarkup([
+    [InlineKeyboardButton("🎮 Мой план на сегодня", callback_data="play_today_slots")],
+    [InlineKeyboardButton("⚡ Найти команду сейчас", callback_data="lobby_join")],
+    [InlineKeyboardButton("👥 Кто играет сегодня?", url="https://valorant-team-finder-ten.vercel.app/")],
+    [InlineKeyboardButton("⚙️ Изменить данные", callback_data="edit_profile")],
+])
+
+LOBBY_KEYBOARD = InlineKeyboardMarkup([
+    [InlineKeyboardButton("❌ Выйти из очереди", callback_data="lobby_leave")],
+    [InlineKeyboardButton("🔙 Назад в меню", callback_data="back_to_menu")],
+])
+
+PROFILE_MENU_KEYBOARD = InlineKeyboardMarkup([
+    [InlineKeyboardButton("🎮 Изменить игровой ник", callback_data="edit_nick")],
+    [InlineKeyboardButton("📊 Изменить ранг", callback_data="edit_rank")],
+    [InlineKeyboardButton("🎯 Изменить роли", callback_data="edit_roles")],
+    [InlineKeyboardButton("🔙 Назад в меню", callback_data="back_to_menu")],
+])
+
+DAILY_NOTIFICATION_KEYBOARD = InlineKeyboardMarkup([
+    [InlineKeyboardButton("🎮 Буду играть сегодня", callback_data="play_today_slots")],
+    [InlineKeyboardButton("❌ Не буду играть", callback_data="cancel_slots")],
+])
+
+RANK_KEYBOARD = InlineKeyboardMarkup([
+    [InlineKeyboardButton(rank, callback_data=f"rank_{rank}")] for rank in RANKS
+])
+
+TIME_SLOTS_KEYBOARDS = tuple(_build_time_slots_keyboard(mask) for mask in range(1 << len(TIME_SLOTS)))
+
+ROLES_KEYBOARDS = {
+    editing: tuple(_build_roles_keyboard(mask, editing) for mask in range(1 << len(ROLE_NAMES)))
+    for editing in (False, True)
+}
+
+
+def get_main_menu_keyboard():
+    """Главное меню"""
+    return MAIN_MENU_KEYBOARD
+
+
+def get_time_slots_keyboard(selected_slots=None):
+    """Клавиатура выбора временных слотов"""
+    return TIME_SLOTS_KEYBOARDS[_selection_mask(selected_slots, TIME_SLOTS)]
+
+
 def get_rank_keyboard():
     """Клавиатура выбора ранга"""
-    ranks = ["Железо", "Бронза", "Серебро", "Золото", 
-             "Платина", "Алмаз", "Бессмертный", "Сияющий"]
-    keyboard = [[InlineKeyboardButton(rank, callback_data=f"rank_{rank}")] 
-                for rank in ranks]
-    return InlineKeyboardMarkup(keyboard)
+    return RANK_KEYBOARD
 
 
-def get_roles_keyboard():
-    """Клавиатура выбора ролей"""
-    roles = [
-        ("💨 Дуэлист", "duelist"),
-        ("🛡 Страж", "sentinel"),
-        ("⚡ Инициатор", "initiator"),
-        ("🎯 Контроллер", "controller")
-    ]
-    keyboard = [[InlineKeyboardButton(name, callback_data=f"role_{value}")] 
-                for name, value in roles]
-    return InlineKeyboardMarkup(keyboard)
+def get_roles_keyboard(selected_roles=None, editing: bool = False):
+    """Клавиатура выбора ролей (регистрация или редактирование профиля)"""
+    return ROLES_KEYBOARDS[editing][_selection_mask(selected_roles, ROLE_NAMES)]
 
 
 # ======================
 # РЕГИСТРАЦИЯ
 # ======================
 
+@metrics.track_handler
 async def start(update: Update, context: ContextTypes.DEFAULT_TYPE):
     """Обработчик команды /start"""
     user = update.effective_user
     telegram_id = user.id
     
     # Проверяем, зарегистрирован ли пользователь
-    player = database.get_player(telegram_id)
+    player = await db.get_player(telegram_id)
     
     if player:
         # Пользователь уже зарегистрирован
@@ -153,6 +233,9 @@ async def start(update: Update, context: ContextTypes.DEFAULT_TYPE):
             "Что хочешь сделать?",
             reply_markup=get_main_menu_keyboard()
         )
+    elif not db.is_available():
+        # Профиль не загрузить - не начинаем регистрацию заново
+        await update.message.reply_text(DB_UNAVAILABLE_TEXT)
     else:
         # Новый пользователь - начинаем регистрацию
         await update.message.reply_text(
@@ -165,6 +248,7 @@ async def start(update: Update, context: ContextTypes.DEFAULT_TYPE):
     return ConversationHandler.END
 
 
+@metrics.track_handler
 async def get_valorant_nick(update: Update, context: ContextTypes.DEFAULT_TYPE):
     """Получение игрового ника (регистрация)"""
     nick = update.message.text.strip()
@@ -185,6 +269,7 @@ async def get_valorant_nick(update: Update, context: ContextTypes.DEFAULT_TYPE):
     return RANK
 
 
+@metrics.track_handler
 async def handle_nick_input(update: Update, context: ContextTypes.DEFAULT_TYPE):
     """Обработка ввода ника (может быть регистрация или редактирование)"""
     # Проверяем режим
@@ -194,37 +279,27 @@ async def handle_nick_input(update: Update, context: ContextTypes.DEFAULT_TYPE):
         return await get_valorant_nick(update, context)
 
 
+@metrics.track_handler
 async def get_rank(update: Update, context: ContextTypes.DEFAULT_TYPE):
     """Получение ранга (регистрация)"""
     query = update.callback_query
-    await query.answer()
-    
     rank = query.data.replace("rank_", "")
     context.user_data['rank'] = rank
     context.user_data['roles'] = []
     
-    await query.edit_message_text(
+    await render.edit_message(
+        query,
         f"✅ Ранг: {rank}\n\n"
         "🎯 Выбери роли, которыми играешь (можно выбрать несколько):",
-        reply_markup=get_roles_keyboard()
+        reply_markup=get_roles_keyboard(),
+        answer=True
     )
-    return ROLES
-
-
-async def handle_rank_callback(update: Update, context: ContextTypes.DEFAULT_TYPE):
-    """Обработка выбора ранга (может быть регистрация или редактирование)"""
-    # Проверяем режим
-    if context.user_data.get('editing') == 'rank':
-        return await save_edited_rank(update, context)
-    else:
-        return await get_rank(update, context)
 
 
+@metrics.track_handler
 async def get_roles(update: Update, context: ContextTypes.DEFAULT_TYPE):
     """Получение ролей"""
     query = update.callback_query
-    await query.answer()
-    
     role = query.data.replace("role_", "")
     roles = context.user_data.get('roles', [])
     
@@ -236,34 +311,16 @@ async def get_roles(update: Update, context: ContextTypes.DEFAULT_TYPE):
     
     context.user_data['roles'] = roles
     
-    # Создаем клавиатуру с отметками
-    roles_dict = {
-        "duelist": "💨 Дуэлист",
-        "sentinel": "🛡 Страж",
-        "initiator": "⚡ Инициатор",
-        "controller": "🎯 Контроллер"
-    }
-    
-    keyboard = []
-    for role_id, role_name in roles_dict.items():
-        prefix = "✅ " if role_id in roles else ""
-        keyboard.append([InlineKeyboardButton(
-            f"{prefix}{role_name}",
-            callback_data=f"role_{role_id}"
-        )])
-    
-    # Кнопка готово (если выбрана хотя бы одна роль)
-    if roles:
-        keyboard.append([InlineKeyboardButton("✅ Готово", callback_data="roles_done")])
-    
-    await query.edit_message_text(
+    await render.edit_message(
+        query,
         f"✅ Ранг: {context.user_data['rank']}\n\n"
         f"🎯 Выбери роли (выбрано: {len(roles)}):",
-        reply_markup=InlineKeyboardMarkup(keyboard)
+        reply_markup=get_roles_keyboard(roles),
+        answer=True
     )
-    return ROLES
 
 
+@metrics.track_handler
 async def finish_registration(update: Update, context: ContextTypes.DEFAULT_TYPE):
     """Завершение регистрации"""
     query = update.callback_query
@@ -276,10 +333,11 @@ async def finish_registration(update: Update, context: ContextTypes.DEFAULT_TYPE
     roles = context.user_data['roles']
     
     # Сохраняем в базу
-    success = database.save_player(telegram_id, nick, rank, roles)
+    success = await db.save_player(telegram_id, nick, rank, roles)
     
     if success:
-        await query.edit_message_text(
+        await render.edit_message(
+            query,
             f"✅ Регистрация завершена!\n\n"
             f"🎮 Ник: {nick}\n"
             f"📊 Ранг: {rank}\n"
@@ -288,13 +346,13 @@ async def finish_registration(update: Update, context: ContextTypes.DEFAULT_TYPE
             reply_markup=get_main_menu_keyboard()
         )
     else:
-        await query.edit_message_text(
-            "❌ Ошибка при сохранении данных. Попробуй еще раз: /start"
+        await render.edit_message(
+            query,
+            error_text("❌ Ошибка при сохранении данных. Попробуй еще раз: /start")
         )
-    
-    return ConversationHandler.END
 
 
+@metrics.track_handler
 async def cancel(update: Update, context: ContextTypes.DEFAULT_TYPE):
     """Отмена регистрации"""
     await update.message.reply_text(
@@ -307,6 +365,7 @@ async def cancel(update: Update, context: ContextTypes.DEFAULT_TYPE):
 # ВЫБОР ВРЕМЕННЫХ СЛОТОВ
 # ======================
 
+@metrics.track_handler
 async def play_today_slots(update: Update, context: ContextTypes.DEFAULT_TYPE):
     """Начало выбора временных слотов (или изменение существующих)"""
     query = update.callback_query
@@ -317,7 +376,7 @@ async def play_today_slots(update: Update, context: ContextTypes.DEFAULT_TYPE):
     today = datetime.now().date().isoformat()
     
     # Получаем текущий план
-    current_status = database.get_daily_status(telegram_id, today)
+    current_status = await db.get_daily_status(telegram_id, today)
     current_slots = current_status.get('time_slots', []) if current_status else []
     
     # Инициализируем выбранные слоты текущим планом
@@ -331,17 +390,17 @@ async def play_today_slots(update: Update, context: ContextTypes.DEFAULT_TYPE):
     else:
         message = "🎮 Выбери время когда будешь играть сегодня\n(можно выбрать несколько):"
     
-    await query.edit_message_text(
+    await render.edit_message(
+        query,
         message,
         reply_markup=get_time_slots_keyboard(current_slots)
     )
 
 
+@metrics.track_handler
 async def toggle_slot(update: Update, context: ContextTypes.DEFAULT_TYPE):
     """Переключение временного слота"""
     query = update.callback_query
-    await query.answer()
-    
     slot = query.data.replace("slot_", "")
     selected_slots = context.user_data.get('selected_slots', [])
     
@@ -353,13 +412,26 @@ async def toggle_slot(update: Update, context: ContextTypes.DEFAULT_TYPE):
     
     context.user_data['selected_slots'] = selected_slots
     
-    await query.edit_message_text(
+    await render.edit_message(
+        query,
         "🎮 Выбери время когда будешь играть сегодня\n"
         f"(выбрано: {len(selected_slots)}):",
-        reply_markup=get_time_slots_keyboard(selected_slots)
+        reply_markup=get_time_slots_keyboard(selected_slots),
+        answer=True
     )
 
 
+def _player_link(player: dict) -> str:
+    """Ссылка на игрока в Telegram (Markdown)"""
+    # Используем telegram username если есть, иначе создаём ссылку по ID
+    if player.get('telegram_username'):
+        return f"@{player['telegram_username']}"
+    # Создаём кликабельную ссылку через tg://user?id= (имя сохраняется не у всех)
+    name = player.get('telegram_first_name') or player.get('valorant_nick')
+    return f"[{name}](tg://user?id={player['telegram_id']})"
+
+
+@metrics.track_handler
 async def confirm_slots(update: Update, context: ContextTypes.DEFAULT_TYPE):
     """Подтверждение выбора слотов"""
     query = update.callback_query
@@ -370,25 +442,28 @@ async def confirm_slots(update: Update, context: ContextTypes.DEFAULT_TYPE):
     selected_slots = context.user_data.get('selected_slots', [])
     
     if not selected_slots:
-        await query.edit_message_text(
+        await render.edit_message(
+            query,
             "❌ Нужно выбрать хотя бы один временной слот!",
             reply_markup=get_time_slots_keyboard([])
         )
         return
     
-    # Сохраняем в базу
+    # Сохраняем статус и получаем других игроков в эти же слоты
+    # (ближайших по рангу и ролям) одним обращением к базе
     today = datetime.now().date().isoformat()
-    success = database.update_daily_status(telegram_id, today, True, selected_slots)
+    teammates = await db.confirm_daily_slots(telegram_id, today, selected_slots, limit=5)
     
-    if not success:
-        await query.edit_message_text(
-            "❌ Ошибка при сохранении. Попробуй еще раз.",
+    if teammates is None:
+        await render.edit_message(
+            query,
+            error_text("❌ Ошибка при сохранении. Попробуй еще раз."),
             reply_markup=get_main_menu_keyboard()
         )
         return
     
-    # Получаем других игроков в эти же слоты
-    teammates = database.get_players_by_slots(today, selected_slots, limit=5, exclude_id=telegram_id)
+    # Сбалансированная пятёрка по рангам и ролям в одном из выбранных слотов
+    found = await db.find_team(telegram_id, today, selected_slots)
     
     # Формируем сообщение
     slots_text = ", ".join([TIME_SLOTS_RU[s] for s in selected_slots])
@@ -397,61 +472,63 @@ async def confirm_slots(update: Update, context: ContextTypes.DEFAULT_TYPE):
     message = f"✅ {date_text}\n\n"
     message += f"Сегодня вы будете играть {slots_text}"
     
-    if teammates:
+    if found:
+        slot, team = found
+        message += f"\n\n⚔️ Ваша команда {TIME_SLOTS_RU[slot]}:\n"
+        for position, member in team.lineup():
+            message += f"• {POSITION_NAMES[position]}: {_player_link(member)} ({member['valorant_nick']}, {member['rank']})\n"
+    elif teammates:
         message += "\n\n👥 В это же время с вами будут играть:\n"
         for teammate in teammates[:5]:
-            # Используем telegram username если есть, иначе создаём ссылку по ID
-            if teammate.get('telegram_username'):
-                telegram_link = f"@{teammate['telegram_username']}"
-            else:
-                # Создаём кликабельную ссылку через tg://user?id=
-                telegram_link = f"[{teammate['telegram_first_name']}](tg://user?id={teammate['telegram_id']})"
-            
-            valorant_nick = teammate['valorant_nick']
-            message += f"• {telegram_link} ({valorant_nick})\n"
+            message += f"• {_player_link(teammate)} ({teammate['valorant_nick']})\n"
     else:
         message += "\n\n🔍 Пока никто больше не планирует играть в это время"
     
-    await query.edit_message_text(
+    await render.edit_message(
+        query,
         message,
         reply_markup=get_main_menu_keyboard(),
         parse_mode='Markdown'
     )
 
 
+@metrics.track_handler
 async def not_playing_today(update: Update, context: ContextTypes.DEFAULT_TYPE):
     """Пользователь не будет играть сегодня"""
     query = update.callback_query
-    await query.answer()
-    
     user = update.effective_user
     telegram_id = user.id
     today = datetime.now().date().isoformat()
     
-    # Удаляем или помечаем как не играющий
-    success = database.update_daily_status(telegram_id, today, False, [])
+    # Помечаем как не играющий (запись в базу - при ближайшем сбросе буфера)
+    success = db.queue_daily_status(telegram_id, today, False, [])
     
     if success:
-        await query.edit_message_text(
+        await render.edit_message(
+            query,
             "✅ Понял! Сегодня ты не будешь играть.\n\n"
             "Твой статус обновлён.",
-            reply_markup=get_main_menu_keyboard()
+            reply_markup=get_main_menu_keyboard(),
+            answer=True
         )
     else:
-        await query.edit_message_text(
-            "❌ Ошибка при обновлении статуса. Попробуй еще раз.",
-            reply_markup=get_main_menu_keyboard()
+        await render.edit_message(
+            query,
+            error_text("❌ Ошибка при обновлении статуса. Попробуй еще раз."),
+            reply_markup=get_main_menu_keyboard(),
+            answer=True
         )
 
 
+@metrics.track_handler
 async def cancel_slots(update: Update, context: ContextTypes.DEFAULT_TYPE):
     """Отмена выбора слотов"""
     query = update.callback_query
-    await query.answer()
-    
-    await query.edit_message_text(
+    await render.edit_message(
+        query,
         "❌ Выбор отменен",
-        reply_markup=get_main_menu_keyboard()
+        reply_markup=get_main_menu_keyboard(),
+        answer=True
     )
 
 
@@ -459,6 +536,7 @@ async def cancel_slots(update: Update, context: ContextTypes.DEFAULT_TYPE):
 # ИЗМЕНЕНИЕ ПЛАНА
 # ======================
 
+@metrics.track_handler
 async def change_plan(update: Update, context: ContextTypes.DEFAULT_TYPE):
     """Изменение плана на сегодня"""
     query = update.callback_query
@@ -469,7 +547,7 @@ async def change_plan(update: Update, context: ContextTypes.DEFAULT_TYPE):
     today = datetime.now().date().isoformat()
     
     # Получаем текущий план
-    current_status = database.get_daily_status(telegram_id, today)
+    current_status = await db.get_daily_status(telegram_id, today)
     current_slots = current_status.get('time_slots', []) if current_status else []
     
     # Инициализируем выбранные слоты текущим планом
@@ -484,7 +562,8 @@ async def change_plan(update: Update, context: ContextTypes.DEFAULT_TYPE):
     
     message += "Выберите новое время:"
     
-    await query.edit_message_text(
+    await render.edit_message(
+        query,
         message,
         reply_markup=get_time_slots_keyboard(current_slots)
     )
@@ -494,65 +573,65 @@ async def change_plan(update: Update, context: ContextTypes.DEFAULT_TYPE):
 # ДРУГИЕ КОМАНДЫ
 # ======================
 
+@metrics.track_handler
 async def edit_profile(update: Update, context: ContextTypes.DEFAULT_TYPE):
     """Меню редактирования профиля"""
     query = update.callback_query
     await query.answer()
     
+    # Сюда же ведёт "Отмена" из редактирования ролей
+    context.user_data.pop('editing', None)
+    
     user = update.effective_user
     telegram_id = user.id
-    player = database.get_player(telegram_id)
+    player = await db.get_player(telegram_id)
     
     if not player:
-        await query.edit_message_text(
-            "❌ Профиль не найден. Начните регистрацию: /start"
+        await render.edit_message(
+            query,
+            error_text("❌ Профиль не найден. Начните регистрацию: /start")
         )
         return
     
-    keyboard = [
-        [InlineKeyboardButton("🎮 Изменить игровой ник", callback_data="edit_nick")],
-        [InlineKeyboardButton("📊 Изменить ранг", callback_data="edit_rank")],
-        [InlineKeyboardButton("🎯 Изменить роли", callback_data="edit_roles")],
-        [InlineKeyboardButton("🔙 Назад в меню", callback_data="back_to_menu")],
-    ]
-    reply_markup = InlineKeyboardMarkup(keyboard)
-    
-    await query.edit_message_text(
+    await render.edit_message(
+        query,
         f"⚙️ Редактирование профиля\n\n"
         f"🎮 Ник: {player['valorant_nick']}\n"
         f"📊 Ранг: {player['rank']}\n"
         f"🎯 Роли: {', '.join(player['roles'])}\n\n"
         "Что хочешь изменить?",
-        reply_markup=reply_markup
+        reply_markup=PROFILE_MENU_KEYBOARD
     )
 
 
+@metrics.track_handler
 async def edit_nick_start(update: Update, context: ContextTypes.DEFAULT_TYPE):
     """Начало изменения ника"""
     query = update.callback_query
-    await query.answer()
-    
-    await query.edit_message_text(
+    await render.edit_message(
+        query,
         "🎮 Изменение игрового ника\n\n"
-        "Введи новый ник в VALORANT:"
+        "Введи новый ник в VALORANT:",
+        answer=True
     )
     context.user_data['editing'] = 'nick'
-    return VALORANT_NICK
 
 
+@metrics.track_handler
 async def edit_rank_start(update: Update, context: ContextTypes.DEFAULT_TYPE):
     """Начало изменения ранга"""
     query = update.callback_query
-    await query.answer()
-    
-    await query.edit_message_text(
+    await render.edit_message(
+        query,
         "📊 Изменение ранга\n\n"
         "Выбери новый ранг:",
-        reply_markup=get_rank_keyboard()
+        reply_markup=get_rank_keyboard(),
+        answer=True
     )
     context.user_data['editing'] = 'rank'
 
 
+@metrics.track_handler
 async def edit_roles_start(update: Update, context: ContextTypes.DEFAULT_TYPE):
     """Начало изменения ролей"""
     query = update.callback_query
@@ -560,39 +639,21 @@ async def edit_roles_start(update: Update, context: ContextTypes.DEFAULT_TYPE):
     
     user = update.effective_user
     telegram_id = user.id
-    player = database.get_player(telegram_id)
+    player = await db.get_player(telegram_id)
     
     # Инициализируем текущие роли
     context.user_data['roles'] = player['roles'].copy()
     context.user_data['editing'] = 'roles'
     
-    # Создаем клавиатуру с отметками текущих ролей
-    roles_dict = {
-        "duelist": "💨 Дуэлист",
-        "sentinel": "🛡 Страж",
-        "initiator": "⚡ Инициатор",
-        "controller": "🎯 Контроллер"
-    }
-    
-    keyboard = []
-    for role_id, role_name in roles_dict.items():
-        prefix = "✅ " if role_id in context.user_data['roles'] else ""
-        keyboard.append([InlineKeyboardButton(
-            f"{prefix}{role_name}",
-            callback_data=f"role_{role_id}"
-        )])
-    
-    if context.user_data['roles']:
-        keyboard.append([InlineKeyboardButton("✅ Сохранить", callback_data="save_roles")])
-    keyboard.append([InlineKeyboardButton("❌ Отмена", callback_data="edit_profile")])
-    
-    await query.edit_message_text(
+    await render.edit_message(
+        query,
         f"🎯 Изменение ролей\n\n"
         f"Выбери роли (сейчас выбрано: {len(context.user_data['roles'])}):",
-        reply_markup=InlineKeyboardMarkup(keyboard)
+        reply_markup=get_roles_keyboard(context.user_data['roles'], editing=True)
     )
 
 
+@metrics.track_handler
 async def save_edited_nick(update: Update, context: ContextTypes.DEFAULT_TYPE):
     """Сохранение нового ника"""
     user = update.effective_user
@@ -605,16 +666,8 @@ async def save_edited_nick(update: Update, context: ContextTypes.DEFAULT_TYPE):
         )
         return VALORANT_NICK
     
-    # Получаем текущий профиль
-    player = database.get_player(telegram_id)
-    if not player:
-        await update.message.reply_text(
-            "❌ Ошибка. Начни заново: /start"
-        )
-        return ConversationHandler.END
-    
-    # Сохраняем с новым ником
-    success = database.save_player(telegram_id, new_nick, player['rank'], player['roles'])
+    # Обновляем только ник (отложенная запись, см. flush_pending_writes)
+    success = db.queue_player_fields(telegram_id, valorant_nick=new_nick)
     
     if success:
         await update.message.reply_text(
@@ -623,52 +676,45 @@ async def save_edited_nick(update: Update, context: ContextTypes.DEFAULT_TYPE):
         )
     else:
         await update.message.reply_text(
-            "❌ Ошибка при сохранении. Попробуй еще раз: /start"
+            error_text("❌ Ошибка при сохранении. Попробуй еще раз: /start")
         )
     
     context.user_data.pop('editing', None)
     return ConversationHandler.END
 
 
+@metrics.track_handler
 async def save_edited_rank(update: Update, context: ContextTypes.DEFAULT_TYPE):
     """Сохранение нового ранга"""
     query = update.callback_query
-    await query.answer()
-    
     user = update.effective_user
     telegram_id = user.id
     new_rank = query.data.replace("rank_", "")
     
-    # Получаем текущий профиль
-    player = database.get_player(telegram_id)
-    if not player:
-        await query.edit_message_text(
-            "❌ Ошибка. Начни заново: /start"
-        )
-        return ConversationHandler.END
-    
-    # Сохраняем с новым рангом
-    success = database.save_player(telegram_id, player['valorant_nick'], new_rank, player['roles'])
+    # Обновляем только ранг
+    success = db.queue_player_fields(telegram_id, rank=new_rank)
     
     if success:
-        await query.edit_message_text(
+        await render.edit_message(
+            query,
             f"✅ Ранг изменён на: {new_rank}",
-            reply_markup=get_main_menu_keyboard()
+            reply_markup=get_main_menu_keyboard(),
+            answer=True
         )
     else:
-        await query.edit_message_text(
-            "❌ Ошибка при сохранении. Попробуй еще раз: /start"
+        await render.edit_message(
+            query,
+            error_text("❌ Ошибка при сохранении. Попробуй еще раз: /start"),
+            answer=True
         )
     
     context.user_data.pop('editing', None)
-    return ConversationHandler.END
 
 
+@metrics.track_handler
 async def save_edited_roles(update: Update, context: ContextTypes.DEFAULT_TYPE):
     """Сохранение новых ролей"""
     query = update.callback_query
-    await query.answer()
-    
     user = update.effective_user
     telegram_id = user.id
     new_roles = context.user_data.get('roles', [])
@@ -677,32 +723,28 @@ async def save_edited_roles(update: Update, context: ContextTypes.DEFAULT_TYPE):
         await query.answer("❌ Нужно выбрать хотя бы одну роль!", show_alert=True)
         return
     
-    # Получаем текущий профиль
-    player = database.get_player(telegram_id)
-    if not player:
-        await query.edit_message_text(
-            "❌ Ошибка. Начни заново: /start"
-        )
-        return ConversationHandler.END
-    
-    # Сохраняем с новыми ролями
-    success = database.save_player(telegram_id, player['valorant_nick'], player['rank'], new_roles)
+    # Обновляем только роли
+    success = db.queue_player_fields(telegram_id, roles=new_roles)
     
     if success:
-        await query.edit_message_text(
+        await render.edit_message(
+            query,
             f"✅ Роли изменены: {', '.join(new_roles)}",
-            reply_markup=get_main_menu_keyboard()
+            reply_markup=get_main_menu_keyboard(),
+            answer=True
         )
     else:
-        await query.edit_message_text(
-            "❌ Ошибка при сохранении. Попробуй еще раз: /start"
+        await render.edit_message(
+            query,
+            error_text("❌ Ошибка при сохранении. Попробуй еще раз: /start"),
+            answer=True
         )
     
     context.user_data.pop('editing', None)
     context.user_data.pop('roles', None)
-    return ConversationHandler.END
 
 
+@metrics.track_handler
 async def back_to_menu(update: Update, context: ContextTypes.DEFAULT_TYPE):
     """Возврат в главное меню"""
     query = update.callback_query
@@ -710,10 +752,11 @@ async def back_to_menu(update: Update, context: ContextTypes.DEFAULT_TYPE):
     
     user = update.effective_user
     telegram_id = user.id
-    player = database.get_player(telegram_id)
+    player = await db.get_player(telegram_id)
     
     if player:
-        await query.edit_message_text(
+        await render.edit_message(
+            query,
             f"👋 Привет, {player['valorant_nick']}!\n\n"
             f"📊 Твой ранг: {player['rank']}\n"
             f"🎯 Роли: {', '.join(player['roles'])}\n\n"
@@ -721,188 +764,398 @@ async def back_to_menu(update: Update, context: ContextTypes.DEFAULT_TYPE):
             reply_markup=get_main_menu_keyboard()
         )
     else:
-        await query.edit_message_text(
-            "❌ Профиль не найден. Начни заново: /start"
+        await render.edit_message(
+            query,
+            error_text("❌ Профиль не найден. Начни заново: /start")
         )
-    
-    return ConversationHandler.END
 
 
-async def handle_callback(update: Update, context: ContextTypes.DEFAULT_TYPE):
-    """Обработчик callback кнопок"""
+@metrics.track_handler
+async def toggle_edited_role(update: Update, context: ContextTypes.DEFAULT_TYPE):
+    """Переключение роли в режиме редактирования профиля"""
     query = update.callback_query
-    data = query.data
-    
-    # Проверяем контекст редактирования
-    editing = context.user_data.get('editing')
-    
-    if data == "play_today_slots":
-        await play_today_slots(update, context)
-    elif data.startswith("slot_"):
-        await toggle_slot(update, context)
-    elif data == "confirm_slots":
-        await confirm_slots(update, context)
-    elif data == "cancel_slots":
-        await cancel_slots(update, context)
-    elif data == "not_playing":
-        await not_playing_today(update, context)
-    elif data == "edit_profile":
-        await edit_profile(update, context)
-    elif data == "edit_nick":
-        await edit_nick_start(update, context)
-        return VALORANT_NICK
-    elif data == "edit_rank":
-        await edit_rank_start(update, context)
-    elif data.startswith("rank_") and editing == 'rank':
-        await save_edited_rank(update, context)
-        return ConversationHandler.END
-    elif data == "edit_roles":
-        await edit_roles_start(update, context)
-    elif data.startswith("role_") and editing == 'roles':
-        # Переключаем роль в режиме редактирования
-        role = data.replace("role_", "")
-        roles = context.user_data.get('roles', [])
-        
-        if role in roles:
-            roles.remove(role)
-        else:
-            roles.append(role)
-        
-        context.user_data['roles'] = roles
-        
-        # Обновляем клавиатуру
-        roles_dict = {
-            "duelist": "💨 Дуэлист",
-            "sentinel": "🛡 Страж",
-            "initiator": "⚡ Инициатор",
-            "controller": "🎯 Контроллер"
-        }
-        
-        keyboard = []
-        for role_id, role_name in roles_dict.items():
-            prefix = "✅ " if role_id in roles else ""
-            keyboard.append([InlineKeyboardButton(
-                f"{prefix}{role_name}",
-                callback_data=f"role_{role_id}"
-            )])
-        
-        if roles:
-            keyboard.append([InlineKeyboardButton("✅ Сохранить", callback_data="save_roles")])
-        keyboard.append([InlineKeyboardButton("❌ Отмена", callback_data="edit_profile")])
-        
-        await query.edit_message_text(
-            f"🎯 Изменение ролей\n\n"
-            f"Выбери роли (сейчас выбрано: {len(roles)}):",
-            reply_markup=InlineKeyboardMarkup(keyboard)
-        )
-        await query.answer()
-    elif data == "save_roles":
-        await save_edited_roles(update, context)
-        return ConversationHandler.END
-    elif data == "back_to_menu":
-        await back_to_menu(update, context)
-        return ConversationHandler.END
+    role = query.data.replace("role_", "")
+    roles = context.user_data.get('roles', [])
+    
+    if role in roles:
+        roles.remove(role)
     else:
-        await query.answer("⚠️ Неизвестная команда")
+        roles.append(role)
+    
+    context.user_data['roles'] = roles
+    
+    await render.edit_message(
+        query,
+        f"🎯 Изменение ролей\n\n"
+        f"Выбери роли (сейчас выбрано: {len(roles)}):",
+        reply_markup=get_roles_keyboard(roles, editing=True),
+        answer=True
+    )
 
 
 # ======================
 # ЕЖЕДНЕВНЫЕ УВЕДОМЛЕНИЯ
 # ======================
 
+@metrics.track_handler
 async def send_daily_notification(context: ContextTypes.DEFAULT_TYPE):
     """Отправка ежедневных уведомлений"""
     logger.info("Sending daily notifications...")
     
-    # Получаем всех игроков
-    all_players = database.get_all_players()
-    
-    for player in all_players:
-        try:
-            telegram_id = player['telegram_id']
-            
-            keyboard = [
-                [InlineKeyboardButton("🎮 Буду играть сегодня", callback_data="play_today_slots")],
-                [InlineKeyboardButton("❌ Не буду играть", callback_data="cancel_slots")],
-            ]
-            reply_markup = InlineKeyboardMarkup(keyboard)
-            
-            await context.bot.send_message(
-                chat_id=telegram_id,
-                text=f"🌅 Привет, {player['valorant_nick']}!\n\n"
-                     "Будешь играть в VALORANT сегодня?",
-                reply_markup=reply_markup
-            )
-        except Exception as e:
-            logger.error(f"Failed to send notification to {telegram_id}: {e}")
+    def build_message(player):
+        return {
+            'text': f"🌅 Привет, {player['valorant_nick']}!\n\n"
+                    "Будешь играть в VALORANT сегодня?",
+            'reply_markup': DAILY_NOTIFICATION_KEYBOARD,
+        }
     
-    logger.info(f"Notifications sent to {len(all_players)} players")
+    # Игроки загружаются страницами, прогресс сохраняется после каждой страницы
+    today = datetime.now().date().isoformat()
+    broadcaster = Broadcaster(context.bot, db.get_players_page, progress=BroadcastProgress())
+    stats = await broadcaster.run(f"{today}:{context.job.name}", build_message)
+    context.bot_data['last_broadcast'] = stats.as_dict()
+    
+    logger.info(
+        f"Notifications sent: {stats.sent}, blocked: {stats.blocked}, failed: {stats.failed}, "
+        f"unknown (timed out): {stats.unknown}, "
+        f"retries: {stats.retries}, {stats.messages_per_second:.1f} msg/s in {stats.elapsed:.1f}s"
+    )
+
+
+@metrics.track_handler
+async def archive_old_statuses(context: ContextTypes.DEFAULT_TYPE):
+    """Перенос старых дней daily_status в архив (раз в сутки, на воркере 0)"""
+    started = asyncio.get_running_loop().time()
+    moved = await db.archive_old_statuses()
+    elapsed = asyncio.get_running_loop().time() - started
+    context.bot_data['last_archive'] = {
+        'at': datetime.now().isoformat(timespec='seconds'),
+        'retention_days': db.STATUS_RETENTION_DAYS,
+        'moved': moved,
+        'seconds': round(elapsed, 2),
+    }
+    if moved is None:
+        logger.error("Archiving old daily statuses failed, will retry tomorrow")
+    else:
+        logger.info(f"Archived {moved} daily statuses older than {db.STATUS_RETENTION_DAYS} days in {elapsed:.1f}s")
 
 
 # ======================
-# MAIN
+# ОЧЕРЕДЬ "НАЙТИ КОМАНДУ СЕЙЧАС"
 # ======================
+# Сопоставитель запускается в run_bot на воркере 0 (кнопки lobby_* routing.py
+# направляет туда же)
 
-def main():
-    """Запуск бота"""
-    if not BOT_TOKEN:
-        logger.error("BOT_TOKEN не установлен!")
-        return
+lobby = Lobby(RANKS)
+
+
+@metrics.track_handler
+async def lobby_join(update: Update, context: ContextTypes.DEFAULT_TYPE):
+    """Встать в очередь: слоты из плана на сегодня, иначе текущее время суток"""
+    query = update.callback_query
+    await query.answer()
     
-    # Запуск HTTP сервера в отдельном потоке (для Render health checks)
-    http_thread = Thread(target=run_http_server, daemon=True)
-    http_thread.start()
+    user = update.effective_user
+    player = await db.get_player(user.id)
+    if not player:
+        await render.edit_message(query, error_text("❌ Профиль не найден. Начни заново: /start"))
+        return
     
-    application = Application.builder().token(BOT_TOKEN).build()
+    today = datetime.now().date().isoformat()
+    status = await db.get_daily_status(user.id, today)
+    slots = (status.get('time_slots') if status and status.get('is_playing') else None) or [current_time_slot()]
+    
+    # Имя и username из апдейта - чтобы тиммейты могли написать игроку
+    player = {**player, 'telegram_username': user.username, 'telegram_first_name': user.first_name}
+    if not lobby.join(player, slots):
+        await render.edit_message(
+            query,
+            "⚠️ Очередь сейчас недоступна, попробуй позже",
+            reply_markup=get_main_menu_keyboard()
+        )
+        return
     
-    # Conversation handler для регистрации и редактирования
+    slots_text = ", ".join(TIME_SLOTS_RU[s] for s in slots)
+    await render.edit_message(
+        query,
+        f"🔎 Ищем команду ({slots_text})...\n\n"
+        f"👥 Сейчас в очереди: {max(lobby.size(), 1)}\n"
+        "Как только соберётся пятёрка по рангу и ролям, пришлю состав всем пятерым.",
+        reply_markup=LOBBY_KEYBOARD
+    )
+
+
+@metrics.track_handler
+async def lobby_leave(update: Update, context: ContextTypes.DEFAULT_TYPE):
+    """Выйти из очереди"""
+    query = update.callback_query
+    lobby.leave(update.effective_user.id)
+    await render.edit_message(
+        query,
+        "✅ Ты вышел из очереди",
+        reply_markup=get_main_menu_keyboard(),
+        answer=True
+    )
+
+
+async def notify_lobby_team(bot, match):
+    """Отправить состав собранной пятёрки всем пятерым"""
+    team = match.team
+    message = f"⚡ Команда собрана ({TIME_SLOTS_RU[match.slot]})!\n\n"
+    for position, member in team.lineup():
+        message += f"• {POSITION_NAMES[position]}: {_player_link(member)} ({member['valorant_nick']}, {member['rank']})\n"
+    message += "\nНапиши тиммейтам и заходи в игру 🎮"
+    
+    results = await asyncio.gather(*(
+        bot.send_message(member['telegram_id'], message, parse_mode='Markdown',
+                         reply_markup=get_main_menu_keyboard())
+        for member in team.players
+    ), return_exceptions=True)
+    failed = [result for result in results if isinstance(result, Exception)]
+    if failed:
+        logger.warning(f"Lobby team notification failed for {len(failed)} of {len(results)}: {failed[0]}")
+
+
+async def notify_lobby_expired(bot, player):
+    """Сообщить игроку, что время ожидания в очереди истекло"""
+    await bot.send_message(
+        player['telegram_id'],
+        "⌛ Команда не собралась, ты больше не в очереди. Попробуй ещё раз позже!",
+        reply_markup=get_main_menu_keyboard()
+    )
+
+
+# ======================
+# МАРШРУТЫ КНОПОК
+# ======================
+# Все callback-кнопки и состояние диалога после каждой из них.
+# mode - режим редактирования профиля (user_data['editing'])
+
+callback_router = CallbackRouter()
+
+callback_router.add(play_today_slots, data="play_today_slots")
+callback_router.add(toggle_slot, prefix="slot_")
+callback_router.add(confirm_slots, data="confirm_slots")
+callback_router.add(cancel_slots, data="cancel_slots")
+callback_router.add(not_playing_today, data="not_playing")
+callback_router.add(lobby_join, data="lobby_join")
+callback_router.add(lobby_leave, data="lobby_leave")
+
+# Регистрация: ранг -> роли -> готово
+callback_router.add(get_rank, prefix="rank_", next_state=ROLES)
+callback_router.add(get_roles, prefix="role_", next_state=ROLES)
+callback_router.add(finish_registration, data="roles_done", next_state=ConversationHandler.END)
+
+# Редактирование профиля
+callback_router.add(edit_profile, data="edit_profile", next_state=ConversationHandler.END)
+callback_router.add(edit_nick_start, data="edit_nick", next_state=VALORANT_NICK)
+callback_router.add(edit_rank_start, data="edit_rank", next_state=RANK)
+callback_router.add(save_edited_rank, prefix="rank_", mode='rank', next_state=ConversationHandler.END)
+callback_router.add(edit_roles_start, data="edit_roles", next_state=ROLES)
+callback_router.add(toggle_edited_role, prefix="role_", mode='roles', next_state=ROLES)
+callback_router.add(save_edited_roles, data="save_roles", next_state=ConversationHandler.END)
+callback_router.add(back_to_menu, data="back_to_menu", next_state=ConversationHandler.END)
+
+
+# ======================
+# MAIN
+# ======================
+
+def add_handlers(application: Application, persistent: bool = False):
+    """Зарегистрировать обработчики команд и кнопок (используется и в bench/bench_bot.py)"""
+    # Conversation handler для регистрации и редактирования. Все кнопки
+    # обрабатывает callback_router, он же возвращает следующее состояние
+    routed_callbacks = CallbackQueryHandler(callback_router.dispatch, pattern=callback_router.pattern())
     conv_handler = ConversationHandler(
         entry_points=[
             CommandHandler('start', start),
-            CallbackQueryHandler(edit_nick_start, pattern="^edit_nick$"),
-            CallbackQueryHandler(edit_rank_start, pattern="^edit_rank$"),
-            CallbackQueryHandler(edit_roles_start, pattern="^edit_roles$"),
+            routed_callbacks,
         ],
         states={
             VALORANT_NICK: [
                 MessageHandler(filters.TEXT & ~filters.COMMAND, handle_nick_input),
             ],
-            RANK: [
-                CallbackQueryHandler(handle_rank_callback, pattern="^rank_"),
-            ],
-            ROLES: [
-                CallbackQueryHandler(get_roles, pattern="^role_"),
-                CallbackQueryHandler(finish_registration, pattern="^roles_done$"),
-                CallbackQueryHandler(save_edited_roles, pattern="^save_roles$"),
-            ],
+            RANK: [routed_callbacks],
+            ROLES: [routed_callbacks],
         },
         fallbacks=[
             CommandHandler('cancel', cancel),
-            CallbackQueryHandler(back_to_menu, pattern="^back_to_menu$"),
-            CallbackQueryHandler(edit_profile, pattern="^edit_profile$"),
+            routed_callbacks,
         ],
-        per_message=False
+        per_message=False,
+        name='main_conversation',
+        persistent=persistent,
     )
     
     application.add_handler(conv_handler)
-    application.add_handler(CallbackQueryHandler(handle_callback))
-    
-    # Ежедневные уведомления (если доступен job_queue)
+    # Кнопки без маршрута (например, из старых сообщений) - ответ "неизвестная команда"
+    application.add_handler(CallbackQueryHandler(callback_router.dispatch))
+
+
+def main():
+    """Запуск бота"""
+    if not BOT_TOKEN:
+        logger.error("BOT_TOKEN не установлен!")
+        return
+    if len(WORKER_URLS) > 1 and not os.environ.get('WEBHOOK_SECRET'):
+        # Случайный секрет у каждого воркера свой: пересланные апдейты получили бы 403
+        logger.error("При нескольких воркерах (WORKER_URLS) нужен общий WEBHOOK_SECRET")
+        sys.exit(1)
+    
+    # Состояние диалогов вне процесса (PERSISTENCE=sqlite|postgres), иначе в памяти
+    persistence = create_persistence()
+    builder = Application.builder().token(BOT_TOKEN)
+    if persistence:
+        builder = builder.persistence(persistence)
+    application = builder.build()
+    
+    add_handlers(application, persistent=persistence is not None)
+    
+    # Ежедневные уведомления (если доступен job_queue); при нескольких
+    # воркерах рассылку ведёт только нулевой, иначе сообщения уйдут N раз
     try:
         job_queue = application.job_queue
-        if job_queue:
+        if job_queue and WORKER_INDEX != 0:
+            logger.info(f"Воркер {WORKER_INDEX}: ежедневные уведомления и архивацию ведёт воркер 0")
+        elif job_queue:
             # Устанавливаем время в UTC (10:00 UTC = 13:00 MSK, 18:00 UTC = 21:00 MSK)
             # Если нужно 10:00 и 18:00 по Москве, то в UTC это 07:00 и 15:00
-            job_queue.run_daily(send_daily_notification, time=time(7, 0, 0))  # 10:00 MSK
-            job_queue.run_daily(send_daily_notification, time=time(15, 0, 0))  # 18:00 MSK
+            job_queue.run_daily(send_daily_notification, time=time(7, 0, 0), name='morning')  # 10:00 MSK
+            job_queue.run_daily(send_daily_notification, time=time(15, 0, 0), name='evening')  # 18:00 MSK
             logger.info("Ежедневные уведомления настроены на 10:00 и 18:00 МСК (7:00 и 15:00 UTC)")
+            
+            # Архив старых дней - ночью, когда почти никто не отмечается (03:30 МСК)
+            if db.STATUS_RETENTION_DAYS > 0:
+                job_queue.run_daily(archive_old_statuses, time=time(0, 30, 0), name='archive')
+                logger.info(f"daily_status хранит {db.STATUS_RETENTION_DAYS} дн., архивация в 03:30 МСК")
+            
+            # Продолжаем рассылку, прерванную перезапуском бота
+            unfinished = BroadcastProgress().unfinished()
+            today = datetime.now().date().isoformat()
+            if unfinished and unfinished.startswith(f"{today}:"):
+                job_name = unfinished.split(':', 1)[1]
+                job_queue.run_once(send_daily_notification, when=5, name=job_name)
+                logger.info(f"Рассылка {unfinished} будет продолжена")
         else:
             logger.warning("JobQueue недоступен. Ежедневные уведомления отключены.")
     except Exception as e:
         logger.warning(f"Не удалось настроить ежедневные уведомления: {e}")
     
-    logger.info("Бот запущен!")
-    application.run_polling(allowed_updates=Update.ALL_TYPES)
+    asyncio.run(run_bot(application))
+    db.shutdown()
+
+
+async def flush_pending_writes(bot):
+    """Периодически сбрасывать буфер отложенных записей в базу (на каждом воркере)"""
+    while True:
+        await asyncio.sleep(db.WRITE_FLUSH_INTERVAL)
+        await db.flush_writes()
+        for telegram_id, kind in db.take_dropped_writes():
+            await notify_dropped_write(bot, telegram_id, kind)
+
+
+# Пользователь уже видел "✅", но база отклонила запись при сбросе буфера
+DROPPED_WRITE_TEXT = {
+    'status': "⚠️ Не удалось сохранить твой ответ на сегодня. Отметься ещё раз через меню.",
+    'profile': "⚠️ Не удалось сохранить изменения профиля. Попробуй изменить его ещё раз.",
+}
+
+
+async def notify_dropped_write(bot, telegram_id: int, kind: str):
+    """Сообщить пользователю, что его отложенное изменение не сохранилось"""
+    try:
+        await bot.send_message(telegram_id, DROPPED_WRITE_TEXT[kind], reply_markup=get_main_menu_keyboard())
+    except TelegramError as e:
+        logger.warning(f"Failed to notify {telegram_id} about a dropped {kind} write: {e}")
+
+
+async def run_bot(application: Application):
+    """
+    Запуск бота и HTTP сервера в одном event loop
+    
+    Если задан WEBHOOK_URL - апдейты приходят вебхуком на тот же порт, что и
+    health check, иначе бот получает их через long polling.
+    """
+    router = create_router(WEBHOOK_PATH, WEBHOOK_SECRET)
+    server = BotWebServer(
+        application,
+        PORT,
+        webhook_path=WEBHOOK_PATH if WEBHOOK_URL else None,
+        secret_token=WEBHOOK_SECRET,
+        router=router,
+        stats_provider=lambda: {
+            'worker_index': WORKER_INDEX,
+            'db_client': db.get_client_stats(),
+            'db_breaker': db.get_breaker_stats(),
+            'player_cache': db.get_player_cache_stats(),
+            'render': render.get_render_stats(),
+            'routes': callback_router.stats(),
+            'write_buffer': db.get_write_buffer_stats(),
+            'lobby': lobby.stats(),
+            'last_broadcast': application.bot_data.get('last_broadcast'),
+            'last_archive': application.bot_data.get('last_archive'),
+        },
+        health_provider=lambda: {
+            'status': 'ok' if db.is_available() else 'degraded',
+            'worker_index': WORKER_INDEX,
+            'database': db.get_breaker_stats(),
+        },
+    )
+    
+    stop_event = asyncio.Event()
+    loop = asyncio.get_running_loop()
+    for sig in (signal.SIGINT, signal.SIGTERM):
+        try:
+            loop.add_signal_handler(sig, stop_event.set)
+        except NotImplementedError:
+            pass
+    
+    async with application:
+        await application.start()
+        await server.start()
+        
+        # Клиент базы создаётся лениво; здесь - заранее, пока апдейтов ещё нет
+        try:
+            await db.warm_up_client()
+            logger.info(f"Клиент Supabase создан за {db.get_client_stats()['init_ms']} мс")
+        except Exception as e:
+            logger.error(f"Не удалось создать клиент Supabase (повтор при первом запросе): {e}")
+        
+        if WEBHOOK_URL and WORKER_INDEX != 0:
+            # Вебхук (адрес балансировщика) регистрирует воркер 0
+            logger.info(f"Воркер {WORKER_INDEX} принимает апдейты на {WEBHOOK_PATH}")
+        elif WEBHOOK_URL:
+            await application.bot.set_webhook(
+                url=f"{WEBHOOK_URL}{WEBHOOK_PATH}",
+                secret_token=WEBHOOK_SECRET,
+                allowed_updates=Update.ALL_TYPES,
+            )
+            logger.info(f"Бот запущен в режиме вебхука: {WEBHOOK_URL}{WEBHOOK_PATH}")
+        else:
+            if router.enabled:
+                logger.warning("WORKER_URLS задан, но без WEBHOOK_URL апдейты получает каждый воркер через polling")
+            await application.bot.delete_webhook()
+            await application.updater.start_polling(allowed_updates=Update.ALL_TYPES)
+            logger.info("Бот запущен в режиме polling!")
+        
+        flusher = asyncio.create_task(flush_pending_writes(application.bot))
+        if WORKER_INDEX == 0:
+            lobby.start(
+                on_match=lambda match: notify_lobby_team(application.bot, match),
+                on_expire=lambda player: notify_lobby_expired(application.bot, player),
+            )
+        await stop_event.wait()
+        
+        logger.info("Остановка бота...")
+        flusher.cancel()
+        await lobby.stop()
+        await server.stop()
+        await router.close()
+        if application.updater and application.updater.running:
+            await application.updater.stop()
+        await application.stop()
+        # Последние изменения, накопленные в буфере
+        await db.flush_writes()
 
 
 if __name__ == '__main__':
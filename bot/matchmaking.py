@@ -0,0 +1,223 @@
+"""
+Составление команд по 5 человек из всех играющих в (дата, слот)
+Игроки раскладываются по корзинам рангов; команда собирается вокруг самого
+низкого по рангу свободного игрока из соседних рангов (разброс не больше
+MAX_RANK_SPREAD), недостающие роли добираются в первую очередь. Позиции в
+готовой команде назначаются точно - динамикой по подмножествам позиций
+(5 игроков x 2^5 состояний) вместо перебора перестановок.
+
+Весь пул обрабатывается за один проход: каждый игрок попадает в команду
+или в список оставшихся, время растёт линейно с размером пула.
+"""
+import functools
+from collections import deque
+from dataclasses import dataclass, field
+
+TEAM_SIZE = 5
+ROLES = ('duelist', 'sentinel', 'initiator', 'controller')
+# Четыре роли и одно место для любой роли
+POSITIONS = ROLES + ('flex',)
+
+# Максимальная разница рангов в команде (2 - например Золото, Платина и Алмаз)
+MAX_RANK_SPREAD = 2
+
+
+@dataclass
+class Team:
+    """Команда: игроки, позиция каждого и показатели качества"""
+    players: list
+    positions: dict = field(default_factory=dict)  # telegram_id -> позиция
+    rank_spread: int = 0
+    off_role: int = 0  # сколько игроков стоит не на своей роли
+
+    def lineup(self) -> list:
+        """[(позиция, игрок)] в порядке POSITIONS"""
+        return sorted(((self.positions[player['telegram_id']], player) for player in self.players),
+                      key=lambda item: POSITIONS.index(item[0]))
+
+    def as_dict(self) -> dict:
+        return {
+            'players': [dict(player, position=self.positions[player['telegram_id']]) for player in self.players],
+            'rank_spread': self.rank_spread,
+            'off_role': self.off_role,
+        }
+
+
+# Бит позиции в маске; flex подходит любому игроку
+_POSITION_BITS = {position: 1 << j for j, position in enumerate(POSITIONS)}
+_FLEX_BIT = _POSITION_BITS['flex']
+# Маски занятых позиций, сгруппированные по числу занятых (слои динамики)
+_LAYERS = [[mask for mask in range(1 << len(POSITIONS)) if bin(mask).count('1') == i]
+           for i in range(len(POSITIONS) + 1)]
+
+
+def _allowed_positions(player: dict) -> int:
+    """Маска позиций, на которых игрок играет свою роль"""
+    mask = _FLEX_BIT
+    for role in player.get('roles') or ():
+        mask |= _POSITION_BITS.get(role, 0)
+    return mask
+
+
+@functools.lru_cache(maxsize=4096)
+def _solve_positions(allowed: tuple):
+    """
+    Динамика cost[маска занятых позиций]: игроки расставляются по очереди,
+    i-й игрок занимает одну из свободных позиций. O(n * 2^n) для n = 5.
+
+    Результат зависит только от масок ролей игроков, поэтому кэшируется:
+    разных наборов масок в пуле немного, и для большинства команд
+    динамика не считается заново.
+
+    Returns:
+        (число игроков не на своей роли, номер позиции для каждого игрока)
+    """
+    n = len(allowed)
+    unreachable = n + 1
+    cost = [unreachable] * (1 << len(POSITIONS))
+    choice = [0] * (1 << len(POSITIONS))
+    cost[0] = 0
+
+    for i, fits in enumerate(allowed):
+        for mask in _LAYERS[i]:
+            base = cost[mask]
+            if base == unreachable:
+                continue
+            for j in range(len(POSITIONS)):
+                bit = 1 << j
+                if mask & bit:
+                    continue
+                value = base if fits & bit else base + 1
+                if value < cost[mask | bit]:
+                    cost[mask | bit] = value
+                    choice[mask | bit] = j
+
+    # Лучшее конечное состояние: все игроки расставлены
+    end = min(_LAYERS[n], key=cost.__getitem__)
+    slots = [0] * n
+    mask = end
+    for i in range(n - 1, -1, -1):
+        slots[i] = choice[mask]
+        mask &= ~(1 << slots[i])
+    return cost[end], tuple(slots)
+
+
+def assign_positions(players: list):
+    """
+    Назначить позиции так, чтобы не на своей роли было как можно меньше игроков
+
+    Точное решение задачи о назначениях динамикой по подмножествам позиций
+    (см. _solve_positions) вместо перебора 5! перестановок.
+
+    Returns:
+        ({telegram_id: позиция}, число игроков не на своей роли)
+    """
+    # Игроки упорядочиваются по маске, чтобы одинаковые наборы попадали в кэш
+    ordered = sorted(((_allowed_positions(player), player) for player in players), key=lambda item: item[0])
+    off_role, slots = _solve_positions(tuple(allowed for allowed, _ in ordered))
+    assignment = {player['telegram_id']: POSITIONS[j] for (_, player), j in zip(ordered, slots)}
+    return assignment, off_role
+
+
+def _first_free(queue: deque, used: set):
+    """Первый свободный игрок очереди (занятые удаляются из начала по пути)"""
+    while queue and queue[0]['telegram_id'] in used:
+        queue.popleft()
+    return queue[0] if queue else None
+
+
+def form_teams(players: list, ranks: list, max_rank_spread: int = MAX_RANK_SPREAD):
+    """
+    Разбить пул игроков на команды по 5
+
+    Args:
+        players: Записи игроков (telegram_id, rank, roles), например из индекса слотов.
+            При равных рангах раньше в команду попадает тот, кто раньше в списке
+        ranks: Ранги от низшего к высшему (database.RANKS)
+        max_rank_spread: Максимальная разница рангов внутри команды
+
+    Returns:
+        (список Team, список игроков без команды)
+    """
+    rank_index = {rank: i for i, rank in enumerate(ranks)}
+    by_rank = [deque() for _ in ranks]
+    by_rank_role = [{role: deque() for role in ROLES} for _ in ranks]
+    unmatched = []
+    for player in players:
+        r = rank_index.get(player.get('rank'))
+        if r is None:
+            # Без известного ранга нельзя оценить разброс
+            unmatched.append(player)
+            continue
+        by_rank[r].append(player)
+        for role in player.get('roles') or ():
+            if role in by_rank_role[r]:
+                by_rank_role[r][role].append(player)
+
+    teams = []
+    used = set()
+    free = [len(queue) for queue in by_rank]  # свободных игроков в каждом ранге
+    # Свободных игроков каждой роли в каждом ранге: по ним выбирается, какую
+    # недостающую роль добирать первой, поэтому они уменьшаются вместе с пулом
+    free_roles = [{role: len(queue) for role, queue in queues.items()} for queues in by_rank_role]
+
+    def take(player):
+        k = rank_index[player['rank']]
+        used.add(player['telegram_id'])
+        free[k] -= 1
+        for role in player.get('roles') or ():
+            if role in free_roles[k]:
+                free_roles[k][role] -= 1
+
+    for r in range(len(ranks)):
+        window = range(r, min(r + max_rank_spread, len(ranks) - 1) + 1)
+        while True:
+            anchor = _first_free(by_rank[r], used)
+            if anchor is None:
+                break
+            if sum(free[k] for k in window) < TEAM_SIZE:
+                # В окне рангов не набирается пятеро - якорь остаётся без команды
+                take(anchor)
+                unmatched.append(anchor)
+                continue
+
+            team = [anchor]
+            take(anchor)
+            covered = set(anchor.get('roles') or ())
+
+            # Сначала роли, которых меньше всего среди свободных игроков окна рангов
+            missing = sorted((role for role in ROLES if role not in covered),
+                             key=lambda role: sum(free_roles[k][role] for k in window))
+            for role in missing:
+                if role in covered or len(team) == TEAM_SIZE:
+                    continue
+                for k in window:
+                    candidate = _first_free(by_rank_role[k][role], used)
+                    if candidate is not None:
+                        team.append(candidate)
+                        take(candidate)
+                        covered.update(candidate.get('roles') or ())
+                        break
+
+            # Оставшиеся места - ближайшие по рангу
+            for k in window:
+                while len(team) < TEAM_SIZE:
+                    candidate = _first_free(by_rank[k], used)
+                    if candidate is None:
+                        break
+                    team.append(candidate)
+                    take(candidate)
+
+            team_ranks = [rank_index[player['rank']] for player in team]
+            assignment, off_role = assign_positions(team)
+            teams.append(Team(team, assignment, max(team_ranks) - min(team_ranks), off_role))
+
+    return teams, unmatched
+
+
+def find_team(teams: list, telegram_id: int):
+    """Команда, в которую попал игрок, или None"""
+    for team in teams:
+        if team.positions.get(telegram_id) is not None:
+            return team
+    return None
@@ -0,0 +1,253 @@
+"""
+Метрики бота в формате Prometheus (отдаются на /metrics)
+Гистограммы времени обработчиков и вызовов database.py, число и время
+запросов к базе на один апдейт, счётчики ошибок.
+
+Запросы к базе привязываются к апдейту через contextvars: track_handler
+открывает учёт, round_trip добавляет в него каждый отправленный запрос
+(ответ из кэша запросом не считается). async_database выполняет функции
+в пуле потоков с копией контекста, поэтому учёт виден и там.
+"""
+import time
+import logging
+import functools
+import threading
+import contextvars
+
+logger = logging.getLogger(__name__)
+
+LATENCY_BUCKETS = (0.005, 0.01, 0.025, 0.05, 0.1, 0.25, 0.5, 1.0, 2.5, 5.0, 10.0)
+COUNT_BUCKETS = (0, 1, 2, 3, 5, 10, 20)
+
+# Медленные вызовы базы пишутся в лог с уровнем WARNING
+SLOW_DB_CALL_SECONDS = 0.5
+
+
+def _format_labels(labelnames, values) -> str:
+    if not labelnames:
+        return ''
+    pairs = ','.join(f'{name}="{value}"' for name, value in zip(labelnames, values))
+    return f'{{{pairs}}}'
+
+
+class Counter:
+    """Счётчик с метками"""
+
+    def __init__(self, name: str, documentation: str, labelnames=()):
+        self.name = name
+        self.documentation = documentation
+        self.labelnames = tuple(labelnames)
+        self._values = {}
+        self._lock = threading.Lock()
+
+    def inc(self, amount: float = 1, **labels):
+        key = tuple(str(labels[name]) for name in self.labelnames)
+        with self._lock:
+            self._values[key] = self._values.get(key, 0) + amount
+
+    def render(self) -> list:
+        lines = [f'# HELP {self.name} {self.documentation}', f'# TYPE {self.name} counter']
+        with self._lock:
+            for key, value in sorted(self._values.items()):
+                lines.append(f'{self.name}{_format_labels(self.labelnames, key)} {value}')
+        return lines
+
+
+class Histogram:
+    """Гистограмма с фиксированными корзинами и метками"""
+
+    def __init__(self, name: str, documentation: str, labelnames=(), buckets=LATENCY_BUCKETS):
+        self.name = name
+        self.documentation = documentation
+        self.labelnames = tuple(labelnames)
+        self.buckets = tuple(buckets)
+        self._series = {}  # метки -> [счётчики корзин..., сумма, количество]
+        self._lock = threading.Lock()
+
+    def observe(self, value: float, **labels):
+        key = tuple(str(labels[name]) for name in self.labelnames)
+        with self._lock:
+            series = self._series.get(key)
+            if series is None:
+                series = self._series[key] = [0] * (len(self.buckets) + 2)
+            for i, bound in enumerate(self.buckets):
+                if value <= bound:
+                    series[i] += 1
+            series[-2] += value
+            series[-1] += 1
+
+    def render(self) -> list:
+        lines = [f'# HELP {self.name} {self.documentation}', f'# TYPE {self.name} histogram']
+        with self._lock:
+            for key, series in sorted(self._series.items()):
+                for bound, count in zip(self.buckets, series):
+                    labels = _format_labels(self.labelnames + ('le',), key + (bound,))
+                    lines.append(f'{self.name}_bucket{labels} {count}')
+                labels = _format_labels(self.labelnames + ('le',), key + ('+Inf',))
+                lines.append(f'{self.name}_bucket{labels} {series[-1]}')
+                labels = _format_labels(self.labelnames, key)
+                lines.append(f'{self.name}_sum{labels} {round(series[-2], 6)}')
+                lines.append(f'{self.name}_count{labels} {series[-1]}')
+        return lines
+
+
+class Registry:
+    """Набор метрик, которые отдаются одним текстом"""
+
+    def __init__(self):
+        self._metrics = []
+
+    def counter(self, name: str, documentation: str, labelnames=()) -> Counter:
+        metric = Counter(name, documentation, labelnames)
+        self._metrics.append(metric)
+        return metric
+
+    def histogram(self, name: str, documentation: str, labelnames=(), buckets=LATENCY_BUCKETS) -> Histogram:
+        metric = Histogram(name, documentation, labelnames, buckets)
+        self._metrics.append(metric)
+        return metric
+
+    def render(self) -> str:
+        lines = []
+        for metric in self._metrics:
+            lines.extend(metric.render())
+        return '\n'.join(lines) + '\n'
+
+
+REGISTRY = Registry()
+
+HANDLER_LATENCY = REGISTRY.histogram(
+    'bot_handler_duration_seconds', 'Время обработки апдейта обработчиком', ('handler',))
+HANDLER_ERRORS = REGISTRY.counter(
+    'bot_handler_errors_total', 'Исключения в обработчиках', ('handler',))
+UPDATE_DB_CALLS = REGISTRY.histogram(
+    'bot_update_db_calls', 'Запросов к базе на один апдейт', ('handler',), buckets=COUNT_BUCKETS)
+UPDATE_DB_SECONDS = REGISTRY.histogram(
+    'bot_update_db_seconds', 'Суммарное время запросов к базе на один апдейт', ('handler',))
+DB_LATENCY = REGISTRY.histogram(
+    'bot_db_call_duration_seconds', 'Время вызова функции database.py (вместе с кэшем)', ('function',))
+DB_ROUND_TRIPS = REGISTRY.counter(
+    'bot_db_round_trips_total', 'Запросы к базе (с повторами)', ('function',))
+DB_ERRORS = REGISTRY.counter(
+    'bot_db_errors_total', 'Ошибки запросов к базе', ('function',))
+DB_RETRIES = REGISTRY.counter(
+    'bot_db_retries_total', 'Повторы чтения после временного сбоя базы', ('function',))
+DB_REJECTED = REGISTRY.counter(
+    'bot_db_rejected_total', 'Запросы, не отправленные из-за разомкнутого предохранителя', ('function',))
+DB_BREAKER_OPENED = REGISTRY.counter(
+    'bot_db_breaker_opened_total', 'Сколько раз размыкался предохранитель базы')
+
+
+class _UpdateDbUsage:
+    """Запросы к базе в рамках одного апдейта"""
+    __slots__ = ('calls', 'seconds', '_lock')
+
+    def __init__(self):
+        self.calls = 0
+        self.seconds = 0.0
+        self._lock = threading.Lock()
+
+    def add(self, seconds: float):
+        with self._lock:
+            self.calls += 1
+            self.seconds += seconds
+
+
+_update_usage = contextvars.ContextVar('update_db_usage', default=None)
+_db_function = contextvars.ContextVar('db_function', default=None)
+
+
+def track_handler(func):
+    """Декоратор обработчика: время, ошибки и обращения к базе за апдейт"""
+    name = func.__name__
+
+    @functools.wraps(func)
+    async def wrapper(*args, **kwargs):
+        # Вложенный вызов (например handle_nick_input -> save_edited_nick)
+        # учитывается в апдейте внешнего обработчика
+        usage = _update_usage.get()
+        token = None
+        if usage is None:
+            usage = _UpdateDbUsage()
+            token = _update_usage.set(usage)
+
+        started = time.perf_counter()
+        try:
+            return await func(*args, **kwargs)
+        except Exception:
+            HANDLER_ERRORS.inc(handler=name)
+            raise
+        finally:
+            elapsed = time.perf_counter() - started
+            HANDLER_LATENCY.observe(elapsed, handler=name)
+            if token is not None:
+                _update_usage.reset(token)
+                UPDATE_DB_CALLS.observe(usage.calls, handler=name)
+                UPDATE_DB_SECONDS.observe(usage.seconds, handler=name)
+                logger.info(f"handler={name} duration_ms={elapsed * 1000:.1f} "
+                            f"db_round_trips={usage.calls} db_ms={usage.seconds * 1000:.1f}")
+    return wrapper
+
+
+def track_db(func):
+    """
+    Декоратор функции database.py: время вызова и имя функции для меток
+
+    Запросы к базе внутри функции считает round_trip: вызов, ответивший из
+    кэша или буфера, в учёт апдейта не попадает.
+    """
+    name = func.__name__
+
+    @functools.wraps(func)
+    def wrapper(*args, **kwargs):
+        token = _db_function.set(name)
+        started = time.perf_counter()
+        try:
+            return func(*args, **kwargs)
+        finally:
+            elapsed = time.perf_counter() - started
+            _db_function.reset(token)
+            DB_LATENCY.observe(elapsed, function=name)
+            if elapsed >= SLOW_DB_CALL_SECONDS:
+                logger.warning(f"db_call function={name} duration_ms={elapsed * 1000:.1f} slow=true")
+            else:
+                logger.debug(f"db_call function={name} duration_ms={elapsed * 1000:.1f}")
+    return wrapper
+
+
+def round_trip(execute):
+    """
+    Обернуть query.execute: каждый запрос к базе (и каждый повтор)
+    учитывается в bot_db_round_trips_total и в текущем апдейте
+    """
+    def timed():
+        started = time.perf_counter()
+        try:
+            return execute()
+        finally:
+            elapsed = time.perf_counter() - started
+            DB_ROUND_TRIPS.inc(function=current_db_function())
+            usage = _update_usage.get()
+            if usage is not None:
+                usage.add(elapsed)
+    return timed
+
+
+def current_db_function() -> str:
+    """Имя выполняемой функции database.py (для меток метрик)"""
+    return _db_function.get() or 'unknown'
+
+
+def db_error(message: str, error: Exception):
+    """Записать ошибку запроса к базе (в лог и в bot_db_errors_total)"""
+    function = current_db_function()
+    if getattr(error, 'circuit_open', False):
+        # Запрос не отправлялся: размыкание уже записано в лог, считается в bot_db_rejected_total
+        logger.debug(f"db_error function={function} message=\"{message}\" circuit_open=true")
+        return
+    DB_ERRORS.inc(function=function)
+    logger.error(f"db_error function={function} error_type={type(error).__name__} message=\"{message}\" error=\"{error}\"")
+
+
+def render() -> str:
+    return REGISTRY.render()
@@ -0,0 +1,249 @@
+"""
+Хранение состояния диалогов вне памяти процесса
+user_data (selected_slots, roles, editing, valorant_nick) и состояния
+ConversationHandler сохраняются в SQLite-файл или в таблицу Postgres (bot_state),
+поэтому перезапуск бота не теряет регистрацию, а несколько воркеров могут
+работать с одним хранилищем.
+
+Записи копятся в памяти и пишутся одним пакетом: PTB вызывает update_*
+раз в update_interval секунд для всех изменившихся пользователей, а мы
+сбрасываем их одной транзакцией (одним upsert).
+
+Копия user_data в памяти воркера актуальна для его "своих" пользователей
+(routing.py). Чужие попадают к воркеру только закреплёнными кнопками
+(PINNED_CALLBACK_PREFIXES) - перед таким апдейтом их user_data
+перечитывается из хранилища.
+"""
+import os
+import copy
+import json
+import sqlite3
+import asyncio
+import logging
+from collections import defaultdict
+from telegram.ext import BasePersistence, PersistenceInput
+import database
+import routing
+
+logger = logging.getLogger(__name__)
+
+# Задержка перед записью пакета: PTB успевает передать все изменения за тик
+BATCH_DELAY = 0.1
+
+USER_DATA = 'user_data'
+CONVERSATION = 'conversation'
+
+
+class BufferedPersistence(BasePersistence):
+    """
+    Общая часть: данные в памяти, пакетная запись в хранилище
+
+    Подклассы реализуют _load_rows(kind=None, key=None) -> [(kind, key, value_json)]
+    и _write_rows([(kind, key, value_json или None для удаления)]) - оба синхронные,
+    вызываются в отдельном потоке.
+
+    Args:
+        owns_user: owns_user(user_id) -> False, если апдейты пользователя обычно
+            обрабатывает другой воркер и user_data надо перечитывать (None - не перечитывать)
+    """
+
+    def __init__(self, update_interval: float = 5, owns_user=None):
+        super().__init__(
+            store_data=PersistenceInput(bot_data=False, chat_data=False, user_data=True, callback_data=False),
+            update_interval=update_interval,
+        )
+        self._user_data = None
+        self._conversations = None
+        self._pending = {}
+        self._flush_task = None
+        self._owns_user = owns_user
+
+    async def _ensure_loaded(self):
+        if self._user_data is not None:
+            return
+        rows = await asyncio.to_thread(self._load_rows)
+        self._user_data = defaultdict(dict)
+        self._conversations = defaultdict(dict)
+        for kind, key, value in rows:
+            if kind == USER_DATA:
+                self._user_data[int(key)] = json.loads(value)
+            elif kind.startswith(f'{CONVERSATION}:'):
+                name = kind.split(':', 1)[1]
+                self._conversations[name][tuple(json.loads(key))] = json.loads(value)
+
+    def _schedule(self, kind: str, key: str, value):
+        self._pending[(kind, key)] = None if value is None else json.dumps(value, ensure_ascii=False)
+        if self._flush_task is None or self._flush_task.done():
+            self._flush_task = asyncio.create_task(self._flush_later())
+
+    async def _flush_later(self):
+        await asyncio.sleep(BATCH_DELAY)
+        await self._write_pending()
+
+    async def _write_pending(self):
+        if not self._pending:
+            return
+        batch, self._pending = self._pending, {}
+        try:
+            await asyncio.to_thread(self._write_rows, [(kind, key, value) for (kind, key), value in batch.items()])
+        except Exception as e:
+            logger.error(f"Failed to persist {len(batch)} state rows: {e}")
+            # Вернём в очередь, следующий тик попробует снова (новые значения важнее)
+            self._pending = {**batch, **self._pending}
+
+    # --- user_data ---
+
+    async def get_user_data(self):
+        await self._ensure_loaded()
+        return {user_id: copy.deepcopy(data) for user_id, data in self._user_data.items()}
+
+    async def update_user_data(self, user_id, data):
+        await self._ensure_loaded()
+        if self._user_data.get(user_id) == data:
+            return
+        # Глубокая копия: обработчики меняют списки (selected_slots, roles) на месте,
+        # и с общими списками следующее изменение было бы равно сохранённому
+        self._user_data[user_id] = copy.deepcopy(data)
+        self._schedule(USER_DATA, str(user_id), data)
+
+    async def refresh_user_data(self, user_id, user_data):
+        # Апдейты своих пользователей приходят только сюда - копия в памяти актуальна
+        if self._owns_user is None or self._owns_user(user_id):
+            return
+        await self._ensure_loaded()
+        if (USER_DATA, str(user_id)) in self._pending:
+            # Своё изменение ещё не записано - оно новее хранилища
+            return
+        try:
+            rows = await asyncio.to_thread(self._load_rows, USER_DATA, str(user_id))
+        except Exception as e:
+            logger.warning(f"Failed to refresh user_data of {user_id}, using cached copy: {e}")
+            return
+        data = json.loads(rows[0][2]) if rows else {}
+        self._user_data[user_id] = copy.deepcopy(data)
+        # PTB передаёт свой словарь пользователя - меняем его на месте
+        user_data.clear()
+        user_data.update(data)
+
+    async def drop_user_data(self, user_id):
+        await self._ensure_loaded()
+        self._user_data.pop(user_id, None)
+        self._schedule(USER_DATA, str(user_id), None)
+
+    # --- conversations ---
+
+    async def get_conversations(self, name):
+        await self._ensure_loaded()
+        return dict(self._conversations.get(name, {}))
+
+    async def update_conversation(self, name, key, new_state):
+        await self._ensure_loaded()
+        if self._conversations[name].get(key) == new_state:
+            return
+        if new_state is None:
+            self._conversations[name].pop(key, None)
+        else:
+            self._conversations[name][key] = new_state
+        self._schedule(f'{CONVERSATION}:{name}', json.dumps(list(key)), new_state)
+
+    # --- не храним ---
+
+    async def get_bot_data(self):
+        return {}
+
+    async def update_bot_data(self, data):
+        pass
+
+    async def refresh_bot_data(self, bot_data):
+        pass
+
+    async def get_chat_data(self):
+        return {}
+
+    async def update_chat_data(self, chat_id, data):
+        pass
+
+    async def refresh_chat_data(self, chat_id, chat_data):
+        pass
+
+    async def drop_chat_data(self, chat_id):
+        pass
+
+    async def get_callback_data(self):
+        return None
+
+    async def update_callback_data(self, data):
+        pass
+
+    async def flush(self):
+        if self._flush_task and not self._flush_task.done():
+            self._flush_task.cancel()
+        await self._write_pending()
+
+    def _load_rows(self, kind: str = None, key: str = None):
+        raise NotImplementedError
+
+    def _write_rows(self, rows):
+        raise NotImplementedError
+
+
+class SQLitePersistence(BufferedPersistence):
+    """Состояние в локальном SQLite-файле (один процесс или общий диск)"""
+
+    def __init__(self, path: str, update_interval: float = 5, owns_user=None):
+        super().__init__(update_interval=update_interval, owns_user=owns_user)
+        self.path = path
+        with self._connect() as conn:
+            conn.execute(
+                'CREATE TABLE IF NOT EXISTS bot_state ('
+                'kind TEXT NOT NULL, key TEXT NOT NULL, value TEXT NOT NULL, '
+                'PRIMARY KEY (kind, key))'
+            )
+
+    def _connect(self):
+        return sqlite3.connect(self.path, timeout=10)
+
+    def _load_rows(self, kind: str = None, key: str = None):
+        with self._connect() as conn:
+            if kind is None:
+                return conn.execute('SELECT kind, key, value FROM bot_state').fetchall()
+            return conn.execute('SELECT kind, key, value FROM bot_state WHERE kind = ? AND key = ?',
+                                (kind, key)).fetchall()
+
+    def _write_rows(self, rows):
+        with self._connect() as conn:
+            conn.executemany(
+                'INSERT INTO bot_state (kind, key, value) VALUES (?, ?, ?) '
+                'ON CONFLICT (kind, key) DO UPDATE SET value = excluded.value',
+                [row for row in rows if row[2] is not None],
+            )
+            conn.executemany(
+                'DELETE FROM bot_state WHERE kind = ? AND key = ?',
+                [(kind, key) for kind, key, value in rows if value is None],
+            )
+
+
+class PostgresPersistence(BufferedPersistence):
+    """Состояние в таблице bot_state в Supabase (migrations/005_bot_state.sql)"""
+
+    def _load_rows(self, kind: str = None, key: str = None):
+        rows = database.load_bot_state(kind, key)
+        if rows is None:
+            raise RuntimeError('load_bot_state failed')
+        return rows
+
+    def _write_rows(self, rows):
+        if not database.save_bot_state(rows):
+            raise RuntimeError('save_bot_state failed')
+
+
+def create_persistence():
+    """Хранилище по переменной окружения PERSISTENCE: sqlite, postgres или пусто (в памяти)"""
+    backend = os.environ.get('PERSISTENCE', '').lower()
+    interval = float(os.environ.get('PERSISTENCE_INTERVAL', 5))
+    if backend == 'sqlite':
+        return SQLitePersistence(os.environ.get('PERSISTENCE_PATH', 'bot_state.sqlite3'),
+                                 update_interval=interval, owns_user=routing.owns_user)
+    if backend == 'postgres':
+        return PostgresPersistence(update_interval=interval, owns_user=routing.owns_user)
+    return None
@@ -0,0 +1,138 @@
+"""
+Слой отрисовки сообщений бота
+Повторное нажатие той же кнопки (например "Отмена" дважды) приводит к
+edit_message_text с тем же текстом и клавиатурой - лишний запрос к Bot API,
+который к тому же падает с "message is not modified". Здесь запоминается,
+что сейчас показано в каждом сообщении, и такие правки не отправляются.
+
+Сообщения, которое можно было бы править, может и не быть: у кнопки из
+inline-режима query.message - None, у слишком старого сообщения (больше
+48 часов) - InaccessibleMessage. Тогда вместо правки отправляется новое.
+"""
+import asyncio
+import threading
+from collections import OrderedDict
+from telegram.error import BadRequest
+
+# Сколько последних сообщений помнить
+RENDER_CACHE_SIZE = 10000
+
+
+class MessageRenderer:
+    """Правка сообщений по callback-запросам без повторной отправки того же содержимого"""
+
+    def __init__(self, maxsize: int = RENDER_CACHE_SIZE):
+        self.maxsize = maxsize
+        self.edits_sent = 0
+        self.edits_skipped = 0
+        self.not_modified = 0
+        self.answers_batched = 0
+        self.sent_instead = 0
+        self._shown = OrderedDict()  # (chat_id, message_id) -> отпечаток содержимого
+        self._lock = threading.Lock()
+
+    @staticmethod
+    def _fingerprint(text: str, reply_markup, parse_mode) -> int:
+        # Клавиатуры неизменяемы и сравниваются по кнопкам (см. клавиатуры в main.py)
+        try:
+            return hash((text, parse_mode, reply_markup))
+        except TypeError:
+            return hash((text, parse_mode, reply_markup.to_json()))
+
+    def _remember(self, key, fingerprint):
+        with self._lock:
+            self._shown[key] = fingerprint
+            self._shown.move_to_end(key)
+            while len(self._shown) > self.maxsize:
+                self._shown.popitem(last=False)
+
+    def _is_shown(self, query, key, fingerprint, text, reply_markup, parse_mode) -> bool:
+        # Telegram присылает текущее состояние сообщения вместе с нажатием -
+        # это самый свежий источник, он работает и после перезапуска бота.
+        # С разметкой message.text хранит текст без неё, тогда сверяемся с тем,
+        # что отправляли сами
+        message = query.message
+        if parse_mode is None and getattr(message, 'text', None) is not None:
+            return message.text == text and getattr(message, 'reply_markup', None) == reply_markup
+        with self._lock:
+            return self._shown.get(key) == fingerprint
+
+    async def edit(self, query, text: str, reply_markup=None, parse_mode=None, answer: bool = False) -> bool:
+        """
+        Показать text и reply_markup в сообщении, к которому относится нажатие
+
+        Args:
+            query: CallbackQuery
+            answer: Ответить на callback-запрос параллельно с правкой (для
+                обработчиков, которые не ходят в базу и не ответили раньше)
+
+        Returns:
+            True если правка (или новое сообщение) отправлена, False если
+            сообщение уже так выглядит
+        """
+        message = query.message
+        if message is None or not getattr(message, 'is_accessible', True):
+            await self._send_instead(query, text, reply_markup, parse_mode, answer)
+            return True
+
+        key = (message.chat_id, message.message_id)
+        fingerprint = self._fingerprint(text, reply_markup, parse_mode)
+
+        if self._is_shown(query, key, fingerprint, text, reply_markup, parse_mode):
+            self.edits_skipped += 1
+            self._remember(key, fingerprint)
+            if answer:
+                await query.answer()
+            return False
+
+        edit = query.edit_message_text(text, reply_markup=reply_markup, parse_mode=parse_mode)
+        try:
+            if answer:
+                self.answers_batched += 1
+                await asyncio.gather(edit, query.answer())
+            else:
+                await edit
+        except BadRequest as e:
+            if 'message is not modified' not in str(e).lower():
+                raise
+            self.not_modified += 1
+            self._remember(key, fingerprint)
+            return False
+
+        self.edits_sent += 1
+        self._remember(key, fingerprint)
+        return True
+
+    async def _send_instead(self, query, text: str, reply_markup, parse_mode, answer: bool):
+        """Сообщение нельзя править - ответить на нажатие и прислать новое"""
+        chat_id = query.message.chat.id if query.message is not None else query.from_user.id
+        send = query.get_bot().send_message(chat_id, text, reply_markup=reply_markup, parse_mode=parse_mode)
+        if answer:
+            _, sent = await asyncio.gather(query.answer(), send)
+        else:
+            sent = await send
+        self.sent_instead += 1
+        self._remember((sent.chat_id, sent.message_id), self._fingerprint(text, reply_markup, parse_mode))
+
+    def stats(self) -> dict:
+        return {
+            'edits_sent': self.edits_sent,
+            'edits_skipped': self.edits_skipped,
+            'not_modified': self.not_modified,
+            'answers_batched': self.answers_batched,
+            'sent_instead': self.sent_instead,
+            # Пропущенные правки - это запросы к Bot API, которые не понадобились
+            'api_calls_saved': self.edits_skipped,
+        }
+
+
+_renderer = MessageRenderer()
+
+
+async def edit_message(query, text: str, reply_markup=None, parse_mode=None, answer: bool = False) -> bool:
+    """Правка сообщения через общий MessageRenderer (см. MessageRenderer.edit)"""
+    return await _renderer.edit(query, text, reply_markup=reply_markup, parse_mode=parse_mode, answer=answer)
+
+
+def get_render_stats() -> dict:
+    return _renderer.stats()
@@ -0,0 +1,167 @@
+"""
+Устойчивость запросов к базе: повторы и предохранитель (circuit breaker)
+
+Временный сбой (сеть, таймаут, 5xx от PostgREST) при чтении повторяется
+с экспоненциальной задержкой со случайным разбросом. Если сбои идут
+подряд, предохранитель размыкается: следующие DB_BREAKER_COOLDOWN секунд
+запросы не отправляются вовсе и сразу завершаются CircuitOpenError, а
+database.py отдаёт то, что есть в кэше. Затем один пробный запрос
+решает, замкнуть предохранитель или подождать ещё.
+
+Ошибки самого запроса (нет функции, нарушение ограничения) означают, что
+база отвечает, и предохранитель не размыкают.
+"""
+import sys
+import time
+import random
+import logging
+import threading
+import metrics
+
+logger = logging.getLogger(__name__)
+
+# Задержка перед первым повтором; дальше удваивается
+RETRY_BASE_DELAY = 0.2
+
+# Коды ошибок PostgREST/Postgres, при которых запрос стоит повторить:
+# нет соединения с базой, таймаут пула, statement timeout, нехватка ресурсов
+TRANSIENT_CODE_PREFIXES = ('PGRST000', 'PGRST001', 'PGRST002', 'PGRST003', '08', '53', '57')
+
+
+class CircuitOpenError(Exception):
+    """Предохранитель разомкнут: база недоступна, запрос не отправлялся"""
+    circuit_open = True
+
+
+def is_transient(error: Exception) -> bool:
+    """Сбой сети или сервера (стоит повторить), а не ошибка в запросе"""
+    if isinstance(error, OSError):
+        return True
+    # httpx уже загружен, если запрос вообще отправлялся
+    httpx = sys.modules.get('httpx')
+    if httpx is not None and isinstance(error, httpx.TransportError):
+        return True
+    # postgrest.APIError: код Postgres/PostgREST или HTTP-статус, если ответ не JSON
+    code = str(getattr(error, 'code', '') or '')
+    if len(code) == 3 and code.startswith('5'):
+        return True
+    return code.startswith(TRANSIENT_CODE_PREFIXES)
+
+
+def is_unavailable(error: Exception) -> bool:
+    """База недоступна (а не ошибка в запросе): запасной запрос тоже не пройдёт"""
+    return getattr(error, 'circuit_open', False) or is_transient(error)
+
+
+class CircuitBreaker:
+    """
+    Предохранитель: closed -> open после failure_threshold сбоев подряд,
+    open -> half_open через cooldown секунд (пропускается один пробный
+    запрос), half_open -> closed при успехе или снова open при сбое.
+    Потокобезопасный: database.py вызывается из пула потоков.
+    """
+
+    def __init__(self, failure_threshold: int = 5, cooldown: float = 30):
+        self.failure_threshold = failure_threshold
+        self.cooldown = cooldown
+        self.state = 'closed'
+        self.failures = 0       # сбоев подряд
+        self.opened = 0         # сколько раз размыкался
+        self.rejected = 0       # запросов не отправлено
+        self.last_error = None
+        self._opened_at = None  # когда разомкнулся (для open_seconds)
+        self._probe_at = None   # когда можно отправить пробный запрос
+        self._probe_in_flight = False
+        self._lock = threading.Lock()
+
+    def allow(self) -> bool:
+        """Можно ли отправить запрос сейчас"""
+        with self._lock:
+            if self.state == 'closed':
+                return True
+            if self.state == 'open' and time.monotonic() >= self._probe_at:
+                self.state = 'half_open'
+            if self.state == 'half_open' and not self._probe_in_flight:
+                self._probe_in_flight = True
+                return True
+            self.rejected += 1
+            return False
+
+    def record_success(self):
+        with self._lock:
+            if self.state != 'closed':
+                logger.info(f"Database is reachable again, circuit closed after {self._open_seconds():.0f}s")
+            self.state = 'closed'
+            self.failures = 0
+            self._opened_at = None
+            self._probe_in_flight = False
+
+    def record_failure(self, error: Exception):
+        with self._lock:
+            self.failures += 1
+            self.last_error = f"{type(error).__name__}: {error}"[:200]
+            self._probe_in_flight = False
+            if self.state == 'closed' and self.failures >= self.failure_threshold:
+                self.opened += 1
+                self._opened_at = time.monotonic()
+                metrics.DB_BREAKER_OPENED.inc()
+                logger.warning(f"Database circuit opened after {self.failures} failures in a row: {self.last_error}")
+            elif self.state == 'closed':
+                return
+            # Разомкнулся или пробный запрос не прошёл - следующая проба через cooldown
+            self.state = 'open'
+            self._probe_at = time.monotonic() + self.cooldown
+
+    def _open_seconds(self) -> float:
+        return time.monotonic() - self._opened_at if self._opened_at is not None else 0.0
+
+    @property
+    def is_open(self) -> bool:
+        return self.state != 'closed'
+
+    def stats(self) -> dict:
+        with self._lock:
+            return {
+                'state': self.state,
+                'failures_in_row': self.failures,
+                'open_seconds': round(self._open_seconds(), 1),
+                'opened': self.opened,
+                'rejected': self.rejected,
+                'last_error': self.last_error,
+            }
+
+
+def call(breaker: CircuitBreaker, operation, retries: int = 0):
+    """
+    Выполнить operation() через предохранитель
+
+    Args:
+        breaker: Предохранитель базы
+        operation: Функция без аргументов (query.execute)
+        retries: Сколько раз повторить при временном сбое - только для
+            идемпотентных запросов (чтение)
+
+    Raises:
+        CircuitOpenError: Предохранитель разомкнут, запрос не отправлялся
+        Exception: Ошибка последней попытки
+    """
+    for attempt in range(retries + 1):
+        if not breaker.allow():
+            metrics.DB_REJECTED.inc(function=metrics.current_db_function())
+            raise CircuitOpenError(f"database unavailable, circuit {breaker.state}")
+        try:
+            result = operation()
+        except Exception as e:
+            if not is_transient(e):
+                # База ответила - ошибка в самом запросе
+                breaker.record_success()
+                raise
+            breaker.record_failure(e)
+            if attempt == retries or breaker.is_open:
+                raise
+            metrics.DB_RETRIES.inc(function=metrics.current_db_function())
+            # Full jitter: повторы разных потоков не приходят в базу одновременно
+            time.sleep(random.uniform(0, RETRY_BASE_DELAY * 2 ** attempt))
+            continue
+        breaker.record_success()
+        return result
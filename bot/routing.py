@@ -0,0 +1,119 @@
+"""
+Распределение апдейтов между несколькими воркерами бота
+Telegram шлёт вебхук на один адрес (балансировщик), а воркер, получивший
+апдейт, пересылает его "владельцу" - воркеру с номером user_id % N.
+Так все апдейты одного пользователя обрабатываются по порядку в одном
+процессе, а состояние диалога лежит в общем хранилище (persistence.py).
+
+Кэш профилей, индекс слотов и буфер записей (database.py) у каждого
+воркера свои. Индекс слотов догоняет отметки чужих пользователей по
+daily_status.updated_at (SLOT_INDEX_SYNC_SECONDS), изменения профилей
+видны после PLAYER_CACHE_TTL.
+"""
+import os
+import logging
+import httpx
+
+logger = logging.getLogger(__name__)
+
+# Адреса всех воркеров через запятую (в одинаковом порядке на каждом воркере)
+WORKER_URLS = [url.strip().rstrip('/') for url in os.environ.get('WORKER_URLS', '').split(',') if url.strip()]
+WORKER_INDEX = int(os.environ.get('WORKER_INDEX', 0))
+FORWARD_TIMEOUT = 5.0
+FORWARDED_HEADER = 'x-forwarded-by-worker'
+
+# Кнопки, которые обрабатывает один воркер: очередь лобби (lobby.py) живёт
+# в памяти воркера 0, поэтому входы и выходы всех игроков идут туда.
+# user_data таких игроков воркер 0 перечитывает из хранилища (persistence.py)
+PINNED_CALLBACK_PREFIXES = {'lobby_': 0}
+
+# Поля апдейта, в которых лежит объект с отправителем (from)
+UPDATE_KINDS = ('message', 'edited_message', 'callback_query', 'inline_query',
+                'chosen_inline_result', 'shipping_query', 'pre_checkout_query',
+                'poll_answer', 'my_chat_member', 'chat_member', 'chat_join_request')
+
+
+def update_owner_key(data: dict) -> int:
+    """Ключ шардирования: id пользователя, для апдейтов без отправителя - update_id"""
+    for kind in UPDATE_KINDS:
+        payload = data.get(kind)
+        if isinstance(payload, dict):
+            sender = payload.get('from') or payload.get('user')
+            if sender and 'id' in sender:
+                return sender['id']
+    return data.get('update_id', 0)
+
+
+def owns_user(user_id: int) -> bool:
+    """Приходят ли в этот воркер все апдейты пользователя (кроме закреплённых кнопок)"""
+    return len(WORKER_URLS) <= 1 or user_id % len(WORKER_URLS) == WORKER_INDEX
+
+
+class UpdateRouter:
+    """
+    Выбор воркера для апдейта и пересылка чужих апдейтов
+
+    Args:
+        worker_urls: Базовые адреса воркеров; пустой список - один воркер
+        worker_index: Номер текущего воркера в списке
+        webhook_path: Путь вебхука на воркерах
+        secret_token: Секрет вебхука (передаётся при пересылке)
+    """
+
+    def __init__(self, worker_urls: list, worker_index: int, webhook_path: str, secret_token: str):
+        self.worker_urls = worker_urls
+        self.worker_index = worker_index
+        self.webhook_path = webhook_path
+        self.secret_token = secret_token
+        self.forwarded = 0
+        self.forward_failed = 0
+        self._client = None
+
+    @property
+    def enabled(self) -> bool:
+        return len(self.worker_urls) > 1
+
+    def owner(self, data: dict) -> int:
+        if not self.enabled:
+            return self.worker_index
+        callback = data.get('callback_query')
+        if isinstance(callback, dict):
+            for prefix, worker in PINNED_CALLBACK_PREFIXES.items():
+                if str(callback.get('data') or '').startswith(prefix):
+                    return worker
+        return update_owner_key(data) % len(self.worker_urls)
+
+    def is_local(self, data: dict) -> bool:
+        return self.owner(data) == self.worker_index
+
+    async def forward(self, body: bytes, owner: int) -> bool:
+        """Переслать апдейт воркеру owner; False - переслать не удалось"""
+        if self._client is None:
+            self._client = httpx.AsyncClient(timeout=FORWARD_TIMEOUT)
+        try:
+            response = await self._client.post(
+                f"{self.worker_urls[owner]}{self.webhook_path}",
+                content=body,
+                headers={
+                    'Content-Type': 'application/json',
+                    'X-Telegram-Bot-Api-Secret-Token': self.secret_token,
+                    'X-Forwarded-By-Worker': str(self.worker_index),
+                },
+            )
+            response.raise_for_status()
+            self.forwarded += 1
+            return True
+        except httpx.HTTPError as e:
+            logger.warning(f"Failed to forward update to worker {owner}: {e}")
+            self.forward_failed += 1
+            return False
+
+    async def close(self):
+        if self._client is not None:
+            await self._client.aclose()
+            self._client = None
+
+
+def create_router(webhook_path: str, secret_token: str) -> UpdateRouter:
+    """Роутер по переменным окружения WORKER_URLS и WORKER_INDEX"""
+    return UpdateRouter(WORKER_URLS, WORKER_INDEX, webhook_path, secret_token)
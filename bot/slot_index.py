@@ -0,0 +1,236 @@
+"""
+Индекс игроков по (дата, временной слот)
+Строится один раз на день одним проходом по daily_status + players,
+дальше обновляется при каждой записи статуса, поэтому вопросы
+"кто играет сегодня/в этот слот" решаются поиском в словаре.
+"""
+import time
+import itertools
+import threading
+
+# Поля профиля, которые хранятся в индексе
+PLAYER_FIELDS = ('telegram_id', 'telegram_username', 'telegram_first_name',
+                 'valorant_nick', 'rank', 'roles')
+
+# Номера версий слотов общие для всех индексов, чтобы версия не повторялась
+# после перезагрузки даты
+_versions = itertools.count(1)
+
+
+def compact_record(player: dict, time_slots: list, slot_mask: int) -> dict:
+    """Компактная запись игрока для индекса (слоты и списком, и битовой маской)"""
+    record = {field: player.get(field) for field in PLAYER_FIELDS}
+    record['time_slots'] = list(time_slots or [])
+    record['slot_mask'] = slot_mask
+    return record
+
+
+class SlotIndex:
+    """Потокобезопасный индекс {дата: {слот: {telegram_id: запись}}}"""
+
+    def __init__(self, ttl: float = 600, max_dates: int = 2):
+        self.ttl = ttl
+        self.max_dates = max_dates
+        self._lock = threading.RLock()
+        self._records = {}    # date -> {telegram_id: record}
+        self._slots = {}      # (date, slot) -> {telegram_id: record}
+        self._loaded_at = {}  # date -> time.monotonic()
+        self._journal = {}    # date -> [(операция, аргументы)], пока идёт загрузка
+        self._versions = {}   # (date, slot) -> номер последнего изменения слота
+        self._synced = {}     # date -> (курсор updated_at, time.monotonic()) для sync_due
+
+    def is_loaded(self, date: str) -> bool:
+        with self._lock:
+            loaded_at = self._loaded_at.get(date)
+            return loaded_at is not None and time.monotonic() - loaded_at < self.ttl
+
+    def begin_load(self, date: str):
+        """
+        Начать загрузку даты: изменения до вызова load запоминаются
+
+        Снимок из базы читается без блокировки индекса, и записи, сделанные
+        во время чтения, в него могут не попасть - load применит их заново.
+        """
+        with self._lock:
+            self._journal[date] = []
+
+    def abort_load(self, date: str):
+        """Загрузка не удалась - забыть запомненные изменения"""
+        with self._lock:
+            self._journal.pop(date, None)
+
+    def load(self, date: str, records: list, pending: list = ()):
+        """
+        Заменить данные за дату полным списком записей
+
+        Args:
+            records: Записи индекса из базы
+            pending: Статусы, ещё не записанные в базу - аргументы set_status
+                (telegram_id, is_playing, time_slots, slot_mask, profile)
+        """
+        with self._lock:
+            journal = self._journal.pop(date, [])
+            self._drop_date(date)
+            self._records[date] = {}
+            for record in records:
+                self._add(date, record)
+            self._loaded_at[date] = time.monotonic()
+
+            # Сначала отложенные записи, затем изменения, пришедшие во время чтения
+            replay = [('status', args) for args in pending] + journal
+            for operation, args in replay:
+                if operation == 'status':
+                    if not self._set_status(date, *args):
+                        # Профиля нет - данные оставляем, но при следующем запросе перечитаем
+                        self._loaded_at[date] = float('-inf')
+                elif operation == 'profile':
+                    self._update_profile(date, args)
+                else:
+                    self._remove(date, args)
+
+            # Держим только последние даты (сегодня и вчера около полуночи)
+            for old_date in sorted(self._loaded_at)[:-self.max_dates]:
+                self._drop_date(old_date)
+
+    def sync_due(self, date: str, interval: float):
+        """
+        Курсор, с которого пора догнать изменения даты из базы, или None
+
+        Изменения, сделанные другими воркерами, индекс сам не видит; их
+        применяют через set_status не чаще раза в interval секунд.
+        """
+        with self._lock:
+            synced = self._synced.get(date)
+            if synced is None or time.monotonic() - synced[1] < interval:
+                return None
+            return synced[0]
+
+    def mark_synced(self, date: str, cursor):
+        """Изменения даты до cursor применены (дата должна быть загружена)"""
+        with self._lock:
+            if date in self._records:
+                self._synced[date] = (cursor, time.monotonic())
+
+    def has_data(self, date: str) -> bool:
+        """Есть ли данные за дату, даже устаревшие (запасной вариант, когда база недоступна)"""
+        with self._lock:
+            return date in self._records
+
+    def invalidate(self, date: str):
+        with self._lock:
+            self._drop_date(date)
+
+    def set_status(self, date: str, telegram_id: int, is_playing: bool, time_slots: list,
+                   slot_mask: int, profile: dict = None):
+        """
+        Применить запись daily_status к индексу
+
+        Если дата ещё не загружена - ничего не делаем (данные подтянутся при загрузке,
+        а запись, сделанная во время загрузки, будет применена после неё).
+        Если профиля игрока нет ни в индексе, ни в аргументах - дата будет перезагружена.
+        """
+        with self._lock:
+            args = (telegram_id, is_playing, time_slots, slot_mask, profile)
+            if date in self._journal:
+                self._journal[date].append(('status', args))
+            if date in self._records and not self._set_status(date, *args):
+                self._drop_date(date)
+
+    def update_profile(self, player: dict):
+        """Обновить профиль игрока во всех загруженных датах"""
+        with self._lock:
+            for journal in self._journal.values():
+                journal.append(('profile', player))
+            for date in list(self._records):
+                self._update_profile(date, player)
+
+    def remove_player(self, telegram_id: int):
+        with self._lock:
+            for journal in self._journal.values():
+                journal.append(('remove', telegram_id))
+            for date in list(self._records):
+                self._remove(date, telegram_id)
+
+    def players(self, date: str) -> list:
+        """Все играющие в дату"""
+        with self._lock:
+            return [dict(record) for record in self._records.get(date, {}).values()]
+
+    def player(self, date: str, telegram_id: int):
+        """Запись игрока, если он играет в дату, иначе None"""
+        with self._lock:
+            record = self._records.get(date, {}).get(telegram_id)
+            return dict(record) if record is not None else None
+
+    def players_in_slot(self, date: str, slot: str) -> list:
+        """Играющие в конкретный слот"""
+        with self._lock:
+            return [dict(record) for record in self._slots.get((date, slot), {}).values()]
+
+    def version(self, date: str, slot: str) -> int:
+        """
+        Версия состава слота: меняется при каждом изменении игроков в нём
+
+        По ней кэшируются производные данные (команды слота); 0 - в слот
+        никто не записывался с последней загрузки, то есть он пуст.
+        """
+        with self._lock:
+            return self._versions.get((date, slot), 0)
+
+    def players_in_slots(self, date: str, slot_mask: int, exclude_id: int = None) -> list:
+        """Играющие хотя бы в один из слотов маски (пересечение - побитовое И)"""
+        with self._lock:
+            return [dict(record) for telegram_id, record in self._records.get(date, {}).items()
+                    if record['slot_mask'] & slot_mask and telegram_id != exclude_id]
+
+    def _set_status(self, date: str, telegram_id: int, is_playing: bool, time_slots: list,
+                    slot_mask: int, profile: dict) -> bool:
+        """False, если игрок играет, но его профиля нет ни в индексе, ни в аргументах"""
+        existing = self._records[date].get(telegram_id)
+        if not is_playing or not slot_mask:
+            self._remove(date, telegram_id)
+            return True
+
+        source = profile or existing
+        if source is None:
+            self._remove(date, telegram_id)
+            return False
+        record = compact_record(source, time_slots, slot_mask)
+        # Повторная отметка тех же слотов не меняет версию (кэш команд остаётся)
+        if record != existing:
+            self._remove(date, telegram_id)
+            self._add(date, record)
+        return True
+
+    def _update_profile(self, date: str, player: dict):
+        telegram_id = player.get('telegram_id')
+        existing = self._records[date].get(telegram_id)
+        if existing is not None:
+            record = compact_record({**existing, **player}, existing['time_slots'], existing['slot_mask'])
+            if record != existing:
+                self._remove(date, telegram_id)
+                self._add(date, record)
+
+    def _add(self, date: str, record: dict):
+        telegram_id = record['telegram_id']
+        self._records[date][telegram_id] = record
+        for slot in record['time_slots']:
+            self._slots.setdefault((date, slot), {})[telegram_id] = record
+            self._versions[(date, slot)] = next(_versions)
+
+    def _remove(self, date: str, telegram_id: int):
+        record = self._records.get(date, {}).pop(telegram_id, None)
+        if record is None:
+            return
+        for slot in record['time_slots']:
+            self._slots.get((date, slot), {}).pop(telegram_id, None)
+            self._versions[(date, slot)] = next(_versions)
+
+    def _drop_date(self, date: str):
+        self._records.pop(date, None)
+        self._loaded_at.pop(date, None)
+        self._synced.pop(date, None)
+        for key in [key for key in self._slots if key[0] == date]:
+            del self._slots[key]
+        for key in [key for key in self._versions if key[0] == date]:
+            del self._versions[key]
@@ -0,0 +1,183 @@
+"""
+HTTP-сервер бота на asyncio
+Один порт и один event loop для health check, статистики и вебхука Telegram
+(вместо HTTPServer в отдельном потоке).
+"""
+import hmac
+import json
+import asyncio
+import logging
+from telegram import Update
+import metrics
+
+logger = logging.getLogger(__name__)
+
+MAX_BODY_SIZE = 1024 * 1024
+KEEPALIVE_TIMEOUT = 75
+
+REASONS = {200: 'OK', 400: 'Bad Request', 403: 'Forbidden', 404: 'Not Found',
+           405: 'Method Not Allowed', 413: 'Payload Too Large'}
+
+
+class BotWebServer:
+    """
+    Минимальный HTTP/1.1 сервер поверх asyncio.start_server
+
+    Args:
+        application: telegram.ext.Application, в очередь которого кладутся апдейты
+        port: Порт (PORT из окружения)
+        webhook_path: Путь вебхука; None - режим polling, вебхук не принимается
+        secret_token: Ожидаемый заголовок X-Telegram-Bot-Api-Secret-Token
+        stats_provider: Функция без аргументов -> dict для /stats
+        health_provider: Функция без аргументов -> dict для /health; ключ 'status' -
+            'ok' или 'degraded' (бот работает, но база недоступна)
+        router: routing.UpdateRouter; апдейты чужих пользователей пересылаются владельцу
+    """
+
+    def __init__(self, application, port: int, webhook_path: str = None,
+                 secret_token: str = None, stats_provider=None, health_provider=None, router=None):
+        self.application = application
+        self.router = router
+        self.port = port
+        self.webhook_path = webhook_path
+        self.secret_token = secret_token
+        self.stats_provider = stats_provider or (lambda: {})
+        self.health_provider = health_provider or (lambda: {'status': 'ok'})
+        self.updates_received = 0
+        self.updates_rejected = 0
+        self._server = None
+        self._connections = set()
+
+    async def start(self):
+        self._server = await asyncio.start_server(self._handle_connection, '0.0.0.0', self.port)
+        logger.info(f"HTTP server started on port {self.port}")
+
+    async def stop(self):
+        if self._server:
+            self._server.close()
+            # Открытые keep-alive соединения закрываем сами, иначе wait_closed их ждёт
+            for writer in list(self._connections):
+                writer.close()
+            await self._server.wait_closed()
+
+    async def _handle_connection(self, reader, writer):
+        self._connections.add(writer)
+        try:
+            # Telegram держит соединение открытым и шлёт апдейты подряд
+            while True:
+                request = await asyncio.wait_for(self._read_request(reader), KEEPALIVE_TIMEOUT)
+                if request is None:
+                    break
+                method, path, headers, body = request
+                status, content_type, payload = await self._dispatch(method, path, headers, body)
+                keep_alive = headers.get('connection', '').lower() != 'close'
+                self._write_response(writer, status, content_type, payload, keep_alive)
+                await writer.drain()
+                if not keep_alive:
+                    break
+        except (asyncio.TimeoutError, asyncio.IncompleteReadError, ConnectionError):
+            pass
+        except ValueError as e:
+            self._write_response(writer, 400, 'text/plain', str(e).encode(), keep_alive=False)
+        finally:
+            self._connections.discard(writer)
+            writer.close()
+
+    async def _read_request(self, reader):
+        request_line = await reader.readline()
+        if not request_line:
+            return None
+        try:
+            method, target, _ = request_line.decode('latin-1').split(' ', 2)
+        except ValueError:
+            raise ValueError('Malformed request line')
+
+        headers = {}
+        while True:
+            line = await reader.readline()
+            if line in (b'\r\n', b'\n', b''):
+                break
+            name, _, value = line.decode('latin-1').partition(':')
+            headers[name.strip().lower()] = value.strip()
+
+        length = int(headers.get('content-length') or 0)
+        if length > MAX_BODY_SIZE:
+            raise ValueError('Payload too large')
+        body = await reader.readexactly(length) if length else b''
+        return method, target.split('?', 1)[0], headers, body
+
+    async def _dispatch(self, method, path, headers, body):
+        if self.webhook_path and path == self.webhook_path:
+            if method != 'POST':
+                return 405, 'text/plain', b'Method not allowed'
+            return await self._handle_webhook(headers, body)
+
+        if method != 'GET':
+            return 405, 'text/plain', b'Method not allowed'
+        if path == '/stats':
+            return 200, 'application/json', json.dumps(self.stats_provider()).encode()
+        if path == '/metrics':
+            return 200, 'text/plain; version=0.0.4', self._render_metrics().encode()
+        if path == '/health':
+            # Всегда 200: перезапуск бота не вернёт базу, а без неё бот отвечает из кэша
+            return 200, 'application/json', json.dumps(self.health_provider()).encode()
+        if path == '/':
+            return 200, 'text/plain', b'Bot is running!'
+        return 404, 'text/plain', b'Not found'
+
+    async def _handle_webhook(self, headers, body):
+        token = headers.get('x-telegram-bot-api-secret-token', '')
+        if not self.secret_token or not hmac.compare_digest(token, self.secret_token):
+            self.updates_rejected += 1
+            return 403, 'text/plain', b'Forbidden'
+
+        try:
+            data = json.loads(body)
+        except ValueError:
+            return 400, 'text/plain', b'Invalid update'
+
+        # Апдейт уже пересланный другим воркером обрабатываем здесь, без повторной пересылки
+        if self.router and self.router.enabled and 'x-forwarded-by-worker' not in headers:
+            owner = self.router.owner(data)
+            if owner != self.router.worker_index and await self.router.forward(body, owner):
+                return 200, 'text/plain', b'OK'
+
+        try:
+            update = Update.de_json(data, self.application.bot)
+        except ValueError:
+            return 400, 'text/plain', b'Invalid update'
+
+        # Отвечаем сразу, обработка идёт в Application
+        await self.application.update_queue.put(update)
+        self.updates_received += 1
+        return 200, 'text/plain', b'OK'
+
+    def _render_metrics(self) -> str:
+        lines = [
+            '# TYPE bot_webhook_updates_received_total counter',
+            f'bot_webhook_updates_received_total {self.updates_received}',
+            '# TYPE bot_webhook_updates_rejected_total counter',
+            f'bot_webhook_updates_rejected_total {self.updates_rejected}',
+            '# TYPE bot_update_queue_size gauge',
+            f'bot_update_queue_size {self.application.update_queue.qsize()}',
+        ]
+        if self.router and self.router.enabled:
+            lines += [
+                '# TYPE bot_updates_forwarded_total counter',
+                f'bot_updates_forwarded_total {self.router.forwarded}',
+                '# TYPE bot_updates_forward_failed_total counter',
+                f'bot_updates_forward_failed_total {self.router.forward_failed}',
+            ]
+        # Обработчики и обращения к базе (metrics.py)
+        return '\n'.join(lines) + '\n' + metrics.render()
+
+    @staticmethod
+    def _write_response(writer, status, content_type, payload, keep_alive=True):
+        head = (
+            f"HTTP/1.1 {status} {REASONS.get(status, 'OK')}\r\n"
+            f"Content-Type: {content_type}\r\n"
+            f"Content-Length: {len(payload)}\r\n"
+            f"Connection: {'keep-alive' if keep_alive else 'close'}\r\n"
+            "\r\n"
+        )
+        writer.write(head.encode('latin-1') + payload)
@@ -0,0 +1,28 @@
+-- Базовая схема: таблицы игроков и ежедневных статусов
+-- Повторный запуск безопасен (IF NOT EXISTS)
+
+CREATE TABLE IF NOT EXISTS players (
+    telegram_id BIGINT PRIMARY KEY,
+    telegram_username TEXT,
+    telegram_first_name TEXT,
+    valorant_nick TEXT NOT NULL,
+    rank TEXT NOT NULL,
+    roles TEXT[] NOT NULL,
+    created_at TIMESTAMP DEFAULT NOW(),
+    updated_at TIMESTAMP DEFAULT NOW()
+);
+
+CREATE TABLE IF NOT EXISTS daily_status (
+    telegram_id BIGINT,
+    date DATE,
+    is_playing BOOLEAN DEFAULT FALSE,
+    updated_at TIMESTAMP DEFAULT NOW(),
+    PRIMARY KEY (telegram_id, date),
+    FOREIGN KEY (telegram_id) REFERENCES players(telegram_id) ON DELETE CASCADE
+);
+
+-- Временные слоты: 'morning', 'day', 'evening', 'night'
+ALTER TABLE daily_status ADD COLUMN IF NOT EXISTS time_slots TEXT[] NOT NULL DEFAULT '{}';
+
+CREATE INDEX IF NOT EXISTS idx_daily_status_date ON daily_status(date);
+CREATE INDEX IF NOT EXISTS idx_daily_status_playing ON daily_status(date, is_playing);
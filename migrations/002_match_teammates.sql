@@ -0,0 +1,47 @@
+-- Подбор тиммейтов на стороне базы
+-- Пересечение слотов проверяется в запросе (оператор &&), а результат
+-- сортируется по близости ранга и по ролям, которых не хватает игроку.
+-- Вызывается из database.get_players_by_slots через supabase.rpc()
+
+CREATE OR REPLACE FUNCTION match_teammates(
+    p_date DATE,
+    p_time_slots TEXT[],
+    p_exclude_id BIGINT DEFAULT NULL,
+    p_rank TEXT DEFAULT NULL,
+    p_roles TEXT[] DEFAULT '{}',
+    p_limit INT DEFAULT 10
+)
+RETURNS TABLE (
+    telegram_id BIGINT,
+    telegram_username TEXT,
+    telegram_first_name TEXT,
+    valorant_nick TEXT,
+    rank TEXT,
+    roles TEXT[],
+    time_slots TEXT[]
+)
+LANGUAGE sql STABLE
+AS $$
+    SELECT p.telegram_id, p.telegram_username, p.telegram_first_name,
+           p.valorant_nick, p.rank, p.roles, ds.time_slots
+    FROM daily_status ds
+    JOIN players p ON p.telegram_id = ds.telegram_id
+    WHERE ds.date = p_date
+      AND ds.is_playing
+      AND ds.time_slots && p_time_slots
+      AND (p_exclude_id IS NULL OR ds.telegram_id <> p_exclude_id)
+    ORDER BY
+        -- Разница в рангах (если ранг неизвестен - не учитываем)
+        COALESCE(ABS(
+            array_position(ARRAY['Железо', 'Бронза', 'Серебро', 'Золото',
+                                 'Платина', 'Алмаз', 'Бессмертный', 'Сияющий'], p.rank)
+          - array_position(ARRAY['Железо', 'Бронза', 'Серебро', 'Золото',
+                                 'Платина', 'Алмаз', 'Бессмертный', 'Сияющий'], p_rank)
+        ), 0),
+        -- Сколько ролей закрывает тиммейт, которых нет у игрока
+        cardinality(ARRAY(SELECT unnest(p.roles) EXCEPT SELECT unnest(p_roles))) DESC,
+        -- Сколько общих слотов
+        cardinality(ARRAY(SELECT unnest(ds.time_slots) INTERSECT SELECT unnest(p_time_slots))) DESC,
+        ds.updated_at DESC
+    LIMIT p_limit;
+$$;
@@ -0,0 +1,106 @@
+-- Битовая маска временных слотов в daily_status
+-- morning = 1, day = 2, evening = 4, night = 8 (как SLOT_BITS в bot/database.py)
+-- Бот пишет и читает только slot_mask, колонка time_slots заполняется триггером
+-- для веб-приложения и старых клиентов.
+
+CREATE OR REPLACE FUNCTION slot_mask_from_array(p_slots TEXT[])
+RETURNS SMALLINT
+LANGUAGE sql IMMUTABLE
+AS $$
+    SELECT (
+        CASE WHEN 'morning' = ANY(p_slots) THEN 1 ELSE 0 END
+      | CASE WHEN 'day' = ANY(p_slots) THEN 2 ELSE 0 END
+      | CASE WHEN 'evening' = ANY(p_slots) THEN 4 ELSE 0 END
+      | CASE WHEN 'night' = ANY(p_slots) THEN 8 ELSE 0 END
+    )::SMALLINT;
+$$;
+
+CREATE OR REPLACE FUNCTION slot_array_from_mask(p_mask SMALLINT)
+RETURNS TEXT[]
+LANGUAGE sql IMMUTABLE
+AS $$
+    SELECT ARRAY(
+        SELECT slot
+        FROM unnest(ARRAY['morning', 'day', 'evening', 'night']) WITH ORDINALITY AS s(slot, n)
+        WHERE p_mask & (1 << (n - 1)::INT) <> 0
+        ORDER BY n
+    );
+$$;
+
+ALTER TABLE daily_status ADD COLUMN IF NOT EXISTS slot_mask SMALLINT NOT NULL DEFAULT 0;
+
+-- Перенос существующих строк
+UPDATE daily_status
+SET slot_mask = slot_mask_from_array(time_slots)
+WHERE slot_mask = 0 AND cardinality(time_slots) > 0;
+
+-- Синхронизация колонок: источник истины - та колонка, которую изменили.
+-- Старые клиенты пишут только time_slots, бот - только slot_mask
+CREATE OR REPLACE FUNCTION daily_status_sync_slots()
+RETURNS TRIGGER
+LANGUAGE plpgsql
+AS $$
+BEGIN
+    IF TG_OP = 'UPDATE' AND NEW.slot_mask IS DISTINCT FROM OLD.slot_mask THEN
+        NEW.time_slots := slot_array_from_mask(NEW.slot_mask);
+    ELSIF TG_OP = 'UPDATE' AND NEW.time_slots IS DISTINCT FROM OLD.time_slots THEN
+        NEW.slot_mask := slot_mask_from_array(NEW.time_slots);
+    ELSIF TG_OP = 'INSERT' AND NEW.slot_mask = 0 THEN
+        NEW.slot_mask := slot_mask_from_array(NEW.time_slots);
+    ELSE
+        NEW.time_slots := slot_array_from_mask(NEW.slot_mask);
+    END IF;
+    RETURN NEW;
+END;
+$$;
+
+DROP TRIGGER IF EXISTS daily_status_sync_slots ON daily_status;
+CREATE TRIGGER daily_status_sync_slots
+    BEFORE INSERT OR UPDATE ON daily_status
+    FOR EACH ROW EXECUTE FUNCTION daily_status_sync_slots();
+
+-- match_teammates теперь принимает и возвращает маску
+DROP FUNCTION IF EXISTS match_teammates(DATE, TEXT[], BIGINT, TEXT, TEXT[], INT);
+
+CREATE OR REPLACE FUNCTION match_teammates(
+    p_date DATE,
+    p_slot_mask INT,
+    p_exclude_id BIGINT DEFAULT NULL,
+    p_rank TEXT DEFAULT NULL,
+    p_roles TEXT[] DEFAULT '{}',
+    p_limit INT DEFAULT 10
+)
+RETURNS TABLE (
+    telegram_id BIGINT,
+    telegram_username TEXT,
+    telegram_first_name TEXT,
+    valorant_nick TEXT,
+    rank TEXT,
+    roles TEXT[],
+    slot_mask SMALLINT
+)
+LANGUAGE sql STABLE
+AS $$
+    SELECT p.telegram_id, p.telegram_username, p.telegram_first_name,
+           p.valorant_nick, p.rank, p.roles, ds.slot_mask
+    FROM daily_status ds
+    JOIN players p ON p.telegram_id = ds.telegram_id
+    WHERE ds.date = p_date
+      AND ds.is_playing
+      AND ds.slot_mask & p_slot_mask <> 0
+      AND (p_exclude_id IS NULL OR ds.telegram_id <> p_exclude_id)
+    ORDER BY
+        -- Разница в рангах (если ранг неизвестен - не учитываем)
+        COALESCE(ABS(
+            array_position(ARRAY['Железо', 'Бронза', 'Серебро', 'Золото',
+                                 'Платина', 'Алмаз', 'Бессмертный', 'Сияющий'], p.rank)
+          - array_position(ARRAY['Железо', 'Бронза', 'Серебро', 'Золото',
+                                 'Платина', 'Алмаз', 'Бессмертный', 'Сияющий'], p_rank)
+        ), 0),
+        -- Сколько ролей закрывает тиммейт, которых нет у игрока
+        cardinality(ARRAY(SELECT unnest(p.roles) EXCEPT SELECT unnest(p_roles))) DESC,
+        -- Сколько общих слотов
+        bit_count((ds.slot_mask & p_slot_mask)::INT::BIT(4)) DESC,
+        ds.updated_at DESC
+    LIMIT p_limit;
+$$;
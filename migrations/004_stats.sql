@@ -0,0 +1,22 @@
+-- Статистика для шапки дашборда одним запросом:
+-- всего игроков, играющих сегодня и разбивка по временным слотам.
+-- Возвращает только числа, объём ответа не зависит от количества игроков.
+-- Вызывается из api/index.py (_handle_stats)
+
+CREATE OR REPLACE FUNCTION team_finder_stats(p_date DATE)
+RETURNS JSON
+LANGUAGE sql STABLE
+AS $$
+    SELECT json_build_object(
+        'total_players', (SELECT count(*) FROM players),
+        'playing_today', count(*),
+        'slots', json_build_object(
+            'morning', count(*) FILTER (WHERE slot_mask & 1 <> 0),
+            'day', count(*) FILTER (WHERE slot_mask & 2 <> 0),
+            'evening', count(*) FILTER (WHERE slot_mask & 4 <> 0),
+            'night', count(*) FILTER (WHERE slot_mask & 8 <> 0)
+        )
+    )
+    FROM daily_status
+    WHERE date = p_date AND is_playing;
+$$;
@@ -0,0 +1,10 @@
+-- Состояние диалогов бота (user_data и ConversationHandler)
+-- Используется при PERSISTENCE=postgres, см. bot/persistence.py
+
+CREATE TABLE IF NOT EXISTS bot_state (
+    kind TEXT NOT NULL,
+    key TEXT NOT NULL,
+    value JSONB NOT NULL,
+    updated_at TIMESTAMP DEFAULT NOW(),
+    PRIMARY KEY (kind, key)
+);
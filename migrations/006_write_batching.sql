@@ -0,0 +1,68 @@
+-- Пакетная запись и подтверждение слотов за один запрос
+-- Используется bot/database.py: flush_writes и confirm_daily_slots
+
+-- Изменения профилей из буфера отложенных записей одним запросом.
+-- p_changes: [{"telegram_id": 1, "rank": "Золото"}, {"telegram_id": 2, "roles": [...]}, ...]
+-- Меняются только колонки, которые есть в объекте
+CREATE OR REPLACE FUNCTION apply_player_changes(p_changes JSONB)
+RETURNS INT
+LANGUAGE sql
+AS $$
+    WITH changes AS (
+        SELECT value AS c FROM jsonb_array_elements(p_changes)
+    ), updated AS (
+        UPDATE players p SET
+            valorant_nick = CASE WHEN c ? 'valorant_nick' THEN c->>'valorant_nick' ELSE p.valorant_nick END,
+            rank = CASE WHEN c ? 'rank' THEN c->>'rank' ELSE p.rank END,
+            roles = CASE WHEN c ? 'roles'
+                         THEN ARRAY(SELECT jsonb_array_elements_text(c->'roles'))
+                         ELSE p.roles END,
+            telegram_username = CASE WHEN c ? 'telegram_username' THEN c->>'telegram_username' ELSE p.telegram_username END,
+            telegram_first_name = CASE WHEN c ? 'telegram_first_name' THEN c->>'telegram_first_name' ELSE p.telegram_first_name END,
+            updated_at = NOW()
+        FROM changes
+        WHERE p.telegram_id = (c->>'telegram_id')::BIGINT
+        RETURNING 1
+    )
+    SELECT count(*)::INT FROM updated;
+$$;
+
+-- Записать статус "играю в слоты p_slot_mask" и вернуть тиммейтов
+-- (то же, что match_teammates, ранг и роли берутся из профиля игрока)
+CREATE OR REPLACE FUNCTION confirm_slots_and_match(
+    p_telegram_id BIGINT,
+    p_date DATE,
+    p_slot_mask INT,
+    p_limit INT DEFAULT 10
+)
+RETURNS TABLE (
+    telegram_id BIGINT,
+    telegram_username TEXT,
+    telegram_first_name TEXT,
+    valorant_nick TEXT,
+    rank TEXT,
+    roles TEXT[],
+    slot_mask SMALLINT
+)
+LANGUAGE plpgsql
+AS $$
+#variable_conflict use_column
+DECLARE
+    v_rank TEXT;
+    v_roles TEXT[];
+BEGIN
+    INSERT INTO daily_status (telegram_id, date, is_playing, slot_mask, updated_at)
+    VALUES (p_telegram_id, p_date, TRUE, p_slot_mask, NOW())
+    ON CONFLICT (telegram_id, date) DO UPDATE
+        SET is_playing = TRUE,
+            slot_mask = EXCLUDED.slot_mask,
+            updated_at = EXCLUDED.updated_at;
+
+    SELECT p.rank, p.roles INTO v_rank, v_roles
+    FROM players p
+    WHERE p.telegram_id = p_telegram_id;
+
+    RETURN QUERY
+    SELECT * FROM match_teammates(p_date, p_slot_mask, p_telegram_id, v_rank, COALESCE(v_roles, '{}'), p_limit);
+END;
+$$;
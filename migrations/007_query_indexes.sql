@@ -0,0 +1,41 @@
+-- Индексы под запросы, которые реально выполняют бот и API
+-- Планы запросов: python bench/bench_query_plans.py
+-- migrate: no-transaction
+--
+-- CREATE INDEX CONCURRENTLY не блокирует записи в daily_status на время
+-- построения, но не выполняется внутри транзакции: migrate.py выполняет этот
+-- файл по одной команде (см. строку выше), в SQL Editor - тоже по одной.
+-- Если построение прервалось, индекс остаётся INVALID: удалите его
+-- (DROP INDEX CONCURRENTLY ...) и запустите миграцию снова.
+--
+-- Почти все запросы к daily_status идут за одну дату и только по играющим:
+--   date = ? AND is_playing [AND telegram_id > ? ORDER BY telegram_id LIMIT n]
+--     - database.iter_players_playing (индекс слотов бота), api _fetch_players_page
+--   date = ? AND is_playing AND time_slots @> '{slot}'
+--     - api /api/players?timeslot=, _count_stats, запасные запросы бота
+--   date = ? AND is_playing AND slot_mask & ? <> 0
+--     - match_teammates, team_finder_stats
+--   date = ? AND updated_at > ? ORDER BY updated_at
+--     - живая лента api/live.py (опрос каждые LIVE_POLL_SECONDS)
+-- Поиск по (telegram_id, date) идёт по первичному ключу.
+--
+-- Отдельного индекса по слотам нет: за одну дату играющих немного, и фильтр
+-- по time_slots / slot_mask дешевле проверить на строках из индекса по дате
+-- (GIN по time_slots ни в одном плане bench_query_plans.py не выбирался).
+
+-- Играющие за дату в порядке telegram_id: постраничная выборка читает
+-- ровно одну страницу индекса без сортировки. Неиграющие в индекс не попадают
+CREATE INDEX CONCURRENTLY IF NOT EXISTS idx_daily_status_playing_by_id
+    ON daily_status (date, telegram_id)
+    WHERE is_playing;
+
+-- Изменения за дату по времени: курсор живой ленты
+CREATE INDEX CONCURRENTLY IF NOT EXISTS idx_daily_status_date_updated
+    ON daily_status (date, updated_at);
+
+-- Составной (date, is_playing) из 001_initial_schema.sql остаётся для
+-- подсчётов по дате; индекс по одной date дублирует его начало
+CREATE INDEX CONCURRENTLY IF NOT EXISTS idx_daily_status_playing ON daily_status (date, is_playing);
+DROP INDEX CONCURRENTLY IF EXISTS idx_daily_status_date;
+
+ANALYZE daily_status;
@@ -0,0 +1,47 @@
+-- Архив старых дней daily_status
+-- Бот и API читают только сегодняшний день, а таблица растёт на строку на
+-- игрока в день. Раз в сутки бот переносит дни старше STATUS_RETENTION_DAYS
+-- в компактную daily_status_history (database.archive_old_statuses), и
+-- daily_status с её индексами остаётся размером в несколько дней.
+
+-- Только то, что нужно для статистики: без time_slots (есть slot_mask) и updated_at
+CREATE TABLE IF NOT EXISTS daily_status_history (
+    date DATE NOT NULL,
+    telegram_id BIGINT NOT NULL REFERENCES players(telegram_id) ON DELETE CASCADE,
+    is_playing BOOLEAN NOT NULL,
+    slot_mask SMALLINT NOT NULL DEFAULT 0,
+    PRIMARY KEY (date, telegram_id)
+);
+
+-- Для ON DELETE CASCADE при удалении игрока
+CREATE INDEX IF NOT EXISTS idx_daily_status_history_player ON daily_status_history (telegram_id);
+
+-- Перенести до p_batch строк с датой раньше p_before; возвращает число
+-- перенесённых строк (меньше p_batch - старых строк больше нет).
+-- Пачками, чтобы один вызов не держал блокировки и не раздувал WAL
+CREATE OR REPLACE FUNCTION archive_daily_status(p_before DATE, p_batch INT DEFAULT 10000)
+RETURNS INT
+LANGUAGE sql
+AS $$
+    WITH batch AS (
+        SELECT telegram_id, date
+        FROM daily_status
+        WHERE date < p_before
+        ORDER BY date
+        LIMIT p_batch
+        FOR UPDATE SKIP LOCKED
+    ), moved AS (
+        DELETE FROM daily_status ds
+        USING batch
+        WHERE ds.telegram_id = batch.telegram_id AND ds.date = batch.date
+        RETURNING ds.date, ds.telegram_id, ds.is_playing, ds.slot_mask
+    ), archived AS (
+        INSERT INTO daily_status_history (date, telegram_id, is_playing, slot_mask)
+        SELECT date, telegram_id, is_playing, slot_mask FROM moved
+        ON CONFLICT (date, telegram_id) DO UPDATE
+            SET is_playing = EXCLUDED.is_playing,
+                slot_mask = EXCLUDED.slot_mask
+        RETURNING 1
+    )
+    SELECT count(*)::INT FROM archived;
+$$;
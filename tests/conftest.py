@@ -0,0 +1,14 @@
+"""
+Модули бота импортируют друг друга по имени (как при запуске из bot/);
+bench/fake_supabase.py - база в памяти вместо Supabase. Фиктивные
+SUPABASE_URL/SUPABASE_KEY нужны, чтобы api/index.py считал базу настроенной
+(клиент тесты подставляют сами)
+"""
+import os
+import sys
+
+ROOT = os.path.dirname(os.path.dirname(os.path.abspath(__file__)))
+sys.path[:0] = [os.path.join(ROOT, 'bot'), os.path.join(ROOT, 'api'), os.path.join(ROOT, 'bench')]
+
+os.environ.setdefault('SUPABASE_URL', 'http://tests.invalid')
+os.environ.setdefault('SUPABASE_KEY', 'tests-key')
@@ -0,0 +1,56 @@
+"""API веб-приложения: кэш ответов, ETag и 304"""
+import io
+from datetime import datetime
+from email.message import Message
+
+import pytest
+
+import index as api
+from fake_supabase import FakeClient, seed
+
+
+def call(path, headers=None):
+    """GET через api.handler без сервера; возвращает (статус, заголовки, тело)"""
+    request = api.handler.__new__(api.handler)
+    request.path = path
+    request.command = 'GET'
+    request.request_version = 'HTTP/1.1'
+    request.requestline = f'GET {path}'
+    request.client_address = ('tests', 0)
+    request.headers = Message()
+    for name, value in (headers or {}).items():
+        request.headers[name] = value
+    request.wfile = io.BytesIO()
+    request.log_message = lambda *args: None
+    request.do_GET()
+    head, _, body = request.wfile.getvalue().partition(b'\r\n\r\n')
+    fields = dict(line.split(': ', 1) for line in head.decode().split('\r\n')[1:])
+    return request._status, fields, body
+
+
+@pytest.fixture
+def client(monkeypatch):
+    client = seed(FakeClient(), 50, datetime.now().date().isoformat())
+    monkeypatch.setattr(api, 'supabase_client', client)
+    monkeypatch.setattr(api, '_response_cache', {})
+    return client
+
+
+def test_repeated_request_is_served_from_cache_with_etag(client):
+    status, headers, body = call('/api/players/today?limit=10')
+    assert status == 200 and headers['ETag']
+    trips = client.round_trips
+
+    status, again, cached_body = call('/api/players/today?limit=10')
+    assert (status, again['ETag'], cached_body) == (200, headers['ETag'], body)
+    assert client.round_trips == trips
+
+
+def test_matching_if_none_match_gets_304_without_body(client):
+    _, headers, _ = call('/api/stats')
+
+    status, not_modified, body = call('/api/stats', {'If-None-Match': headers['ETag']})
+    assert (status, not_modified['ETag'], body) == (304, headers['ETag'], b'')
+
+    status, _, body = call('/api/stats', {'If-None-Match': '"stale"'})
+    assert status == 200 and body
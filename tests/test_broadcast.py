@@ -0,0 +1,51 @@
+"""Рассылка: ошибка одного получателя не останавливает остальных"""
+import asyncio
+
+import pytest
+
+pytest.importorskip('telegram')
+
+from telegram.error import RetryAfter, Forbidden, BadRequest, TimedOut, NetworkError  # noqa: E402
+
+from broadcast import Broadcaster, BroadcastProgress  # noqa: E402
+
+# telegram_id -> ошибки, которые бот выбросит при первых попытках
+ERRORS = {
+    1: [Forbidden('bot was blocked by the user')],
+    2: [BadRequest('chat not found')],
+    3: [TimedOut()],
+    4: [NetworkError('connection reset')],
+    5: [RetryAfter(0)],
+    6: [RuntimeError('unexpected')],
+}
+PLAYERS = [{'telegram_id': telegram_id} for telegram_id in range(1, 10)]
+
+
+class FakeBot:
+    def __init__(self):
+        self.calls = {}
+        self.errors = {telegram_id: list(errors) for telegram_id, errors in ERRORS.items()}
+
+    async def send_message(self, chat_id, text):
+        self.calls[chat_id] = self.calls.get(chat_id, 0) + 1
+        if self.errors.get(chat_id):
+            raise self.errors[chat_id].pop(0)
+
+
+def test_every_error_class_is_counted_and_the_run_completes(tmp_path):
+    async def fetch_page(after_id, limit):
+        return [player for player in PLAYERS if player['telegram_id'] > after_id][:limit]
+
+    bot = FakeBot()
+    progress = BroadcastProgress(str(tmp_path / 'state.json'))
+    broadcaster = Broadcaster(bot, fetch_page, rate=1000, page_size=4,
+                              per_chat_interval=0, progress=progress)
+
+    stats = asyncio.run(broadcaster.run('job', lambda player: {'text': 'hi'}))
+
+    assert stats.completed and stats.pages == 3
+    assert (stats.sent, stats.blocked, stats.failed, stats.unknown) == (5, 1, 2, 1)
+    # NetworkError и RetryAfter повторяются, таймаут - нет: сообщение могло дойти
+    assert stats.retries == 2
+    assert (bot.calls[3], bot.calls[4], bot.calls[5]) == (1, 2, 2)
+    assert BroadcastProgress(str(tmp_path / 'state.json')).get('job') == {'last_id': 9, 'done': True}
@@ -0,0 +1,101 @@
+"""Живая лента /api/live: с какого курсора начинается поток"""
+import io
+import json
+from datetime import datetime
+from email.message import Message
+
+import pytest
+
+import index as api
+import live
+from fake_supabase import FakeClient, SLOT_BITS
+
+TODAY = datetime.now().date().isoformat()
+
+
+def at(clock):
+    return f'{TODAY}T{clock}'
+
+
+@pytest.fixture
+def client(monkeypatch):
+    client = FakeClient()
+    for telegram_id in (1, 2, 3):
+        client.upsert_row('players', {'telegram_id': telegram_id, 'telegram_username': f'user{telegram_id}',
+                                      'valorant_nick': f'Agent#{telegram_id}', 'rank': 'Золото',
+                                      'roles': ['duelist']})
+    monkeypatch.setattr(api, 'supabase_client', client)
+    monkeypatch.setattr(api, '_response_cache', {})
+    monkeypatch.setattr(live, '_feed', live.ChangeFeed())
+    return client
+
+
+def play(client, telegram_id, clock):
+    client.upsert_row('daily_status', {'telegram_id': telegram_id, 'date': TODAY, 'is_playing': True,
+                                       'slot_mask': SLOT_BITS['evening'], 'updated_at': at(clock)})
+
+
+def stream(path='/api/live', last_event_id=None):
+    """Один проход цикла stream_roster; возвращает [(событие, данные)]"""
+    request = live.handler.__new__(live.handler)
+    request.path = path
+    request.request_version = 'HTTP/1.1'
+    request.requestline = f'GET {path}'
+    request.headers = Message()
+    if last_event_id is not None:
+        request.headers['Last-Event-ID'] = last_event_id
+    request.wfile = io.BytesIO()
+    request.log_message = lambda *args: None
+    live.stream_roster(request, 0)
+
+    events = []
+    for block in request.wfile.getvalue().decode().split('\n\n'):
+        fields = dict(line.split(': ', 1) for line in block.splitlines() if ': ' in line)
+        if 'event' in fields:
+            events.append((fields['event'], json.loads(fields['data'])))
+    return events
+
+
+def joined(events):
+    return {data['telegram_id'] for event, data in events if event == 'join'}
+
+
+def snapshot_cursor():
+    request = api.handler.__new__(api.handler)
+    request.path = '/api/players/today?limit=10'
+    request.request_version = 'HTTP/1.1'
+    request.requestline = f'GET {request.path}'
+    request.client_address = ('tests', 0)
+    request.headers = Message()
+    request.wfile = io.BytesIO()
+    request.log_message = lambda *args: None
+    request.do_GET()
+    return json.loads(request.wfile.getvalue().partition(b'\r\n\r\n')[2])['live_cursor']
+
+
+def test_stream_starts_at_snapshot_cursor(client):
+    play(client, 1, '12:00:00')
+    cursor = snapshot_cursor()
+    assert cursor == at('12:00:00')
+
+    # Изменения между снимком (мог прийти из кэша) и открытием потока
+    play(client, 2, '12:00:30')
+    play(client, 3, '12:01:00')
+
+    assert joined(stream(f'/api/live?since={cursor}')) >= {2, 3}
+    # Без курсора снимка поток начался бы с последнего изменения и пропустил игрока 2
+    assert 2 not in joined(stream())
+
+
+def test_malformed_last_event_id_falls_back_to_latest(client):
+    play(client, 1, '12:00:00')
+    assert joined(stream(last_event_id='not a timestamp')) == {1}
+    assert joined(stream('/api/live?since=2026-13-45')) == {1}
+
+
+def test_database_error_ends_stream_with_error_event(client, monkeypatch):
+    def broken(today, since):
+        raise ConnectionError('database is down')
+
+    monkeypatch.setattr(live, '_fetch_changes', broken)
+    assert stream() == [('error', {'error': 'database is down'})]
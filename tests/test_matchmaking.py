@@ -0,0 +1,23 @@
+"""Сборка команд: недостающие роли добираются по дефициту среди свободных игроков"""
+import matchmaking
+
+RANKS = ['Золото']
+POOL = ['duelist', 'controller', 'duelist', 'sentinel', 'sentinel', 'controller', 'sentinel',
+        'sentinel', 'duelist', 'initiator', 'duelist+initiator', 'initiator']
+
+
+def test_role_scarcity_is_counted_over_the_remaining_pool():
+    players = [{'telegram_id': telegram_id, 'rank': 'Золото', 'roles': roles.split('+')}
+               for telegram_id, roles in enumerate(POOL)]
+
+    teams, unmatched = matchmaking.form_teams(players, RANKS)
+
+    # Первая пятёрка: якорь 0, контролёр 1, инициатор 9, страж 3, дуэлянт 2.
+    # Среди свободных дуэлянтов теперь не больше, чем инициаторов (2 и 2), и
+    # вторая пятёрка берёт дуэлянта 8, а инициатором - универсала 10. По счётчикам
+    # всего пула (дуэлянтов 4, инициаторов 3) первым добирался бы инициатор 10,
+    # а последнее место занял бы третий страж не на своей роли
+    assert [sorted(player['telegram_id'] for player in team.players) for team in teams] == \
+        [[0, 1, 2, 3, 9], [4, 5, 6, 8, 10]]
+    assert [team.off_role for team in teams] == [0, 0]
+    assert sorted(player['telegram_id'] for player in unmatched) == [7, 11]
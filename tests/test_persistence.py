@@ -0,0 +1,65 @@
+"""Хранение user_data: изменения вложенных списков тоже сохраняются"""
+import asyncio
+
+import pytest
+
+pytest.importorskip('telegram')
+from persistence import SQLitePersistence  # noqa: E402
+
+
+def _reloaded_user_data(path):
+    return asyncio.run(SQLitePersistence(path).get_user_data())
+
+
+def test_nested_list_changed_in_place_is_saved(tmp_path):
+    path = str(tmp_path / 'state.sqlite3')
+
+    async def scenario():
+        persistence = SQLitePersistence(path)
+        user_data = {'selected_slots': ['morning']}
+        await persistence.update_user_data(1, user_data)
+        await persistence.flush()
+        # Как toggle_slot: список меняется на месте, словарь тот же
+        user_data['selected_slots'].append('evening')
+        await persistence.update_user_data(1, user_data)
+        await persistence.flush()
+
+    asyncio.run(scenario())
+    assert _reloaded_user_data(path)[1] == {'selected_slots': ['morning', 'evening']}
+
+
+def test_user_data_from_get_is_not_shared_with_store(tmp_path):
+    path = str(tmp_path / 'state.sqlite3')
+
+    async def scenario():
+        persistence = SQLitePersistence(path)
+        await persistence.update_user_data(1, {'roles': ['duelist']})
+        await persistence.flush()
+        # PTB берёт user_data из get_user_data и дальше меняет его сам
+        user_data = (await persistence.get_user_data())[1]
+        user_data['roles'].remove('duelist')
+        user_data['roles'].append('sentinel')
+        await persistence.update_user_data(1, user_data)
+        await persistence.flush()
+
+    asyncio.run(scenario())
+    assert _reloaded_user_data(path)[1] == {'roles': ['sentinel']}
+
+
+def test_pinned_update_rereads_user_data_of_other_workers_user(tmp_path):
+    path = str(tmp_path / 'state.sqlite3')
+
+    async def scenario():
+        owner = SQLitePersistence(path)
+        # Воркер 0 получает этого пользователя только кнопками lobby_*
+        pinned = SQLitePersistence(path, owns_user=lambda user_id: False)
+        await owner.update_user_data(1, {'selected_slots': ['morning']})
+        await owner.flush()
+        user_data = (await pinned.get_user_data())[1]
+
+        await owner.update_user_data(1, {'selected_slots': ['evening'], 'editing': 'rank'})
+        await owner.flush()
+        await pinned.refresh_user_data(1, user_data)
+        return user_data
+
+    assert asyncio.run(scenario()) == {'selected_slots': ['evening'], 'editing': 'rank'}
@@ -0,0 +1,46 @@
+"""Правка сообщения по нажатию: сообщения может не быть"""
+import asyncio
+from types import SimpleNamespace
+
+import pytest
+
+pytest.importorskip('telegram')
+
+from telegram import Chat, InaccessibleMessage  # noqa: E402
+
+from render import MessageRenderer  # noqa: E402
+
+USER_ID = 1000
+
+
+class FakeQuery:
+    def __init__(self, message):
+        self.message = message
+        self.from_user = SimpleNamespace(id=USER_ID)
+        self.calls = []
+
+    async def answer(self):
+        self.calls.append('answer')
+
+    async def edit_message_text(self, *args, **kwargs):
+        self.calls.append('edit')
+
+    def get_bot(self):
+        return self
+
+    async def send_message(self, chat_id, text, **kwargs):
+        self.calls.append(('send', chat_id, text))
+        return SimpleNamespace(chat_id=chat_id, message_id=1)
+
+
+@pytest.mark.parametrize('message, chat_id', [
+    (None, USER_ID),  # кнопка из inline-режима
+    (InaccessibleMessage(chat=Chat(42, Chat.PRIVATE), message_id=7), 42),  # сообщение старше 48 часов
+])
+def test_unavailable_message_is_answered_and_sent_anew(message, chat_id):
+    renderer = MessageRenderer()
+    query = FakeQuery(message)
+
+    assert asyncio.run(renderer.edit(query, 'Меню', answer=True))
+    assert sorted(query.calls, key=str) == [('send', chat_id, 'Меню'), 'answer']
+    assert renderer.stats()['sent_instead'] == 1
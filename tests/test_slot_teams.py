@@ -0,0 +1,70 @@
+"""Команды слота пересобираются только после изменения его состава"""
+from datetime import datetime
+
+import pytest
+
+import database
+import matchmaking
+from slot_index import SlotIndex
+from fake_supabase import FakeClient, seed
+
+DATE = '2026-10-17'
+
+
+@pytest.fixture
+def calls(monkeypatch):
+    # Состояние модуля database общее для всех тестов - подменяем и возвращаем
+    database.set_client(seed(FakeClient(), 200, DATE, playing_share=1))
+    monkeypatch.setattr(database, '_write_buffer', database.WriteBuffer())
+    monkeypatch.setattr(database, '_slot_index', SlotIndex())
+    monkeypatch.setattr(database, '_slot_teams', {})
+    database._player_cache.clear()
+
+    calls = []
+    form_teams = matchmaking.form_teams
+
+    def counting(players, *args):
+        calls.append(len(players))
+        return form_teams(players, *args)
+
+    monkeypatch.setattr(matchmaking, 'form_teams', counting)
+    yield calls
+    database.set_client(None)
+    database._player_cache.clear()
+
+
+def test_teams_are_reused_until_slot_changes(calls):
+    teams, _ = database.get_slot_teams(DATE, 'evening')
+    member = teams[0].players[0]
+    assert database.find_team(member['telegram_id'], DATE, ['evening'])[1] is teams[0]
+    assert len(calls) == 1
+
+    # Повторная отметка тех же слотов состав не меняет
+    database.queue_daily_status(member['telegram_id'], DATE, True, member['time_slots'])
+    database.get_slot_teams(DATE, 'evening')
+    assert len(calls) == 1
+
+    database.queue_daily_status(member['telegram_id'], DATE, False, [])
+    teams, _ = database.get_slot_teams(DATE, 'evening')
+    assert len(calls) == 2
+    assert matchmaking.find_team(teams, member['telegram_id']) is None
+
+
+def test_status_written_by_another_worker_reaches_the_index(calls, monkeypatch):
+    monkeypatch.setattr(database, 'SLOT_INDEX_SYNC_SECONDS', 1e-6)
+    teams, _ = database.get_slot_teams(DATE, 'evening')
+    leaving, staying = teams[0].players[0], teams[0].players[1]
+
+    # Свой статус ещё в буфере - он новее того, что в базе
+    database.queue_daily_status(staying['telegram_id'], DATE, True, staying['time_slots'])
+    # Другой воркер записал в базу "сегодня не играю" - своему индексу он не сообщает
+    client = database.get_client()
+    for player in (leaving, staying):
+        client.upsert_row('daily_status', {'telegram_id': player['telegram_id'], 'date': DATE,
+                                           'is_playing': False, 'slot_mask': 0,
+                                           'updated_at': datetime.now().isoformat()})
+
+    teams, _ = database.get_slot_teams(DATE, 'evening')
+    assert len(calls) == 2
+    assert matchmaking.find_team(teams, leaving['telegram_id']) is None
+    assert database._slot_index.player(DATE, staying['telegram_id']) is not None
@@ -0,0 +1,112 @@
+"""Отложенная запись: отклонённые базой строки не блокируют буфер"""
+import pytest
+
+import database
+import resilience
+from slot_index import SlotIndex
+from fake_supabase import FakeClient, FakeAPIError, seed
+
+DATE = '2026-10-17'
+PLAYER, OTHER, DELETED = 1000, 1001, 999
+
+
+@pytest.fixture
+def client(monkeypatch):
+    client = seed(FakeClient(), 5, DATE, playing_share=0)
+    database.set_client(client)
+    monkeypatch.setattr(database, '_write_buffer', database.WriteBuffer())
+    monkeypatch.setattr(database, '_slot_index', SlotIndex())
+    monkeypatch.setattr(database, '_breaker', resilience.CircuitBreaker(1000, 0))
+    database._player_cache.clear()
+    yield client
+    database.set_client(None)
+    database._player_cache.clear()
+
+
+def _status(client, telegram_id):
+    return client.tables['daily_status'].get((telegram_id, DATE))
+
+
+def test_rejected_row_is_dropped_and_others_are_written(client):
+    database.queue_daily_status(PLAYER, DATE, True, ['evening'])
+    # Игрок удалён между take() и записью: строка нарушает внешний ключ
+    database.queue_daily_status(DELETED, DATE, True, ['night'])
+
+    assert database.flush_writes()
+    assert _status(client, PLAYER)['slot_mask'] == database.SLOT_BITS['evening']
+    assert _status(client, DELETED) is None
+    stats = database.get_write_buffer_stats()
+    assert (stats['pending_status'], stats['flushed'], stats['dropped']) == (0, 1, 1)
+    # Пользователю, который уже видел "сохранено", бот сообщит о потере
+    assert database.take_dropped_writes() == [(DELETED, 'status')]
+    assert database.take_dropped_writes() == []
+
+    # Следующие сбросы не спотыкаются о ту же строку
+    database.queue_daily_status(OTHER, DATE, True, ['day'])
+    assert database.flush_writes()
+    assert _status(client, OTHER) is not None
+
+
+def test_rows_are_kept_while_database_is_unavailable(client):
+    database.queue_daily_status(PLAYER, DATE, True, ['evening'])
+    client.down = True
+    assert not database.flush_writes()
+    assert database.get_write_buffer_stats()['pending_status'] == 1
+
+    client.down = False
+    assert database.flush_writes()
+    assert _status(client, PLAYER) is not None
+
+
+def test_confirm_writes_only_own_row(client):
+    assert database._ensure_day_indexed(DATE)
+    database.get_player(OTHER)  # обработчик загружает профиль до отметки
+    database.queue_daily_status(OTHER, DATE, True, ['evening'])
+
+    teammates = database.confirm_daily_slots(PLAYER, DATE, ['evening'])
+
+    assert [player['telegram_id'] for player in teammates] == [OTHER]
+    assert _status(client, PLAYER) is not None
+    # Чужие отложенные статусы остаются в буфере до flush_writes
+    assert _status(client, OTHER) is None
+    assert database.get_write_buffer_stats()['pending_status'] == 1
+
+
+def test_rejected_profile_change_is_reported_and_uncached(client, monkeypatch):
+    client.rpc_functions.pop('apply_player_changes')
+    database.get_player(PLAYER)
+    database.queue_player_fields(PLAYER, rank='Сияющий')
+    assert database.get_player(PLAYER)['rank'] == 'Сияющий'
+
+    def rejected(telegram_id, changes):
+        raise FakeAPIError('new row violates check constraint "players_rank_check"', code='23514')
+
+    monkeypatch.setattr(database, '_patch_player', rejected)
+    assert database.flush_writes()
+
+    assert database.take_dropped_writes() == [(PLAYER, 'profile')]
+    # Кэш больше не показывает несохранённый ранг
+    assert database.get_player(PLAYER)['rank'] == client.tables['players'][(PLAYER,)]['rank'] != 'Сияющий'
+
+
+def test_update_player_fields_is_one_patch(client):
+    trips = client.round_trips
+    assert database.update_player_fields(PLAYER, valorant_nick='Renamed#1')
+    assert client.round_trips == trips + 1
+    assert client.tables['players'][(PLAYER,)]['valorant_nick'] == 'Renamed#1'
+    assert database.get_player(PLAYER)['valorant_nick'] == 'Renamed#1'
+    assert client.round_trips == trips + 1
+
+    assert not database.update_player_fields(DELETED, rank='Золото')
+
+
+def test_flush_without_rpc_goes_through_update_player_patch(client):
+    client.rpc_functions.pop('apply_player_changes')
+    database.queue_player_fields(PLAYER, rank='Алмаз')
+    database.queue_player_fields(DELETED, rank='Алмаз')
+
+    assert database.flush_writes()
+    assert client.tables['players'][(PLAYER,)]['rank'] == 'Алмаз'
+    # Удалённому игроку сообщать некому
+    assert database.take_dropped_writes() == []
+    assert database.get_write_buffer_stats()['dropped'] == 1